@@ -0,0 +1 @@
+"""Benchmarks for pfmsoft.aiohttp_queue. Run the modules with ``python -m benchmarks.<name>``."""
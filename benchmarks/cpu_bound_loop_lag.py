@@ -0,0 +1,66 @@
+"""Event loop lag while SaveResultToYamlFile dumps a large result.
+
+Usage::
+
+    python -m benchmarks.cpu_bound_loop_lag --rows 20000
+
+Compares dumping the YAML inline on the event loop, in a thread pool, and in a
+process pool. yaml.dump is pure Python and holds the GIL, so only the process
+pool keeps the loop responsive.
+"""
+import argparse
+import asyncio
+import tempfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from benchmarks.csv_loop_lag import measure
+from benchmarks.json_codecs import market_history
+
+from pfmsoft.aiohttp_queue import AiohttpAction, AiohttpRequest
+from pfmsoft.aiohttp_queue.callbacks import SaveResultToYamlFile
+
+
+async def run(row_count: int, directory: Path) -> List[Dict[str, Any]]:
+    action = AiohttpAction(AiohttpRequest(method="get", url="http://localhost"))
+    action.response_data = market_history(row_count)
+    executors: Dict[str, Optional[Executor]] = {
+        "inline": None,
+        "thread": ThreadPoolExecutor(max_workers=1),
+        "process": ProcessPoolExecutor(max_workers=1),
+    }
+    results = []
+    try:
+        for name, executor in executors.items():
+            callback = SaveResultToYamlFile(
+                file_path=directory / f"{name}.yaml", executor=executor
+            )
+            results.append(await measure(name, callback.do_callback(action)))
+    finally:
+        for executor in executors.values():
+            if executor is not None:
+                executor.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        results = asyncio.run(run(args.rows, Path(directory)))
+    print(
+        f"{'dump':<10}{'seconds':>10}"
+        f"{'lag p50 ms':>12}{'lag p99 ms':>12}{'lag max ms':>12}"
+    )
+    for result in results:
+        print(
+            f"{result['name']:<10}{result['seconds']:>10.2f}"
+            f"{result['p50'] * 1000:>12.1f}{result['p99'] * 1000:>12.1f}"
+            f"{result['max'] * 1000:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
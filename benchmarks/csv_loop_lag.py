@@ -0,0 +1,81 @@
+"""Event loop lag while SaveListOfDictResultToCSVFile writes a large file.
+
+Usage::
+
+    python -m benchmarks.csv_loop_lag --rows 200000
+
+Compares writing the rows inline on the event loop, the way the callback used to,
+with the callback writing in the executor. A LoopLagMonitor samples the loop
+while each write runs, standing in for the other in-flight requests.
+"""
+import argparse
+import asyncio
+import csv
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Dict, List
+
+from benchmarks.json_codecs import market_history
+
+from pfmsoft.aiohttp_queue import AiohttpAction, AiohttpRequest
+from pfmsoft.aiohttp_queue.callbacks import SaveListOfDictResultToCSVFile
+from pfmsoft.aiohttp_queue.profiling import LoopLagMonitor
+
+
+def inline_write(file_path: Path, rows: List[Dict[str, Any]]):
+    """The old behaviour, a blocking write on the event loop."""
+    with open(str(file_path), mode="w") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+async def measure(name: str, coro) -> Dict[str, Any]:
+    start = perf_counter()
+    async with LoopLagMonitor(interval=0.005) as monitor:
+        # Let the monitor take a first sample before the write starts.
+        await asyncio.sleep(0.01)
+        await coro
+        # And record the sample that was due during the write.
+        await asyncio.sleep(0.01)
+    summary = monitor.summary()
+    return {"name": name, "seconds": perf_counter() - start, **summary}
+
+
+async def run(row_count: int, directory: Path) -> List[Dict[str, Any]]:
+    rows = market_history(row_count)
+
+    async def inline():
+        inline_write(directory / "inline.csv", rows)
+
+    action = AiohttpAction(AiohttpRequest(method="get", url="http://localhost"))
+    action.response_data = rows
+    callback = SaveListOfDictResultToCSVFile(file_path=directory / "executor.csv")
+    return [
+        await measure("inline", inline()),
+        await measure("executor", callback.do_callback(action)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        results = asyncio.run(run(args.rows, Path(directory)))
+    print(
+        f"{'write':<10}{'seconds':>10}"
+        f"{'lag p50 ms':>12}{'lag p99 ms':>12}{'lag max ms':>12}"
+    )
+    for result in results:
+        print(
+            f"{result['name']:<10}{result['seconds']:>10.2f}"
+            f"{result['p50'] * 1000:>12.1f}{result['p99'] * 1000:>12.1f}"
+            f"{result['max'] * 1000:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""Queue runner behaviour under injected faults.
+
+Usage::
+
+    python -m benchmarks.faults --actions 500 --workers 16
+    python -m benchmarks.faults --profiles flaky-5xx resets --timeout 1
+
+Runs the queue runner against a fault injection server, once per fault profile,
+and reports:
+
+- goodput, successful actions per second.
+- succeeded, failed, and dropped, actions that raised an exception, which the
+  queue worker logs and does not retry.
+- attempts, requests the server saw, and wasted, attempts that did not produce a
+  success.
+- early, retries sooner than a Retry-After header asked for.
+- p50, p99 and max latency, from first being queued to the last attempt ending.
+
+The server is configured by a profile, a dict of the :func:`make_fault_app` args,
+with probabilities of error statuses, Retry-After responses, connection resets,
+truncated bodies and slow bodies, and exponential latency with a slow tail. It
+can also be run on its own, eg. to point other clients at it::
+
+    python -m benchmarks.faults --serve mixed --port 8080
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+from time import monotonic, time
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+from aiohttp import ClientSession, ClientTimeout, web
+from benchmarks.runner_throughput import percentile
+from benchmarks.server import BenchmarkServer, items_body, serve
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue.callbacks import ResponseContentToJson
+from pfmsoft.aiohttp_queue.events import (
+    ActionEvent,
+    EventBus,
+    EventKind,
+    EventSubscriber,
+)
+from pfmsoft.aiohttp_queue.runners import do_queue_runner
+
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "clean": {},
+    "flaky-5xx": {"error_rate": 0.1, "error_codes": [502, 503]},
+    "retry-after": {"retry_after_rate": 0.1, "retry_after": 0.2},
+    "slow-tail": {"latency_mean": 0.002, "tail_rate": 0.01, "tail_seconds": 1.0},
+    "resets": {"reset_rate": 0.05},
+    "truncated": {"truncate_rate": 0.05},
+    "slow-loris": {"slow_body_rate": 0.02, "slow_body_delay": 0.5},
+    "mixed": {
+        "error_rate": 0.05,
+        "error_codes": [500, 502, 503, 504],
+        "retry_after_rate": 0.02,
+        "reset_rate": 0.01,
+        "truncate_rate": 0.01,
+        "slow_body_rate": 0.01,
+        "latency_mean": 0.001,
+        "tail_rate": 0.005,
+        "tail_seconds": 0.5,
+    },
+}
+
+
+def make_fault_app(
+    error_rate: float = 0.0,
+    error_codes: Sequence[int] = (503,),
+    retry_after_rate: float = 0.0,
+    retry_after: float = 1.0,
+    reset_rate: float = 0.0,
+    truncate_rate: float = 0.0,
+    slow_body_rate: float = 0.0,
+    slow_body_delay: float = 0.5,
+    slow_body_chunks: int = 4,
+    latency_mean: float = 0.0,
+    tail_rate: float = 0.0,
+    tail_seconds: float = 1.0,
+    items: int = 20,
+    seed: Optional[int] = None,
+) -> web.Application:
+    """An app that answers every GET with a JSON list, unless a fault is injected.
+
+    Each rate is the probability of that fault for a request, checked in the
+    order of the args. Latency is exponential with mean `latency_mean`, and
+    `tail_rate` of the requests take an extra `tail_seconds`. Requests with an
+    `id` query arg are tracked, to count retries sooner than a Retry-After.
+    GET /fault-stats returns the counts.
+    """
+    # The injected resets are logged as handler errors.
+    logging.getLogger("aiohttp.server").setLevel(logging.CRITICAL)
+    rng = random.Random(seed)
+    body = items_body(0, items)
+    stats: Dict[str, int] = {
+        "requests": 0,
+        "ok": 0,
+        "error": 0,
+        "retry_after": 0,
+        "reset": 0,
+        "truncated": 0,
+        "slow_body": 0,
+        "tail": 0,
+        "early_retries": 0,
+    }
+    # id: the time before which the client was asked not to retry.
+    not_before: Dict[str, float] = {}
+
+    async def fault_stats_handler(request: web.Request) -> web.Response:
+        _ = request
+        return web.json_response(stats)
+
+    async def fault_handler(request: web.Request) -> web.StreamResponse:
+        stats["requests"] += 1
+        action_id = request.query.get("id")
+        if action_id is not None and action_id in not_before:
+            if monotonic() < not_before.pop(action_id):
+                stats["early_retries"] += 1
+        delay = rng.expovariate(1 / latency_mean) if latency_mean else 0.0
+        if tail_rate and rng.random() < tail_rate:
+            stats["tail"] += 1
+            delay += tail_seconds
+        if delay:
+            await asyncio.sleep(delay)
+        if error_rate and rng.random() < error_rate:
+            stats["error"] += 1
+            return web.Response(status=rng.choice(list(error_codes)))
+        if retry_after_rate and rng.random() < retry_after_rate:
+            stats["retry_after"] += 1
+            if action_id is not None:
+                not_before[action_id] = monotonic() + retry_after
+            return web.Response(status=503, headers={"Retry-After": f"{retry_after:g}"})
+        if reset_rate and rng.random() < reset_rate:
+            stats["reset"] += 1
+            assert request.transport is not None
+            request.transport.abort()
+            raise ConnectionResetError("Injected reset.")
+        response = web.StreamResponse()
+        response.content_type = "application/json"
+        response.content_length = len(body)
+        if truncate_rate and rng.random() < truncate_rate:
+            stats["truncated"] += 1
+            await response.prepare(request)
+            await response.write(body[: len(body) // 2])
+            assert request.transport is not None
+            request.transport.abort()
+            return response
+        await response.prepare(request)
+        if slow_body_rate and rng.random() < slow_body_rate:
+            stats["slow_body"] += 1
+            step = -(-len(body) // slow_body_chunks)
+            for start in range(0, len(body), step):
+                await response.write(body[start : start + step])
+                await asyncio.sleep(slow_body_delay)
+        else:
+            await response.write(body)
+        stats["ok"] += 1
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/fault-stats", fault_stats_handler)
+    app.router.add_get("/{tail:.*}", fault_handler)
+    return app
+
+
+class Outcomes(EventSubscriber):
+    """Collect the first enqueue and last finish time of each action.
+
+    And the actions that raised, the queue worker drops them. An exception in a
+    success callback, eg. reading a truncated body, leaves the action in the
+    success state, so they are counted here.
+    """
+
+    def __init__(self) -> None:
+        self.first_enqueued: Dict[Any, float] = {}
+        self.last_finished: Dict[Any, float] = {}
+        self.raised: Set[Any] = set()
+
+    def handle(self, event: ActionEvent):
+        if event.kind is EventKind.ENQUEUE:
+            self.first_enqueued.setdefault(event.uid, event.timestamp)
+        elif event.kind is EventKind.FINISH:
+            self.last_finished[event.uid] = event.timestamp
+        elif event.kind is EventKind.EXCEPTION:
+            self.raised.add(event.uid)
+
+    def latencies(self) -> List[float]:
+        return [
+            finished - self.first_enqueued[uid]
+            for uid, finished in self.last_finished.items()
+            if uid in self.first_enqueued
+        ]
+
+
+def fetch_stats(base_url: str) -> Dict[str, int]:
+    async def fetch():
+        async with ClientSession() as session:
+            async with session.get(f"{base_url}/fault-stats") as response:
+                return await response.json()
+
+    return asyncio.run(fetch())
+
+
+def run_profile(
+    name: str,
+    count: int,
+    workers: int,
+    max_attempts: int,
+    timeout: float,
+    seed: Optional[int],
+) -> Dict[str, Any]:
+    profile = {**PROFILES[name], "seed": seed}
+    with BenchmarkServer(make_fault_app, profile) as server:
+        outcomes = Outcomes()
+        events = EventBus([outcomes])
+        actions = [
+            AiohttpAction(
+                AiohttpRequest(
+                    method="get",
+                    url=f"{server.base_url}/items",
+                    params={"id": str(index)},
+                ),
+                id_=str(index),
+                max_attempts=max_attempts,
+                callbacks=ActionCallbacks(success=[ResponseContentToJson()]),
+                events=events,
+            )
+            for index in range(count)
+        ]
+        start = time()
+        do_queue_runner(
+            actions,
+            [AiohttpQueueWorker() for _ in range(workers)],
+            session_kwargs={"timeout": ClientTimeout(total=timeout)},
+        )
+        seconds = time() - start
+        stats = fetch_stats(server.base_url)
+    dropped = len(outcomes.raised)
+    succeeded = sum(
+        action.state == ActionState.SUCCESS and action.uid not in outcomes.raised
+        for action in actions
+    )
+    latencies = outcomes.latencies()
+    return {
+        "profile": name,
+        "actions": count,
+        "seconds": seconds,
+        "goodput": succeeded / seconds,
+        "succeeded": succeeded,
+        "failed": count - succeeded - dropped,
+        "dropped": dropped,
+        "attempts": stats["requests"],
+        "wasted": stats["requests"] - succeeded,
+        "early_retries": stats["early_retries"],
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies, default=0.0) * 1000,
+        "server": stats,
+    }
+
+
+def print_results(results: List[Dict[str, Any]]):
+    print(
+        f"{'profile':<13}{'goodput/s':>10}{'ok':>6}{'failed':>7}{'dropped':>8}"
+        f"{'attempts':>9}{'wasted':>7}{'early':>6}"
+        f"{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+    )
+    for result in results:
+        print(
+            f"{result['profile']:<13}{result['goodput']:>10.1f}"
+            f"{result['succeeded']:>6}{result['failed']:>7}{result['dropped']:>8}"
+            f"{result['attempts']:>9}{result['wasted']:>7}"
+            f"{result['early_retries']:>6}"
+            f"{result['p50_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+            f"{result['max_ms']:>9.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--actions", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument(
+        "--timeout", type=float, default=2.0, help="Client timeout, in seconds."
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES)
+    )
+    parser.add_argument("--json", type=str, help="Also write the results here.")
+    parser.add_argument(
+        "--serve", choices=list(PROFILES), help="Only serve this profile."
+    )
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    if args.serve is not None:
+        print(f"Serving {args.serve} at http://127.0.0.1:{args.port}")
+        serve(make_fault_app, PROFILES[args.serve], "127.0.0.1", args.port)
+        return
+    results = [
+        run_profile(
+            name, args.actions, args.workers, args.max_attempts, args.timeout, args.seed
+        )
+        for name in args.profiles
+    ]
+    print_results(results)
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
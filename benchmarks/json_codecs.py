@@ -0,0 +1,140 @@
+"""Compare the available json codecs on realistic payloads.
+
+Usage::
+
+    python -m benchmarks.json_codecs --repeat 5
+
+Payloads mimic the data this library usually handles: a large list of market
+history records, a page of nested contract-like objects, and a small
+httpbin-like response.
+"""
+import argparse
+import random
+from datetime import date, timedelta
+from time import perf_counter_ns
+from typing import Any, Callable, Dict, List
+
+from pfmsoft.aiohttp_queue.json_codec import available_codecs, get_json_codec
+
+
+def market_history(count: int) -> List[Dict[str, Any]]:
+    rng = random.Random(1)
+    start = date(2020, 1, 1)
+    records = []
+    for day in range(count):
+        average = rng.uniform(3.0, 6.0)
+        records.append(
+            {
+                "average": round(average, 2),
+                "date": (start + timedelta(days=day)).isoformat(),
+                "highest": round(average * 1.1, 2),
+                "lowest": round(average * 0.9, 2),
+                "order_count": rng.randint(1000, 5000),
+                "volume": rng.randint(10**8, 10**10),
+            }
+        )
+    return records
+
+
+def contracts(count: int) -> List[Dict[str, Any]]:
+    rng = random.Random(2)
+    return [
+        {
+            "contract_id": 160000000 + idx,
+            "collateral": rng.uniform(0, 10**9),
+            "date_expired": "2021-05-01T12:00:00Z",
+            "date_issued": "2021-04-17T12:00:00Z",
+            "days_to_complete": rng.randint(0, 30),
+            "end_location_id": rng.randint(60000000, 61000000),
+            "for_corporation": rng.random() > 0.5,
+            "issuer_id": rng.randint(90000000, 99000000),
+            "price": rng.uniform(0, 10**10),
+            "title": 'Contract title with unicode éè and "quotes"',
+            "type": rng.choice(["item_exchange", "auction", "courier"]),
+            "items": [
+                {"type_id": rng.randint(1, 50000), "quantity": rng.randint(1, 1000)}
+                for _ in range(rng.randint(0, 5))
+            ],
+        }
+        for idx in range(count)
+    ]
+
+
+def httpbin_get() -> Dict[str, Any]:
+    return {
+        "args": {"arg1": "argument 1", "arg2": "argument 2"},
+        "headers": {
+            "Accept": "*/*",
+            "Accept-Encoding": "gzip, deflate",
+            "Host": "httpbin.org",
+            "User-Agent": "Python/3.9 aiohttp/3.7.4",
+        },
+        "origin": "127.0.0.1",
+        "url": "https://httpbin.org/get?arg1=argument+1&arg2=argument+2",
+    }
+
+
+def payloads() -> Dict[str, Any]:
+    return {
+        "market_history_10k": market_history(10000),
+        "contracts_1k": contracts(1000),
+        "httpbin_get": httpbin_get(),
+    }
+
+
+def best_of(func: Callable[[], Any], repeat: int, number: int) -> float:
+    """Best time for one call, in microseconds."""
+    best = None
+    for _ in range(repeat):
+        start = perf_counter_ns()
+        for _ in range(number):
+            func()
+        elapsed = (perf_counter_ns() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    assert best is not None
+    return best / 1000
+
+
+def run(repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    for payload_name, payload in payloads().items():
+        reference = get_json_codec("json").dumps(payload)
+        number = max(1, 2_000_000 // len(reference))
+        for codec_name in available_codecs():
+            codec = get_json_codec(codec_name)
+            encoded = codec.dumps(payload)
+            results.append(
+                {
+                    "payload": payload_name,
+                    "bytes": len(reference),
+                    "codec": codec_name,
+                    "loads_us": best_of(lambda: codec.loads(encoded), repeat, number),
+                    "dumps_us": best_of(lambda: codec.dumps(payload), repeat, number),
+                    "dumps_indent_us": best_of(
+                        lambda: codec.dumps(payload, indent=2), repeat, number
+                    ),
+                }
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    header = (
+        f"{'payload':<20}{'bytes':>10}  {'codec':<8}"
+        f"{'loads us':>12}{'dumps us':>12}{'indent us':>12}"
+    )
+    print(header)
+    print("-" * len(header))
+    for result in run(args.repeat):
+        print(
+            f"{result['payload']:<20}{result['bytes']:>10}  {result['codec']:<8}"
+            f"{result['loads_us']:>12.1f}{result['dumps_us']:>12.1f}"
+            f"{result['dumps_indent_us']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
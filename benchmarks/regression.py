@@ -0,0 +1,259 @@
+"""Compare benchmark results against a stored baseline.
+
+Usage::
+
+    python -m benchmarks.regression --save          # record the baseline
+    python -m benchmarks.regression                 # compare against it
+    python -m benchmarks.regression --output new.json --repeats 7
+
+Runs the runner scenarios from :mod:`benchmarks.runner_throughput` against a
+local :class:`benchmarks.server.BenchmarkServer`. Each run of a scenario is in a
+fresh process, so its peak RSS is its own. The scenarios are run `--repeats`
+times, interleaved, and each metric is summarised by its median and its median
+absolute deviation (MAD).
+
+A metric regresses when it is worse than the baseline by more than the larger of
+`--min-change` and `--noise-factor` times the relative MAD of the baseline or
+the current runs, whichever is noisier. The comparison is printed as a table,
+and the exit status is 1 if anything regressed.
+
+Baselines depend on the machine, record one before a change and compare after it
+on the same machine.
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import statistics
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from benchmarks.runner_throughput import run_scenario
+from benchmarks.server import BenchmarkServer
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+SCENARIOS: List[Dict[str, Any]] = [
+    {"runner": "single", "workers": 1, "payload": "get", "actions": 50},
+    {"runner": "sequential", "workers": 1, "payload": "get", "actions": 1000},
+    {"runner": "queue", "workers": 1, "payload": "get", "actions": 1000},
+    {"runner": "queue", "workers": 16, "payload": "get", "actions": 2000},
+    {"runner": "queue", "workers": 16, "payload": "list-100", "actions": 1000},
+    {"runner": "queue", "workers": 16, "payload": "bytes-64k", "actions": 1000},
+]
+
+#: Metric: True if higher is better.
+METRICS = {
+    "actions_per_second": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "max_rss_kib": False,
+    "peak_kib_per_action": False,
+}
+
+
+def scenario_name(scenario: Dict[str, Any]) -> str:
+    return f"{scenario['runner']}-{scenario['workers']}-{scenario['payload']}"
+
+
+def run_isolated(base_url: str, scenario: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a scenario in a new process."""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(
+            run_scenario,
+            base_url,
+            scenario["runner"],
+            scenario["workers"],
+            scenario["payload"],
+            scenario["actions"],
+            True,
+        ).result()
+
+
+def summarise(values: List[float]) -> Dict[str, Any]:
+    median = statistics.median(values)
+    mad = statistics.median([abs(value - median) for value in values])
+    return {"median": median, "mad": mad, "values": values}
+
+
+def run_benchmarks(repeats: int) -> Dict[str, Any]:
+    runs: Dict[str, List[Dict[str, Any]]] = {
+        scenario_name(scenario): [] for scenario in SCENARIOS
+    }
+    with BenchmarkServer() as server:
+        # Warm up the server.
+        run_isolated(server.base_url, SCENARIOS[0])
+        for repeat in range(repeats):
+            for scenario in SCENARIOS:
+                name = scenario_name(scenario)
+                print(f"run {repeat + 1}/{repeats} {name}", file=sys.stderr)
+                runs[name].append(run_isolated(server.base_url, scenario))
+    scenarios = {}
+    for scenario in SCENARIOS:
+        name = scenario_name(scenario)
+        scenarios[name] = {
+            "scenario": scenario,
+            "metrics": {
+                metric: summarise([run[metric] for run in runs[name]])
+                for metric in METRICS
+                if all(run[metric] is not None for run in runs[name])
+            },
+        }
+    return {"environment": environment(), "repeats": repeats, "scenarios": scenarios}
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "aiohttp": aiohttp.__version__,
+    }
+
+
+def compare_metric(
+    higher_is_better: bool,
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    min_change: float,
+    noise_factor: float,
+) -> Dict[str, Any]:
+    base = baseline["median"]
+    change = (current["median"] - base) / base if base else 0.0
+    noise = max(
+        baseline["mad"] / base if base else 0.0,
+        current["mad"] / current["median"] if current["median"] else 0.0,
+    )
+    threshold = max(min_change, noise_factor * noise)
+    worse = -change if higher_is_better else change
+    if worse > threshold:
+        status = "REGRESSED"
+    elif -worse > threshold:
+        status = "improved"
+    else:
+        status = "ok"
+    return {
+        "baseline": base,
+        "current": current["median"],
+        "change": change,
+        "threshold": threshold,
+        "status": status,
+    }
+
+
+def compare(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    min_change: float = 0.05,
+    noise_factor: float = 3.0,
+) -> List[Dict[str, Any]]:
+    """Compare each metric of each scenario that is in both result sets."""
+    rows = []
+    for name, scenario in current["scenarios"].items():
+        base_scenario = baseline["scenarios"].get(name)
+        if base_scenario is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in scenario["metrics"]:
+                continue
+            if metric not in base_scenario["metrics"]:
+                continue
+            row = compare_metric(
+                higher_is_better,
+                base_scenario["metrics"][metric],
+                scenario["metrics"][metric],
+                min_change,
+                noise_factor,
+            )
+            rows.append({"scenario": name, "metric": metric, **row})
+    return rows
+
+
+def print_comparison(baseline: Dict[str, Any], rows: List[Dict[str, Any]]):
+    base_env = baseline["environment"]
+    print(
+        f"Baseline {base_env.get('git')} from {base_env.get('date')}, "
+        f"python {base_env.get('python')} on {base_env.get('platform')}"
+    )
+    print(
+        f"{'scenario':<24}{'metric':<22}{'baseline':>12}{'current':>12}"
+        f"{'change':>9}{'limit':>8}  status"
+    )
+    for row in rows:
+        print(
+            f"{row['scenario']:<24}{row['metric']:<22}{row['baseline']:>12.2f}"
+            f"{row['current']:>12.2f}{row['change']:>+9.1%}{row['threshold']:>8.1%}"
+            f"  {row['status']}"
+        )
+    regressed = [row for row in rows if row["status"] == "REGRESSED"]
+    print(f"{len(regressed)} of {len(rows)} metrics regressed.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--save", action="store_true", help="Save the results as the baseline."
+    )
+    parser.add_argument("--output", type=Path, help="Also write the results here.")
+    parser.add_argument(
+        "--current",
+        type=Path,
+        help="Compare these saved results, instead of running the benchmarks.",
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--min-change",
+        type=float,
+        default=0.05,
+        help="The smallest relative change that counts, default 0.05.",
+    )
+    parser.add_argument(
+        "--noise-factor",
+        type=float,
+        default=3.0,
+        help="Changes within this many relative MADs are noise, default 3.",
+    )
+    args = parser.parse_args()
+    if args.current is not None:
+        current = json.loads(args.current.read_text())
+    else:
+        current = run_benchmarks(args.repeats)
+    if args.output is not None:
+        args.output.write_text(json.dumps(current, indent=2))
+    if args.save:
+        args.baseline.write_text(json.dumps(current, indent=2))
+        print(f"Saved the baseline to {args.baseline}")
+        return
+    if not args.baseline.exists():
+        sys.exit(f"No baseline at {args.baseline}, make one with --save.")
+    baseline = json.loads(args.baseline.read_text())
+    rows = compare(baseline, current, args.min_change, args.noise_factor)
+    print_comparison(baseline, rows)
+    if any(row["status"] == "REGRESSED" for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""Throughput, latency and memory of the runners, against a local server.
+
+Usage::
+
+    python -m benchmarks.runner_throughput --actions 2000 --workers 1 8 32
+
+Runs the single, sequential and queue runners, the queue runner with each worker
+count, for each payload, against a :class:`benchmarks.server.BenchmarkServer`.
+Reports actions per second, the p50, p90 and p99 latency of an attempt, from
+starting the request to the callbacks finishing, and with `--memory` the peak
+traced memory, measured in a second run so tracing does not slow the first.
+"""
+import argparse
+import json
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Sequence
+
+from benchmarks.server import BenchmarkServer
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue.callbacks import (
+    ResponseContentToJson,
+    ResponseContentToText,
+)
+from pfmsoft.aiohttp_queue.runners import (
+    do_queue_runner,
+    do_sequential_action_runner,
+    do_single_action_runner,
+)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+#: Payload name: (path, decode as json).
+PAYLOADS = {
+    "get": ("/get", True),
+    "list-100": ("/list-of-dicts/100", True),
+    "list-1000": ("/list-of-dicts/1000", True),
+    "bytes-64k": ("/bytes/65536", False),
+}
+RUNNERS = ("single", "sequential", "queue")
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+    return ordered[index]
+
+
+def max_rss_kib() -> Optional[int]:
+    """The peak resident set size of the process so far, in KiB, on Linux."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def make_actions(base_url: str, payload: str, count: int) -> List[AiohttpAction]:
+    path, is_json = PAYLOADS[payload]
+    actions = []
+    for index in range(count):
+        callback = ResponseContentToJson() if is_json else ResponseContentToText()
+        actions.append(
+            AiohttpAction(
+                AiohttpRequest(method="get", url=f"{base_url}{path}"),
+                name=payload,
+                id_=str(index),
+                callbacks=ActionCallbacks(success=[callback]),
+            )
+        )
+    return actions
+
+
+def run_actions(runner: str, actions: List[AiohttpAction], workers: int):
+    if runner == "single":
+        for action in actions:
+            do_single_action_runner(action)
+    elif runner == "sequential":
+        do_sequential_action_runner(actions)
+    else:
+        do_queue_runner(actions, [AiohttpQueueWorker() for _ in range(workers)])
+
+
+def run_scenario(
+    base_url: str,
+    runner: str,
+    workers: int,
+    payload: str,
+    count: int,
+    memory: bool = False,
+) -> Dict[str, Any]:
+    """Run one scenario, and return its results."""
+    actions = make_actions(base_url, payload, count)
+    start = perf_counter()
+    run_actions(runner, actions, workers)
+    seconds = perf_counter() - start
+    latencies = [
+        action.timings.phases().get("total", 0.0)
+        for action in actions
+        if action.timings is not None
+    ]
+    result: Dict[str, Any] = {
+        "runner": runner,
+        "workers": workers if runner == "queue" else 1,
+        "payload": payload,
+        "actions": count,
+        "succeeded": sum(action.state == ActionState.SUCCESS for action in actions),
+        "seconds": seconds,
+        "actions_per_second": count / seconds,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "peak_kib": None,
+        "peak_kib_per_action": None,
+    }
+    if memory:
+        actions = make_actions(base_url, payload, count)
+        tracemalloc.start()
+        try:
+            run_actions(runner, actions, workers)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result["peak_kib"] = peak / 1024
+        result["peak_kib_per_action"] = peak / 1024 / count
+    result["max_rss_kib"] = max_rss_kib()
+    return result
+
+
+def run_all(
+    base_url: str,
+    count: int,
+    single_count: int,
+    worker_counts: Sequence[int],
+    payloads: Sequence[str],
+    runners: Sequence[str] = RUNNERS,
+    memory: bool = False,
+) -> List[Dict[str, Any]]:
+    # Warm up the server and the client, imports and caches.
+    run_scenario(base_url, "queue", 4, "get", 50)
+    results = []
+    for payload in payloads:
+        for runner in runners:
+            if runner == "queue":
+                for workers in worker_counts:
+                    results.append(
+                        run_scenario(base_url, runner, workers, payload, count, memory)
+                    )
+            else:
+                runner_count = single_count if runner == "single" else count
+                results.append(
+                    run_scenario(base_url, runner, 1, payload, runner_count, memory)
+                )
+    return results
+
+
+def print_results(results: List[Dict[str, Any]]):
+    print(
+        f"{'runner':<12}{'workers':>8}{'payload':>12}{'actions':>9}"
+        f"{'actions/s':>11}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'peak KiB':>10}"
+    )
+    for result in results:
+        peak = result["peak_kib"]
+        print(
+            f"{result['runner']:<12}{result['workers']:>8}{result['payload']:>12}"
+            f"{result['actions']:>9}{result['actions_per_second']:>11.1f}"
+            f"{result['p50_ms']:>9.2f}{result['p90_ms']:>9.2f}"
+            f"{result['p99_ms']:>9.2f}"
+            f"{(f'{peak:.0f}' if peak is not None else '-'):>10}"
+        )
+        if result["succeeded"] != result["actions"]:
+            print(f"  only {result['succeeded']} of {result['actions']} succeeded")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--actions", type=int, default=2000)
+    parser.add_argument(
+        "--single-actions",
+        type=int,
+        default=100,
+        help="Actions for the single action runner, which starts a loop per action.",
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument(
+        "--payloads", nargs="+", choices=list(PAYLOADS), default=["get", "list-100"]
+    )
+    parser.add_argument("--runners", nargs="+", choices=RUNNERS, default=RUNNERS)
+    parser.add_argument("--memory", action="store_true")
+    parser.add_argument("--json", type=Path, help="Also write the results here.")
+    args = parser.parse_args()
+    with BenchmarkServer() as server:
+        results = run_all(
+            server.base_url,
+            args.actions,
+            args.single_actions,
+            args.workers,
+            args.payloads,
+            args.runners,
+            args.memory,
+        )
+    print_results(results)
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""A local aiohttp server for benchmarks, with httpbin like endpoints.
+
+Usage::
+
+    python -m benchmarks.server --port 8080
+
+The server runs in a child process, so serving requests does not compete with
+the client's event loop, and the results measure the library rather than the
+network. Endpoints:
+
+- /get, echoes the query args, like httpbin.
+- /status/{codes}, a status code, or a random choice from a comma separated list
+  with optional weights, eg. /status/200:0.9,503:0.1, like httpbin.
+- /delay/{seconds}, responds after a delay.
+- /bytes/{size}, size bytes of octet-stream.
+- /list-of-dicts/{count}, a JSON array of count small objects.
+- /pages/{count}, numbered pages of the objects, with an x-pages header. Query
+  args page and per_page, default 1 and 100.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+AppFactory = Callable[..., web.Application]
+
+
+@lru_cache(maxsize=None)
+def payload_bytes(size: int) -> bytes:
+    pattern = b"0123456789abcdef"
+    repeats, remainder = divmod(size, len(pattern))
+    return pattern * repeats + pattern[:remainder]
+
+
+def item(index: int) -> Dict[str, Any]:
+    return {
+        "id": index,
+        "name": f"item {index}",
+        "price": index * 0.25,
+        "tags": ["a", "b"],
+        "active": index % 2 == 0,
+    }
+
+
+@lru_cache(maxsize=64)
+def items_body(start: int, stop: int) -> bytes:
+    return json.dumps([item(index) for index in range(start, stop)]).encode()
+
+
+def parse_codes(codes: str) -> Tuple[List[int], List[float]]:
+    """Parse httpbin style status codes, eg. "200:0.9,503:0.1"."""
+    choices = []
+    weights = []
+    for code in codes.split(","):
+        value, _, weight = code.partition(":")
+        choices.append(int(value))
+        weights.append(float(weight) if weight else 1.0)
+    return choices, weights
+
+
+async def get_handler(request: web.Request) -> web.Response:
+    return web.json_response({"args": dict(request.query), "url": str(request.url)})
+
+
+async def status_handler(request: web.Request) -> web.Response:
+    choices, weights = parse_codes(request.match_info["codes"])
+    return web.Response(status=random.choices(choices, weights)[0])
+
+
+async def delay_handler(request: web.Request) -> web.Response:
+    seconds = min(float(request.match_info["seconds"]), 10.0)
+    await asyncio.sleep(seconds)
+    return web.json_response({"args": dict(request.query), "delay": seconds})
+
+
+async def bytes_handler(request: web.Request) -> web.Response:
+    size = int(request.match_info["size"])
+    return web.Response(
+        body=payload_bytes(size), content_type="application/octet-stream"
+    )
+
+
+async def list_of_dicts_handler(request: web.Request) -> web.Response:
+    count = int(request.match_info["count"])
+    return web.Response(body=items_body(0, count), content_type="application/json")
+
+
+async def pages_handler(request: web.Request) -> web.Response:
+    count = int(request.match_info["count"])
+    per_page = int(request.query.get("per_page", "100"))
+    page = int(request.query.get("page", "1"))
+    last_page = max(1, -(-count // per_page))
+    start = (page - 1) * per_page
+    return web.Response(
+        body=items_body(start, max(start, min(start + per_page, count))),
+        content_type="application/json",
+        headers={"x-pages": str(last_page)},
+    )
+
+
+def make_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/get", get_handler)
+    app.router.add_get("/status/{codes}", status_handler)
+    app.router.add_get("/delay/{seconds}", delay_handler)
+    app.router.add_get("/bytes/{size}", bytes_handler)
+    app.router.add_get("/list-of-dicts/{count}", list_of_dicts_handler)
+    app.router.add_get("/pages/{count}", pages_handler)
+    return app
+
+
+async def serve_app(
+    app: web.Application, host: str, port: int, ready: Optional[Any] = None
+):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, backlog=1024)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore
+    if ready is not None:
+        ready.send(port)
+        ready.close()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def serve(
+    app_factory: AppFactory,
+    app_kwargs: Dict[str, Any],
+    host: str,
+    port: int,
+    ready: Optional[Any] = None,
+):
+    """Run the app until the process is stopped. The child process target."""
+    try:
+        asyncio.run(serve_app(app_factory(**app_kwargs), host, port, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+class BenchmarkServer:
+    """Run an app in a child process, for the duration of a `with` block.
+
+    Args:
+        app_factory: A module level function that returns the app, so it can be
+            used in a spawned process.
+        app_kwargs: Args for the app_factory.
+        host: The address to listen on.
+        port: The port, 0 picks a free one.
+    """
+
+    def __init__(
+        self,
+        app_factory: AppFactory = make_app,
+        app_kwargs: Optional[Dict[str, Any]] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.app_factory = app_factory
+        self.app_kwargs = app_kwargs if app_kwargs is not None else {}
+        self.host = host
+        self.port = port
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"app_factory={self.app_factory!r}, app_kwargs={self.app_kwargs!r}, "
+            f"host={self.host!r}, port={self.port!r}"
+            ")"
+        )
+
+    def __enter__(self) -> "BenchmarkServer":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.stop()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        receiver, sender = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=serve,
+            args=(self.app_factory, self.app_kwargs, self.host, self.port, sender),
+            daemon=True,
+        )
+        self.process.start()
+        sender.close()
+        if not receiver.poll(30):
+            self.stop()
+            raise RuntimeError(f"{self!r} did not start.")
+        self.port = receiver.recv()
+        receiver.close()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    print(f"Serving at http://{args.host}:{args.port}")
+    serve(make_app, {}, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,39 @@
+import asyncio
 import logging
 from asyncio.queues import Queue
+from concurrent.futures import Executor
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Any, Dict, List, Optional, Union
+from time import perf_counter
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    TypeVar,
+    Union,
+)
 from uuid import UUID, uuid4
 
 from aiohttp import ClientResponse, ClientSession
 
+from pfmsoft.aiohttp_queue.events import EventBus, EventKind
+from pfmsoft.aiohttp_queue.tracing import PhaseTimings
 from pfmsoft.aiohttp_queue.utilities import optional_object
 
+if TYPE_CHECKING:
+    from pfmsoft.aiohttp_queue.metrics import RunnerMetrics
+    from pfmsoft.aiohttp_queue.progress import ProgressReporter
+
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+T = TypeVar("T")
+
 
 @dataclass
 class AiohttpRequest:
@@ -42,16 +64,34 @@ class AiohttpQueueWorker:
         self.uid = uuid4()
         self.task_count = 0
 
-    async def consumer(self, queue: Queue, session: ClientSession):
+    async def consumer(
+        self,
+        queue: Queue,
+        session: ClientSession,
+        metrics: Optional["RunnerMetrics"] = None,
+        progress: Optional["ProgressReporter"] = None,
+    ):
         while True:
+            idle_start = perf_counter()
             action: AiohttpAction = await queue.get()
+            start = 0.0
+            if metrics is not None:
+                metrics.worker_idle(perf_counter() - idle_start)
+                metrics.queue_depth.set(queue.qsize())
+                start = metrics.action_started()
+            exception = False
             try:
                 self.task_count += 1
                 await action.do_action(session, queue)
             except Exception as ex:
+                exception = True
                 logger.exception(
                     "Queue worker %s caught an exception from %r", self.uid, action
                 )
+            if metrics is not None:
+                metrics.action_finished(action, start, exception)
+            if progress is not None:
+                progress.action_finished(action, exception)
             queue.task_done()
 
     def __repr__(self) -> str:
@@ -69,10 +109,39 @@ class CallbackState(Enum):
 
 
 class AiohttpActionCallback:
+    """Base class for callbacks.
+
+    Callbacks run on the event loop. CPU heavy work, like decoding or serializing
+    a large result, can be passed to :meth:`run_cpu_bound`, which runs it in
+    `self.executor` when the callback has one. Use a ThreadPoolExecutor for work
+    that releases the GIL, and a ProcessPoolExecutor for pure Python work, in
+    which case the function and its args must be picklable.
+
+    When :class:`ActionCallbacks` runs callbacks concurrently, a callback waits
+    for the callbacks it was declared to run :meth:`after`.
+    """
+
     def __init__(self, *args, **kwargs) -> None:
         _, _ = args, kwargs
         self.state: CallbackState = CallbackState.NOT_SET
         self.state_message: str = ""
+        self.executor: Optional[Executor] = None
+        self.dependencies: List["AiohttpActionCallback"] = []
+
+    def after(self, *callbacks: "AiohttpActionCallback") -> "AiohttpActionCallback":
+        """Declare callbacks that must finish before this one starts.
+
+        Returns self, eg. `SaveResultToJsonFile(path).after(parse_callback)`.
+        """
+        self.dependencies.extend(callbacks)
+        return self
+
+    async def run_cpu_bound(self, func: Callable[..., T], *args: Any) -> T:
+        """Run func(*args) in the executor, or inline if there is no executor."""
+        if self.executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
 
     def success(self, caller: "AiohttpAction", msg: str = "", **kwargs):
         _, _ = caller, kwargs
@@ -97,6 +166,12 @@ class AiohttpActionCallback:
 
 
 class ActionObserver:
+    """Observe action state changes.
+
+    The default implementation logs them at info level. For structured events,
+    see :mod:`pfmsoft.aiohttp_queue.events`.
+    """
+
     def __init__(self) -> None:
         pass
 
@@ -108,7 +183,7 @@ class ActionObserver:
         **kwargs,
     ):
         _ = kwargs
-        print(action, source, msg)
+        logger.info("%s %s %s", action, source, msg)
 
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}(" ")"
@@ -116,9 +191,18 @@ class ActionObserver:
 
 @dataclass
 class ActionCallbacks:
+    """The callbacks for each outcome of an action.
+
+    By default the callbacks in a list run one after another, in order. If
+    `concurrent` is True, they run concurrently, except that a callback waits for
+    its dependencies, see :meth:`AiohttpActionCallback.after`. Dependencies must
+    come earlier in the same list.
+    """
+
     success: List[AiohttpActionCallback] = field(default_factory=list)
     retry: List[AiohttpActionCallback] = field(default_factory=list)
     fail: List[AiohttpActionCallback] = field(default_factory=list)
+    concurrent: bool = False
 
 
 class ActionState(Enum):
@@ -129,6 +213,14 @@ class ActionState(Enum):
     CALLBACK_FAIL = "callback_fail"
 
 
+_STATE_EVENTS = {
+    ActionState.SUCCESS: EventKind.SUCCESS,
+    ActionState.RETRY: EventKind.RETRY,
+    ActionState.FAIL: EventKind.FAIL,
+    ActionState.CALLBACK_FAIL: EventKind.CALLBACK_FAIL,
+}
+
+
 class AiohttpAction:
     def __init__(
         self,
@@ -140,6 +232,7 @@ class AiohttpAction:
         callbacks: Optional[ActionCallbacks] = None,
         observers: Optional[List[ActionObserver]] = None,
         retry_codes: Optional[List[int]] = None,
+        events: Optional[EventBus] = None,
     ) -> None:
         self.aiohttp_args = aiohttp_args
         self.id_ = id_
@@ -150,10 +243,17 @@ class AiohttpAction:
         self.observers = optional_object(observers, list)
         self.callbacks: ActionCallbacks = optional_object(callbacks, ActionCallbacks)
         self.retry_codes = optional_object(retry_codes, list, [500, 502, 503, 504])
+        self.events = events
         self.attempts: int = 0
         self.response: Optional[ClientResponse] = None
         self.response_data: Any = None
         self.state: ActionState = ActionState.NOT_SET
+        #: Seconds from sending the request to receiving the response headers.
+        self.request_seconds: Optional[float] = None
+        #: When the action was put on a queue, for the queue_wait phase.
+        self.enqueued_at: Optional[float] = None
+        #: Phase timings of the last attempt.
+        self.timings: Optional[PhaseTimings] = None
 
     def __repr__(self):
         return (
@@ -161,6 +261,7 @@ class AiohttpAction:
             f"name={self.name!r}, id_={self.id_!r}, uid={self.uid!r}, "
             f"aiohttp_args={self.aiohttp_args!r}, max_attempts={self.max_attempts!r}, "
             f"context={self.context!r}, observers={self.observers!r}, "
+            f"events={self.events!r}, "
             f"callbacks={self.callbacks!r}, retry_codes={self.retry_codes!r}, "
             f"attempts={self.attempts!r}, response={self.response!r}, "
             f"response_data={self.response_data!r}, state={self.state}"
@@ -184,22 +285,36 @@ class AiohttpAction:
 
     async def do_action(self, session: ClientSession, queue: Optional[Queue] = None):
         self.attempts += 1
+        self.request_seconds = None
+        timings = self.timings = PhaseTimings(self.enqueued_at)
+        self.enqueued_at = None
+        self.emit(EventKind.START)
         try:
 
             if self.attempts <= self.max_attempts or self.max_attempts == -1:
-                async with session.request(**self.aiohttp_args.as_dict()) as response:
+                request_kwargs = self.aiohttp_args.as_dict()
+                # Filled in by the phase_trace_config, if the session has it.
+                request_kwargs.setdefault("trace_request_ctx", timings)
+                async with session.request(**request_kwargs) as response:
+                    self.request_seconds = perf_counter() - timings.started
                     self.response = response
+                    self.emit(EventKind.RESPONSE, response.status)
+                    timings.callbacks_start = perf_counter()
                     await self.check_response(queue)
+                    timings.callbacks_end = perf_counter()
             else:
                 logger.warning("Retry fail: %r retry_count:%s", self, self.attempts)
                 await self.fail()
         except Exception as ex:
+            self.emit(EventKind.EXCEPTION, detail=ex.__class__.__name__)
             logger.exception(
                 "Exception: %s raised while doing action: %s",
                 ex.__class__.__name__,
                 self,
             )
             raise ex
+        finally:
+            self.emit(EventKind.FINISH, detail=self.state.value)
 
     async def check_response(self, queue: Optional[Queue]):
         if self.response is not None:
@@ -217,32 +332,15 @@ class AiohttpAction:
     async def success(self):
         self.update_state(ActionState.SUCCESS, "action", self.response.status)
         logger.debug("Successful response for %s", self)
-
-        for callback in self.callbacks.success:
-            try:
-                await callback.do_callback(caller=self)
-            except Exception as ex:
-                logger.exception(
-                    "Exception: %s during success callback: %s for action: %s",
-                    ex.__class__.__name__,
-                    callback,
-                    self,
-                )
-                raise ex
+        await self.run_callbacks(self.callbacks.success, "success")
 
     async def fail(self):
-        self.update_state(ActionState.FAIL, "action", str(self))
-        for callback in self.callbacks.fail:
-            try:
-                await callback.do_callback(caller=self)
-            except Exception as ex:
-                logger.exception(
-                    "Exception: %s during fail callback: %s for action: %r",
-                    ex.__class__.__name__,
-                    callback,
-                    self,
-                )
-                raise ex
+        self.update_state(
+            ActionState.FAIL,
+            "action",
+            f"Failed after {self.attempts} of {self.max_attempts} attempts.",
+        )
+        await self.run_callbacks(self.callbacks.fail, "fail")
         logger.warning(
             "Fail response for %r meta: %r", self, self.response_meta_to_dict()
         )
@@ -260,6 +358,7 @@ class AiohttpAction:
             self.max_attempts,
         )
         if queue is not None:
+            self.mark_enqueued()
             await queue.put(self)
         else:
             logger.info(
@@ -268,17 +367,65 @@ class AiohttpAction:
             )
             await self.fail()
             return
-        for callback in self.callbacks.retry:
-            try:
-                await callback.do_callback(caller=self)
-            except Exception as ex:
-                logger.exception(
-                    "Exception: %s during retry callback: %s for action: %s",
-                    ex.__class__.__name__,
-                    callback,
-                    self,
-                )
-                raise ex
+        await self.run_callbacks(self.callbacks.retry, "retry")
+
+    async def run_callbacks(self, callbacks: List[AiohttpActionCallback], kind: str):
+        """Run callbacks in order, or concurrently if ActionCallbacks.concurrent."""
+        if not self.callbacks.concurrent:
+            for callback in callbacks:
+                await self.run_callback(callback, kind)
+            return
+        seen: Set[int] = set()
+        for callback in callbacks:
+            for dependency in callback.dependencies:
+                if id(dependency) not in seen:
+                    raise ValueError(
+                        f"{callback!r} depends on {dependency!r}, which is not "
+                        f"earlier in the {kind} callbacks."
+                    )
+            seen.add(id(callback))
+        tasks: Dict[int, asyncio.Task] = {}
+        for callback in callbacks:
+            dependencies = [tasks[id(item)] for item in callback.dependencies]
+            tasks[id(callback)] = asyncio.create_task(
+                self.run_callback(callback, kind, dependencies)
+            )
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            # Stop the callbacks still running, then raise the first exception.
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+    async def run_callback(
+        self,
+        callback: AiohttpActionCallback,
+        kind: str,
+        dependencies: Sequence[asyncio.Task] = (),
+    ):
+        if dependencies:
+            await asyncio.gather(*dependencies)
+        source = callback.__class__.__name__
+        self.emit(EventKind.CALLBACK_START, source=source, detail=kind)
+        try:
+            await callback.do_callback(caller=self)
+            self.emit(
+                EventKind.CALLBACK_END, source=source, detail=callback.state.value
+            )
+        except Exception as ex:
+            self.emit(
+                EventKind.CALLBACK_END, source=source, detail=ex.__class__.__name__
+            )
+            logger.exception(
+                "Exception: %s during %s callback: %s for action: %s",
+                ex.__class__.__name__,
+                kind,
+                callback,
+                self,
+            )
+            raise ex
 
     def update_state(
         self,
@@ -290,6 +437,27 @@ class AiohttpAction:
         self.state = state
         for observer in self.observers:
             observer.update(self, source, msg, **kwargs)
+        events = self.events
+        if events is not None and events.active:
+            status = self.response.status if self.response is not None else None
+            events.emit(_STATE_EVENTS[state], self, status, source, str(msg))
+
+    def emit(
+        self,
+        kind: EventKind,
+        status: Optional[int] = None,
+        source: str = "action",
+        detail: str = "",
+    ):
+        """Emit an event, if the action has an event bus with subscribers."""
+        events = self.events
+        if events is not None and events.active:
+            events.emit(kind, self, status, source, detail)
+
+    def mark_enqueued(self):
+        """Record that the action is being put on a queue."""
+        self.enqueued_at = perf_counter()
+        self.emit(EventKind.ENQUEUE, source="queue")
 
     def response_meta_to_dict(self) -> Dict[str, Any]:
         data: Dict[str, Any] = {}
@@ -1,22 +1,58 @@
+import asyncio
 import csv
-import json
+import hashlib
+import io
 import logging
+from asyncio.queues import Queue
+from concurrent.futures import Executor
 from copy import deepcopy
+from functools import partial
 from pathlib import Path
-from string import Template
-from typing import Dict, List, Optional, Sequence
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
-import aiofiles
 import yaml
+from aiohttp import ClientSession
 from more_itertools import spy
 
 from pfmsoft.aiohttp_queue import (
+    ActionState,
     AiohttpAction,
     AiohttpActionCallback,
     AiohttpQueueWorker,
+    AiohttpRequest,
 )
 from pfmsoft.aiohttp_queue.aiohttp import ActionCallbacks
+from pfmsoft.aiohttp_queue.compression import (
+    AUTO,
+    SUFFIX_FOR_COMPRESSION,
+    AsyncFileWriter,
+    FileWriter,
+    compression_from_path,
+    get_encoder,
+    resolve_compression,
+)
+from pfmsoft.aiohttp_queue.durability import DurabilityPolicy, get_durability
+from pfmsoft.aiohttp_queue.json_codec import JsonCodec, get_json_codec
+from pfmsoft.aiohttp_queue.json_stream import JsonArrayItemHandler, iter_json_array
+from pfmsoft.aiohttp_queue.pagination import (
+    PageReorderBuffer,
+    PageResults,
+    PaginationStrategy,
+)
+from pfmsoft.aiohttp_queue.paths import PathResolver, get_path_resolver
 from pfmsoft.aiohttp_queue.runners import queue_runner
+from pfmsoft.aiohttp_queue.sinks import AsyncSink
+from pfmsoft.aiohttp_queue.transforms import Projection
 from pfmsoft.aiohttp_queue.utilities import combine_dictionaries, optional_object
 
 logger = logging.getLogger(__name__)
@@ -26,25 +62,156 @@ logger.addHandler(logging.NullHandler())
 # pylint: disable=[useless-super-delegation,no-self-use]
 
 
+def decode_and_project(codec: JsonCodec, projection: Projection, body: bytes) -> Any:
+    """Decode JSON, and apply a projection before the full result is kept."""
+    return projection.apply_result(codec.loads(body))
+
+
+def dump_yaml(data: Any) -> str:
+    """Dump data to a YAML string, keeping the key order."""
+    return yaml.dump(data, sort_keys=False)
+
+
 class ResponseContentToJson(AiohttpActionCallback):
-    def __init__(self) -> None:
+    """Decode the response body with a :class:`JsonCodec`.
+
+    The raw body bytes are passed to the codec, without decoding to str first.
+    If codec is None, the fastest available codec is used. Large bodies can be
+    decoded off the event loop by passing an executor. A projection is applied
+    straight after decoding, in the executor if there is one, so only the
+    projected result is kept.
+    """
+
+    def __init__(
+        self,
+        codec: Optional[JsonCodec] = None,
+        executor: Optional[Executor] = None,
+        projection: Optional[Projection] = None,
+    ) -> None:
         super().__init__()
+        self.codec = optional_object(codec, get_json_codec)
+        self.executor = executor
+        self.projection = projection
 
     def __repr__(self) -> str:
         return (
             f"{self.__class__.__name__}("
-            f"state={self.state!r}, state_message={self.state_message!r}"
+            f"state={self.state!r}, state_message={self.state_message!r}, "
+            f"codec={self.codec!r}, executor={self.executor!r}, "
+            f"projection={self.projection!r}"
             ")"
         )
 
     async def do_callback(self, caller: AiohttpAction):
         if caller.response is not None:
-            caller.response_data = await caller.response.json()
+            body = await caller.response.read()
+            if body.strip():
+                if self.projection is None:
+                    caller.response_data = await self.run_cpu_bound(
+                        self.codec.loads, body
+                    )
+                else:
+                    caller.response_data = await self.run_cpu_bound(
+                        decode_and_project, self.codec, self.projection, body
+                    )
+            else:
+                caller.response_data = None
             self.success(caller)
             return
         self.fail(caller, "Response is None.")
 
 
+class StreamJsonArrayToHandlers(AiohttpActionCallback):
+    """Decode a JSON array response one item at a time, passing each to the handlers.
+
+    Use this instead of ResponseContentToJson for very large list responses.
+    The whole list is never held in memory, unless a handler collects it. The
+    number of items is stored in `caller.context["pfmsoft_item_count"]`.
+
+    With a projection, each item is projected before it is passed on, and
+    filtered out items are dropped.
+    """
+
+    def __init__(
+        self,
+        handlers: Sequence[JsonArrayItemHandler],
+        codec: Optional[JsonCodec] = None,
+        chunk_size: int = 65536,
+        projection: Optional[Projection] = None,
+    ) -> None:
+        super().__init__()
+        self.handlers = list(handlers)
+        self.codec = optional_object(codec, get_json_codec)
+        self.chunk_size = chunk_size
+        self.projection = projection
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"state={self.state!r}, state_message={self.state_message!r}, "
+            f"handlers={self.handlers!r}, codec={self.codec!r}, "
+            f"chunk_size={self.chunk_size!r}, projection={self.projection!r}"
+            ")"
+        )
+
+    async def do_callback(self, caller: AiohttpAction):
+        if caller.response is None:
+            self.fail(caller, "Response is None.")
+            return
+        item_count = 0
+        try:
+            async for item in iter_json_array(
+                caller.response.content, self.codec, self.chunk_size
+            ):
+                item_count += 1
+                if self.projection is not None:
+                    item = self.projection.apply(item)
+                    if item is None:
+                        continue
+                for handler in self.handlers:
+                    await handler.handle_item(caller, item)
+            for handler in self.handlers:
+                await handler.finish(caller)
+        except Exception as ex:
+            logger.exception(
+                "Exception streaming json array with %r in action %s", self, caller
+            )
+            self.fail(caller, f"Exception streaming json array at item {item_count}")
+            raise ex
+        caller.context["pfmsoft_item_count"] = item_count
+        self.success(caller)
+
+
+class ProjectResult(AiohttpActionCallback):
+    """Apply a :class:`Projection` to caller.response_data, a list of dicts or a dict."""
+
+    def __init__(
+        self, projection: Projection, executor: Optional[Executor] = None
+    ) -> None:
+        super().__init__()
+        self.projection = projection
+        self.executor = executor
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"state={self.state!r}, state_message={self.state_message!r}, "
+            f"projection={self.projection!r}, executor={self.executor!r}"
+            ")"
+        )
+
+    async def do_callback(self, caller: AiohttpAction):
+        try:
+            caller.response_data = await self.run_cpu_bound(
+                self.projection.apply_result, caller.response_data
+            )
+        except Exception as ex:
+            logger.exception("Exception projecting with %r in action %s", self, caller)
+            self.fail(caller, "Exception projecting the result.")
+            raise ex
+        self.success(caller)
+
+
 class ResponseContentToText(AiohttpActionCallback):
     def __init__(self) -> None:
         super().__init__()
@@ -67,7 +234,8 @@ class ResponseContentToText(AiohttpActionCallback):
 class CheckForPages(AiohttpActionCallback):
     """Where page=<page number> is in query string, and x-pages is in response header.
 
-    Assumes response data is a list
+    Assumes response data is a list. See :class:`Paginate` for other kinds of
+    pagination, and to stream pages to a sink instead of holding them all.
     """
 
     def __init__(self) -> None:
@@ -148,6 +316,7 @@ class CheckForPages(AiohttpActionCallback):
             id_=str(new_page),
             callbacks=ActionCallbacks(success=[ResponseContentToJson()]),
             observers=caller.observers,
+            events=caller.events,
             retry_codes=caller.retry_codes,
         )
         assert new_action.aiohttp_args.params is not None
@@ -182,11 +351,13 @@ class CheckForPages(AiohttpActionCallback):
             return
         for action in actions:
             if action.response is None:
-                return
-
+                logger.warning(
+                    "No response for page action %s. Data is incomplete.", action
+                )
+                continue
             if action.response.status == 200:
                 caller.response_data.extend(action.response_data)
-                return
+                continue
             logger.warning(
                 (
                     "An attempt to get page data failed. Data is incomplete.\nUrl: %r \n"
@@ -204,8 +375,287 @@ class CheckForPages(AiohttpActionCallback):
         return 5
 
 
+class Paginate(AiohttpActionCallback):
+    """Fetch the other pages of a paginated response, with a :class:`PaginationStrategy`.
+
+    Use after ResponseContentToJson. When the strategy can tell all the page
+    requests from the first page, they are fetched concurrently by `workers`
+    workers. Otherwise pages are followed one at a time, requesting the next
+    page as soon as the strategy can name it, see
+    :meth:`~pfmsoft.aiohttp_queue.pagination.PaginationStrategy.early_request`.
+
+    Pages are handled in page order. Without a sink, the items of all the pages
+    replace `caller.response_data`. With a sink, the items of each page are put
+    in the sink as soon as the pages before it are done, and
+    `caller.response_data` is set to None, so memory is bounded by `window`, the
+    number of pages fetched ahead of the oldest unfinished page, instead of the
+    whole dataset. With `explode` False, each page is put as one record.
+
+    The page requests use their own session, made by `session_factory` with
+    `session_kwargs`, eg. a replay archive's session.
+
+    A :class:`~pfmsoft.aiohttp_queue.pagination.PageResults` report is stored in
+    `caller.context["pfmsoft_page_report"]`, and the number of pages, including
+    the first, in `caller.context["pfmsoft_page_count"]`.
+    """
+
+    def __init__(
+        self,
+        strategy: PaginationStrategy,
+        max_pages: int = 1000,
+        workers: int = 5,
+        session_kwargs: Optional[Dict] = None,
+        sink: Optional[AsyncSink] = None,
+        explode: bool = True,
+        window: int = 20,
+        session_factory: Callable[..., Any] = ClientSession,
+    ) -> None:
+        super().__init__()
+        if max_pages < 1:
+            raise ValueError(f"max_pages must be at least 1, got {max_pages}.")
+        self.strategy = strategy
+        self.max_pages = max_pages
+        self.workers = workers
+        self.session_kwargs = optional_object(session_kwargs, dict)
+        self.sink = sink
+        self.explode = explode
+        self.window = max(window, 1)
+        self.session_factory = session_factory
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"state={self.state!r}, state_message={self.state_message!r}, "
+            f"strategy={self.strategy!r}, max_pages={self.max_pages!r}, "
+            f"workers={self.workers!r}, sink={self.sink!r}, "
+            f"explode={self.explode!r}, window={self.window!r}"
+            ")"
+        )
+
+    async def do_callback(self, caller: AiohttpAction):
+        if caller.response is None:
+            self.fail(caller, "Response is None.")
+            return
+        results = PageResults(self.strategy, self.sink, self.explode)
+        try:
+            await results.add(caller, 1)
+            requests = self.strategy.page_requests(caller)
+            if requests is not None:
+                await self.fetch_concurrently(caller, requests, results)
+            else:
+                await PageFollower(self, caller, results).follow()
+        except Exception as ex:
+            logger.exception("Exception paginating with %r in action %s", self, caller)
+            self.fail(caller, "Exception fetching pages.")
+            raise ex
+        report = results.report()
+        caller.context["pfmsoft_page_report"] = report
+        caller.context["pfmsoft_page_count"] = report["page_count"]
+        caller.response_data = results.items if self.sink is None else None
+        if not report["complete"]:
+            logger.warning(
+                "Pages for %s are incomplete, failed pages: %s truncated: %s",
+                caller,
+                report["failed_pages"],
+                report["truncated"],
+            )
+        self.success(caller)
+
+    def make_page_action(
+        self,
+        caller: AiohttpAction,
+        request: AiohttpRequest,
+        page_number: int,
+        callbacks: Optional[List[AiohttpActionCallback]] = None,
+    ) -> AiohttpAction:
+        return AiohttpAction(
+            aiohttp_args=request,
+            max_attempts=caller.max_attempts,
+            name=f"{caller.uid} - page: {page_number}",
+            id_=str(page_number),
+            callbacks=ActionCallbacks(
+                success=[*(callbacks or []), ResponseContentToJson()]
+            ),
+            observers=caller.observers,
+            events=caller.events,
+            retry_codes=caller.retry_codes,
+        )
+
+    async def fetch_page(
+        self, session: ClientSession, action: AiohttpAction
+    ) -> AiohttpAction:
+        """Do a page action, retrying it as a queue worker would.
+
+        Exceptions are logged, and leave the action in a state other than success.
+        The state is set before the success callbacks run, so if one of them
+        raises, eg. the body is not valid json, the state is set to callback fail.
+        """
+        retries: Queue = Queue()
+        try:
+            await action.do_action(session, retries)
+            while not retries.empty():
+                retries.get_nowait()
+                await action.do_action(session, retries)
+        except Exception as ex:  # pylint: disable=broad-except
+            logger.exception("Exception fetching page %s", action)
+            if action.state == ActionState.SUCCESS:
+                action.update_state(
+                    ActionState.CALLBACK_FAIL,
+                    self.__class__.__name__,
+                    f"{ex.__class__.__name__} raised by a success callback.",
+                )
+        return action
+
+    async def fetch_concurrently(
+        self,
+        caller: AiohttpAction,
+        requests: Sequence[AiohttpRequest],
+        results: PageResults,
+    ):
+        """Fetch the pages with `workers` workers, at most `window` pages ahead."""
+        page_requests = requests[: self.max_pages - 1]
+        if len(page_requests) < len(requests):
+            results.truncated = True
+            logger.info(
+                "%s pages for %s, max_pages is %s, dropping the last %s.",
+                len(requests) + 1,
+                caller,
+                self.max_pages,
+                len(requests) - len(page_requests),
+            )
+        pages = iter(enumerate(page_requests, start=2))
+        buffer = PageReorderBuffer(results.add, window=self.window, next_page=2)
+        logger.info("Fetching %s more pages for %s", len(page_requests), caller)
+        async with self.session_factory(**self.session_kwargs) as session:
+
+            async def worker():
+                # Workers share the iterator, so pages are started in order.
+                for page_number, request in pages:
+                    await buffer.reserve(page_number)
+                    action = self.make_page_action(caller, request, page_number)
+                    action = await self.fetch_page(session, action)
+                    await buffer.add(page_number, action)
+
+            tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # The other workers may be waiting on the buffer, stop them
+                # before the session closes.
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+
+
+class PrefetchNextPage(AiohttpActionCallback):
+    """Used by :class:`PageFollower`, requests the next page once the headers arrive."""
+
+    def __init__(self, follower: "PageFollower") -> None:
+        super().__init__()
+        self.follower = follower
+
+    async def do_callback(self, caller: AiohttpAction):
+        self.follower.prefetch(caller)
+        self.success(caller)
+
+
+class PageFollower:
+    """Follow pages one at a time for :class:`Paginate`, prefetching the next page."""
+
+    def __init__(
+        self, paginate: Paginate, caller: AiohttpAction, results: PageResults
+    ) -> None:
+        self.paginate = paginate
+        self.strategy = paginate.strategy
+        self.caller = caller
+        self.results = results
+        self.page_count = 1
+        self.prefetched: Optional[Tuple[AiohttpRequest, asyncio.Task]] = None
+        self.prefetch_hits = 0
+        self.prefetch_misses = 0
+        self._session: Optional[ClientSession] = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"paginate={self.paginate!r}, page_count={self.page_count!r}, "
+            f"prefetch_hits={self.prefetch_hits!r}, "
+            f"prefetch_misses={self.prefetch_misses!r}"
+            ")"
+        )
+
+    async def follow(self):
+        current = self.caller
+        async with self.paginate.session_factory(
+            **self.paginate.session_kwargs
+        ) as session:
+            self._session = session
+            try:
+                while True:
+                    request = self.strategy.next_request(current)
+                    prefetched, self.prefetched = self.prefetched, None
+                    if prefetched is not None and prefetched[0] == request:
+                        self.prefetch_hits += 1
+                        task = prefetched[1]
+                    else:
+                        await self.discard(prefetched)
+                        if request is None:
+                            break
+                        if self.page_count >= self.paginate.max_pages:
+                            self.results.truncated = True
+                            break
+                        task = self.start_page(request)
+                    current = await task
+                    await self.results.add(current, int(current.id_))
+                    if current.state != ActionState.SUCCESS:
+                        break
+            finally:
+                await self.discard(self.prefetched)
+                self.prefetched = None
+        logger.info(
+            "Followed %s pages for %s, prefetch hits %s misses %s.",
+            self.page_count,
+            self.caller,
+            self.prefetch_hits,
+            self.prefetch_misses,
+        )
+
+    def start_page(self, request: AiohttpRequest) -> asyncio.Task:
+        self.page_count += 1
+        action = self.paginate.make_page_action(
+            self.caller, request, self.page_count, [PrefetchNextPage(self)]
+        )
+        assert self._session is not None
+        return asyncio.create_task(self.paginate.fetch_page(self._session, action))
+
+    def prefetch(self, action: AiohttpAction):
+        """Start the next page, if it is known from the headers of this page."""
+        if self.prefetched is not None or self.page_count >= self.paginate.max_pages:
+            return
+        request = self.strategy.early_request(action)
+        if request is not None:
+            self.prefetched = (request, self.start_page(request))
+
+    async def discard(self, prefetched: Optional[Tuple[AiohttpRequest, asyncio.Task]]):
+        """Drop a prefetched page that turned out not to be the next page."""
+        if prefetched is None:
+            return
+        self.prefetch_misses += 1
+        self.page_count -= 1
+        task = prefetched[1]
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
 class SaveResultToTxtFile(AiohttpActionCallback):
-    """Usually used after ResponseToText callback"""
+    """Usually used after ResponseToText callback
+
+    Output is compressed with a streaming encoder when `compression` is "gzip" or
+    "zstd". The default, "auto", picks the compression from a `.gz` or `.zst`
+    file suffix, eg. `result.json.gz`. `compression_level` is passed to the
+    encoder.
+    """
 
     def __init__(
         self,
@@ -214,6 +664,10 @@ class SaveResultToTxtFile(AiohttpActionCallback):
         file_path_template: Optional[str] = None,
         path_values: Optional[Dict[str, str]] = None,
         file_ending: Optional[str] = ".txt",
+        compression: Optional[str] = AUTO,
+        compression_level: Optional[int] = None,
+        path_resolver: Optional[PathResolver] = None,
+        durability: Optional[DurabilityPolicy] = None,
     ) -> None:
         super().__init__()
         if file_path is None and file_path_template is None:
@@ -222,10 +676,19 @@ class SaveResultToTxtFile(AiohttpActionCallback):
                 "Must have atleast one of those!"
             )
         self.file_path = file_path
+        # Kept so a repeated refine_path does not shard an already sharded path.
+        self.initial_file_path = file_path
         self.mode = mode
         self.file_path_template = file_path_template
         self.path_values = optional_object(path_values, dict)
         self.file_ending = file_ending
+        # Fail early on an unknown compression.
+        resolve_compression(compression, None)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.path_resolver = get_path_resolver(path_resolver)
+        self.durability = get_durability(durability)
+        self.write_path: Optional[Path] = None
 
     def __repr__(self) -> str:
         return (
@@ -234,6 +697,10 @@ class SaveResultToTxtFile(AiohttpActionCallback):
             f"file_path={self.file_path!r}, mode={self.mode!r}, "
             f"file_path_template={self.file_path_template!r}, "
             f"path_values={self.path_values!r}, file_ending={self.file_ending!r}, "
+            f"compression={self.compression!r}, "
+            f"compression_level={self.compression_level!r}, "
+            f"path_resolver={self.path_resolver!r}, "
+            f"durability={self.durability!r}, "
             ")"
         )
 
@@ -243,38 +710,113 @@ class SaveResultToTxtFile(AiohttpActionCallback):
         if self.file_path is None and self.file_path_template is None:
             raise ValueError("Must have a file_path or a file_path_template")
         if self.file_path_template is not None:
-            template = Template(str(self.file_path_template))
-            resolved_string = template.safe_substitute(self.path_values)
-            self.file_path = Path(resolved_string)
+            file_path = self.path_resolver.substitute(
+                str(self.file_path_template), self.path_values
+            )
+        else:
+            assert self.initial_file_path is not None
+            file_path = self.initial_file_path
+        self.file_path = self.path_resolver.shard(self.refine_suffixes(file_path))
+        self.write_path = None
+
+    def refine_suffixes(self, file_path: Path) -> Path:
+        """Apply the file ending, keeping or adding the compression suffix."""
+        compression = resolve_compression(self.compression, file_path)
+        if compression_from_path(file_path) is not None:
+            file_path = file_path.with_suffix("")
         if self.file_ending is not None:
-            assert self.file_path is not None
-            self.file_path = self.file_path.with_suffix(self.file_ending)
+            file_path = file_path.with_suffix(self.file_ending)
+        if compression is not None:
+            file_path = file_path.with_name(
+                file_path.name + SUFFIX_FOR_COMPRESSION[compression]
+            )
+        return file_path
+
+    def open_writer(self) -> AsyncFileWriter:
+        """Open the refined file path, compressing if needed."""
+        assert self.file_path is not None
+        compression = resolve_compression(self.compression, self.file_path)
+        self.write_path = self.durability.write_path(self.file_path, self.mode)
+        return AsyncFileWriter(
+            self.write_path,
+            mode=self.mode,
+            encoder=get_encoder(compression, self.compression_level),
+        )
+
+    async def commit(self):
+        """Move the written file into place, as the durability policy says."""
+        assert self.write_path is not None and self.file_path is not None
+        await self.durability.commit(self.write_path, self.file_path)
+
+    def get_data(self, caller: AiohttpAction) -> Any:
+        """The data to save, caller.response_data by default.
 
-    def get_data(self, caller: AiohttpAction) -> str:
-        """expects caller.response_data to be a string."""
+        Without a :meth:`serializer` it is written as is, and must be a string,
+        or bytes for a binary mode.
+        """
 
         data = caller.response_data
         return data
 
+    def serializer(self) -> Optional[Callable[[Any], Union[str, bytes]]]:
+        """A picklable function that turns the :meth:`get_data` data into file content.
+
+        It is run with :meth:`run_cpu_bound`. None to write the data as is.
+        """
+        return None
+
+    async def serialize(self, caller: AiohttpAction) -> Union[str, bytes]:
+        data = self.get_data(caller)
+        serializer = self.serializer()
+        if serializer is None:
+            return data
+        return await self.run_cpu_bound(serializer, data)
+
+    def remake_parent(self, ex: FileNotFoundError):
+        """Make the parent directory again after opening the file failed.
+
+        Re-raises `ex` if the path resolver had not made the directory, so the
+        directory was not removed since.
+        """
+        self.durability.discard(self.write_path, self.file_path)
+        assert self.file_path is not None
+        if not self.path_resolver.remake_parent(self.file_path):
+            raise ex
+        logger.info("Made %s again, it was removed.", self.file_path.parent)
+
+    async def write_data(self, data: Union[str, bytes]):
+        async with self.open_writer() as writer:
+            await writer.write(data)
+
     async def do_callback(self, caller: AiohttpAction):
         self.refine_path(caller)
         try:
             assert self.file_path is not None
-            self.file_path.parent.mkdir(parents=True, exist_ok=True)
-            async with aiofiles.open(
-                str(self.file_path), mode=self.mode
-            ) as file:  # type:ignore
-                data = self.get_data(caller)
-                await file.write(data)
-                self.success(caller)
+            self.path_resolver.ensure_parent(self.file_path)
+            data = await self.serialize(caller)
+            try:
+                await self.write_data(data)
+            except FileNotFoundError as ex:
+                self.remake_parent(ex)
+                await self.write_data(data)
+            await self.commit()
+            self.success(caller)
         except Exception as ex:
+            self.durability.discard(self.write_path, self.file_path)
             logger.exception("Exception saving file with %r in action %s", self, caller)
             self.fail(caller, f"Exception saving file to {self.file_path}")
             raise ex
 
 
 class SaveResultToJsonFile(SaveResultToTxtFile):
-    """Usually used after ResponseToJson callback."""
+    """Usually used after ResponseToJson callback.
+
+    The data is encoded with a :class:`JsonCodec` straight to bytes. Use
+    indent=None for compact output. If codec is None, the fastest available
+    codec is used, its output can differ from the standard library's, see
+    :mod:`pfmsoft.aiohttp_queue.json_codec`. Large results can be encoded off the
+    event loop by passing an executor.
+    """
 
     def __init__(
         self,
@@ -283,6 +825,13 @@ class SaveResultToJsonFile(SaveResultToTxtFile):
         file_path_template: Optional[str] = None,
         path_values: Optional[Dict[str, str]] = None,
         file_ending: str = ".json",
+        codec: Optional[JsonCodec] = None,
+        indent: Optional[int] = 2,
+        compression: Optional[str] = AUTO,
+        compression_level: Optional[int] = None,
+        path_resolver: Optional[PathResolver] = None,
+        durability: Optional[DurabilityPolicy] = None,
+        executor: Optional[Executor] = None,
     ) -> None:
         super().__init__(
             file_path=file_path,
@@ -290,17 +839,39 @@ class SaveResultToJsonFile(SaveResultToTxtFile):
             file_path_template=file_path_template,
             path_values=path_values,
             file_ending=file_ending,
+            compression=compression,
+            compression_level=compression_level,
+            path_resolver=path_resolver,
+            durability=durability,
         )
+        self.codec = optional_object(codec, get_json_codec)
+        self.indent = indent
+        self.executor = executor
 
-    def get_data(self, caller: AiohttpAction) -> str:
-        """expects data (caller.result in super) to be json."""
-        data = super().get_data(caller)
-        json_data = json.dumps(data, indent=2)
-        return json_data
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"state={self.state!r}, state_message={self.state_message!r}, "
+            f"file_path={self.file_path!r}, mode={self.mode!r}, "
+            f"file_path_template={self.file_path_template!r}, "
+            f"path_values={self.path_values!r}, file_ending={self.file_ending!r}, "
+            f"compression={self.compression!r}, "
+            f"compression_level={self.compression_level!r}, "
+            f"codec={self.codec!r}, indent={self.indent!r}, "
+            f"executor={self.executor!r}, "
+            ")"
+        )
+
+    def serializer(self) -> Callable[[Any], bytes]:
+        return partial(self.codec.dumps, indent=self.indent)
 
 
 class SaveResultToYamlFile(SaveResultToTxtFile):
-    """Usually used after ResponseToJson callback."""
+    """Usually used after ResponseToJson callback.
+
+    YAML dumping is slow pure Python, pass a ProcessPoolExecutor to keep it off
+    the event loop.
+    """
 
     def __init__(
         self,
@@ -309,6 +880,11 @@ class SaveResultToYamlFile(SaveResultToTxtFile):
         file_path_template: Optional[str] = None,
         path_values: Optional[Dict[str, str]] = None,
         file_ending: str = ".yaml",
+        compression: Optional[str] = AUTO,
+        compression_level: Optional[int] = None,
+        path_resolver: Optional[PathResolver] = None,
+        durability: Optional[DurabilityPolicy] = None,
+        executor: Optional[Executor] = None,
     ) -> None:
         super().__init__(
             file_path=file_path,
@@ -316,19 +892,38 @@ class SaveResultToYamlFile(SaveResultToTxtFile):
             file_path_template=file_path_template,
             path_values=path_values,
             file_ending=file_ending,
+            compression=compression,
+            compression_level=compression_level,
+            path_resolver=path_resolver,
+            durability=durability,
         )
+        self.executor = executor
 
-    def get_data(self, caller: AiohttpAction) -> str:
-        """expects data (caller.result in super) to be json."""
-        data = super().get_data(caller)
-        yaml_data = yaml.dump(data, sort_keys=False)
-        return yaml_data
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"state={self.state!r}, state_message={self.state_message!r}, "
+            f"file_path={self.file_path!r}, mode={self.mode!r}, "
+            f"file_path_template={self.file_path_template!r}, "
+            f"path_values={self.path_values!r}, file_ending={self.file_ending!r}, "
+            f"compression={self.compression!r}, "
+            f"compression_level={self.compression_level!r}, "
+            f"executor={self.executor!r}, "
+            ")"
+        )
+
+    def serializer(self) -> Callable[[Any], str]:
+        return dump_yaml
 
 
 class SaveListOfDictResultToCSVFile(SaveResultToTxtFile):
     """Save the result to a CSV file.
 
     Expects the result to be a List[Dict].
+
+    Rows are serialized and written in `executor`, the event loop's default
+    executor if None, so large files do not block the event loop. At most
+    `rows_per_write` rows are buffered before they are written.
     """
 
     def __init__(
@@ -340,6 +935,12 @@ class SaveListOfDictResultToCSVFile(SaveResultToTxtFile):
         file_ending: str = ".csv",
         field_names: Optional[List[str]] = None,
         additional_fields: Dict = None,
+        compression: Optional[str] = AUTO,
+        compression_level: Optional[int] = None,
+        rows_per_write: int = 1000,
+        executor: Optional[Executor] = None,
+        path_resolver: Optional[PathResolver] = None,
+        durability: Optional[DurabilityPolicy] = None,
     ) -> None:
         super().__init__(
             file_path=file_path,
@@ -347,9 +948,15 @@ class SaveListOfDictResultToCSVFile(SaveResultToTxtFile):
             file_path_template=file_path_template,
             path_values=path_values,
             file_ending=file_ending,
+            compression=compression,
+            compression_level=compression_level,
+            path_resolver=path_resolver,
+            durability=durability,
         )
         self.field_names = field_names
         self.additional_fields = additional_fields
+        self.rows_per_write = rows_per_write
+        self.executor = executor
 
     def __repr__(self) -> str:
         return (
@@ -358,7 +965,10 @@ class SaveListOfDictResultToCSVFile(SaveResultToTxtFile):
             f"file_path={self.file_path!r}, mode={self.mode!r}, "
             f"file_path_template={self.file_path_template!r}, "
             f"path_values={self.path_values!r}, file_ending={self.file_ending!r}, "
+            f"compression={self.compression!r}, "
+            f"compression_level={self.compression_level!r}, "
             f"field_names={self.field_names!r}, additional_fields={self.additional_fields!r}, "
+            f"rows_per_write={self.rows_per_write!r}, executor={self.executor!r}, "
             ")"
         )
 
@@ -375,23 +985,188 @@ class SaveListOfDictResultToCSVFile(SaveResultToTxtFile):
             return combined_data
         return data
 
+    def write_csv(self, caller: AiohttpAction):
+        """Serialize and write the rows. Blocking, runs in the executor."""
+        assert self.file_path is not None
+        self.path_resolver.ensure_parent(self.file_path)
+        data = self.get_data(caller)
+        if self.field_names is None:
+            first, data_iter = spy(data)
+            self.field_names = list(first[0].keys())
+            data = data_iter
+        try:
+            self.write_rows(data)
+        except FileNotFoundError as ex:
+            # Raised when opening the file, before any rows are taken from data.
+            self.remake_parent(ex)
+            self.write_rows(data)
+
+    def write_rows(self, data: Iterable[Dict]):
+        assert self.file_path is not None
+        compression = resolve_compression(self.compression, self.file_path)
+        self.write_path = self.durability.write_path(self.file_path, self.mode)
+        with FileWriter(
+            self.write_path,
+            mode=self.mode,
+            encoder=get_encoder(compression, self.compression_level),
+        ) as file:
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=self.field_names)
+            writer.writeheader()
+            for row_count, item in enumerate(data, start=1):
+                writer.writerow(item)
+                if row_count % self.rows_per_write == 0:
+                    file.write(buffer.getvalue())
+                    buffer.seek(0)
+                    buffer.truncate()
+            file.write(buffer.getvalue())
+
     async def do_callback(self, caller: AiohttpAction):
         self.refine_path(caller)
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self.write_csv, caller)
+            await self.commit()
+            self.success(caller)
+        except Exception as ex:
+            self.durability.discard(self.write_path, self.file_path)
+            logger.exception("Exception saving file with %r in action %s", self, caller)
+            self.fail(caller, f"Exception saving file to {self.file_path}")
+            raise ex
+
+
+class SaveResponseStreamToFile(SaveResultToTxtFile):
+    """Stream the response body straight to a file, without buffering it in memory.
+
+    Use this instead of a ResponseContentTo* callback, as it consumes the body.
+    The body is read in chunks of `chunk_size` bytes, so memory use stays constant
+    regardless of the size of the download. If `hash_name` is given, a
+    :mod:`hashlib` digest of the body is computed along the way, and stored in
+    `caller.context["pfmsoft_stream_hash"]`. The digest is of the body as
+    received, before any compression on disk.
+    """
+
+    def __init__(
+        self,
+        file_path: Optional[Path] = None,
+        mode: str = "wb",
+        file_path_template: Optional[str] = None,
+        path_values: Optional[Dict[str, str]] = None,
+        file_ending: Optional[str] = None,
+        chunk_size: int = 65536,
+        hash_name: Optional[str] = None,
+        compression: Optional[str] = AUTO,
+        compression_level: Optional[int] = None,
+        path_resolver: Optional[PathResolver] = None,
+        durability: Optional[DurabilityPolicy] = None,
+    ) -> None:
+        super().__init__(
+            file_path=file_path,
+            mode=mode,
+            file_path_template=file_path_template,
+            path_values=path_values,
+            file_ending=file_ending,
+            compression=compression,
+            compression_level=compression_level,
+            path_resolver=path_resolver,
+            durability=durability,
+        )
+        if "b" not in mode:
+            raise ValueError(f"Mode must be a binary mode, got {mode!r}")
+        if hash_name is not None:
+            # Fail early on an unknown hash name.
+            hashlib.new(hash_name)
+        self.chunk_size = chunk_size
+        self.hash_name = hash_name
+        self.bytes_written: int = 0
+        self.hexdigest: Optional[str] = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"state={self.state!r}, state_message={self.state_message!r}, "
+            f"file_path={self.file_path!r}, mode={self.mode!r}, "
+            f"file_path_template={self.file_path_template!r}, "
+            f"path_values={self.path_values!r}, file_ending={self.file_ending!r}, "
+            f"compression={self.compression!r}, "
+            f"compression_level={self.compression_level!r}, "
+            f"chunk_size={self.chunk_size!r}, hash_name={self.hash_name!r}, "
+            f"bytes_written={self.bytes_written!r}, hexdigest={self.hexdigest!r}, "
+            ")"
+        )
+
+    async def do_callback(self, caller: AiohttpAction):
+        if caller.response is None:
+            self.fail(caller, "Response is None.")
+            return
+        self.refine_path(caller)
         try:
             assert self.file_path is not None
-            self.file_path.parent.mkdir(parents=True, exist_ok=True)
-            data = self.get_data(caller)
-            if self.field_names is None:
-                first, data_iter = spy(data)
-                self.field_names = list(first[0].keys())
-                data = data_iter
-            with open(str(self.file_path), mode=self.mode) as file:
-                writer = csv.DictWriter(file, fieldnames=self.field_names)
-                writer.writeheader()
-                for item in data:
-                    writer.writerow(item)
+            self.path_resolver.ensure_parent(self.file_path)
+            try:
+                hasher = await self.write_stream(caller)
+            except FileNotFoundError as ex:
+                if self.bytes_written:
+                    raise
+                self.remake_parent(ex)
+                hasher = await self.write_stream(caller)
+            await self.commit()
+            if hasher is not None:
+                self.hexdigest = hasher.hexdigest()
+                caller.context["pfmsoft_stream_hash"] = {
+                    "hash_name": self.hash_name,
+                    "hexdigest": self.hexdigest,
+                }
             self.success(caller)
         except Exception as ex:
+            self.durability.discard(self.write_path, self.file_path)
             logger.exception("Exception saving file with %r in action %s", self, caller)
             self.fail(caller, f"Exception saving file to {self.file_path}")
             raise ex
+
+    async def write_stream(self, caller: AiohttpAction) -> Optional[Any]:
+        """Write the body to the file, and return the hasher if there is one."""
+        assert caller.response is not None
+        hasher = hashlib.new(self.hash_name) if self.hash_name else None
+        self.bytes_written = 0
+        async with self.open_writer() as file:
+            async for chunk in caller.response.content.iter_chunked(self.chunk_size):
+                if hasher is not None:
+                    hasher.update(chunk)
+                await file.write(chunk)
+                self.bytes_written += len(chunk)
+        return hasher
+
+
+class SaveResultToSink(AiohttpActionCallback):
+    """Put the result into a shared :class:`~pfmsoft.aiohttp_queue.sinks.AsyncSink`.
+
+    If `explode` is True and the result is a list, each item is a separate record.
+    """
+
+    def __init__(self, sink: AsyncSink, explode: bool = False) -> None:
+        super().__init__()
+        self.sink = sink
+        self.explode = explode
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"state={self.state!r}, state_message={self.state_message!r}, "
+            f"sink={self.sink!r}, explode={self.explode!r}"
+            ")"
+        )
+
+    async def do_callback(self, caller: AiohttpAction):
+        try:
+            if self.explode and isinstance(caller.response_data, list):
+                await self.sink.put_many(caller.response_data)
+            else:
+                await self.sink.put(caller.response_data)
+            self.success(caller)
+        except Exception as ex:
+            logger.exception(
+                "Exception saving to sink with %r in action %s", self, caller
+            )
+            self.fail(caller, f"Exception saving to sink {self.sink!r}")
+            raise ex
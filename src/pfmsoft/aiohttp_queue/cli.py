@@ -0,0 +1,439 @@
+"""Run jobs described in job files from the command line.
+
+A job file is a stream of items, read one at a time as the queue has room, so a
+job of millions of requests is never loaded at once:
+
+- ``.jsonl`` or ``.ndjson``, one JSON object per line.
+- ``.json``, a JSON array of objects.
+- ``.yaml`` or ``.yml``, YAML documents, each an object or a list of objects.
+
+The first item may hold the job settings, under a ``job`` key. The command line
+options override them. Every other item is a request:
+
+.. code:: yaml
+
+    job:
+      workers: 20
+      rate: 50                 # new requests per second
+      limit: 100               # connections
+      limit_per_host: 10
+      timeout: 60
+      max_attempts: 3
+      output: results.jsonl    # .jsonl[.gz|.zst], .sqlite or .parquet
+      callbacks: [json, {name: sink, explode: true}]
+      defaults:
+        headers: {Accept: application/json}
+    ---
+    url: https://example.com/items
+    params: {page: 1}
+    ---
+    - url: https://example.com/other
+      name: other
+      callbacks: [text, {name: save_text, file_path: other.txt}]
+
+A request has a `url`, and optionally `method`, `params`, `data`, `json`,
+`headers`, `name`, `id`, `max_attempts`, `retry_codes`, `context` and
+`callbacks`. The `defaults` are merged into each request. Callbacks are named,
+see :data:`CALLBACKS`, with their args in a mapping with the name. Without
+callbacks, responses are decoded as JSON, and put in the output if there is
+one.
+
+.. code:: shell
+
+    pfmsoft_aiohttp_queue run jobs.jsonl --workers 50 --output results.jsonl
+"""
+import json
+import logging
+import sys
+from itertools import chain
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+import click
+import yaml
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    AiohttpAction,
+    AiohttpActionCallback,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.json_stream import JsonArrayScanner
+from pfmsoft.aiohttp_queue.progress import ProgressReporter, format_bytes
+from pfmsoft.aiohttp_queue.runners import SessionFactory, do_streaming_queue_runner
+from pfmsoft.aiohttp_queue.sinks import (
+    AsyncSink,
+    JsonLinesSink,
+    ParquetSink,
+    SqliteSink,
+)
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+JOB_KEY = "job"
+DEFAULT_SETTINGS: Dict[str, Any] = {
+    "workers": 10,
+    "max_queued": 1000,
+    "rate": None,
+    "limit": 100,
+    "limit_per_host": 0,
+    "timeout": 300.0,
+    "max_attempts": 1,
+    "output": None,
+    "output_table": "results",
+    "callbacks": None,
+    "defaults": {},
+}
+REQUEST_KEYS = {
+    "url",
+    "method",
+    "params",
+    "data",
+    "json",
+    "headers",
+    "name",
+    "id",
+    "max_attempts",
+    "retry_codes",
+    "context",
+    "callbacks",
+}
+CallbackSpec = Union[str, Dict[str, Any]]
+
+
+class JobFileError(ValueError):
+    """A job file, or an item in it, is not valid."""
+
+
+def iter_jsonl(path: Path) -> Iterator[Any]:
+    with open(path, "rb") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as ex:
+                raise JobFileError(f"{path}, line {line_number}: {ex}") from ex
+
+
+def iter_json_array(path: Path, chunk_size: int = 65536) -> Iterator[Any]:
+    scanner = JsonArrayScanner()
+    try:
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(chunk_size), b""):
+                for item in scanner.feed(chunk):
+                    yield json.loads(item)
+        scanner.close()
+    except ValueError as ex:
+        raise JobFileError(f"{path}: {ex}") from ex
+
+
+def iter_yaml(path: Path) -> Iterator[Any]:
+    with open(path, "r") as file:
+        try:
+            for document in yaml.safe_load_all(file):
+                if isinstance(document, list):
+                    yield from document
+                elif document is not None:
+                    yield document
+        except yaml.YAMLError as ex:
+            raise JobFileError(f"{path}: {ex}") from ex
+
+
+def iter_job_items(path: Path) -> Iterator[Any]:
+    """The items of a job file, read as they are needed."""
+    suffix = path.suffix.lower()
+    if suffix in (".jsonl", ".ndjson"):
+        return iter_jsonl(path)
+    if suffix == ".json":
+        return iter_json_array(path)
+    if suffix in (".yaml", ".yml"):
+        return iter_yaml(path)
+    raise JobFileError(
+        f"{path}: unknown job file type {suffix!r}, "
+        "expected .jsonl, .ndjson, .json, .yaml or .yml."
+    )
+
+
+def make_output_sink(path: Path, table: str = "results") -> AsyncSink:
+    """A sink for the output path, by its suffix."""
+    suffixes = [suffix.lower() for suffix in path.suffixes]
+    if ".parquet" in suffixes:
+        return ParquetSink(path)
+    if ".sqlite" in suffixes or ".db" in suffixes:
+        return SqliteSink(path, table)
+    return JsonLinesSink(path)
+
+
+def _sink_callback(sink: Optional[AsyncSink], explode: bool = False):
+    if sink is None:
+        raise JobFileError("The sink callback needs an output.")
+    return AC.SaveResultToSink(sink, explode=explode)
+
+
+def _file_callback(callback_class: Callable[..., AiohttpActionCallback]):
+    def make(sink: Optional[AsyncSink], **kwargs) -> AiohttpActionCallback:
+        _ = sink
+        if kwargs.get("file_path") is not None:
+            kwargs["file_path"] = Path(kwargs["file_path"])
+        return callback_class(**kwargs)
+
+    return make
+
+
+#: Callback name: a function of the output sink and the callback args.
+CALLBACKS: Dict[str, Callable[..., AiohttpActionCallback]] = {
+    "json": lambda sink: AC.ResponseContentToJson(),
+    "text": lambda sink: AC.ResponseContentToText(),
+    "sink": _sink_callback,
+    "save_text": _file_callback(AC.SaveResultToTxtFile),
+    "save_json": _file_callback(AC.SaveResultToJsonFile),
+    "save_yaml": _file_callback(AC.SaveResultToYamlFile),
+    "save_csv": _file_callback(AC.SaveListOfDictResultToCSVFile),
+    "save_stream": _file_callback(AC.SaveResponseStreamToFile),
+}
+
+
+def make_callback(
+    spec: CallbackSpec, sink: Optional[AsyncSink]
+) -> AiohttpActionCallback:
+    """A callback from its name, or a mapping of its name and args."""
+    if isinstance(spec, str):
+        name, kwargs = spec, {}
+    elif isinstance(spec, dict) and "name" in spec:
+        kwargs = dict(spec)
+        name = kwargs.pop("name")
+    else:
+        raise JobFileError(f"A callback is a name, or a mapping with a name: {spec!r}")
+    factory = CALLBACKS.get(name)
+    if factory is None:
+        raise JobFileError(
+            f"Unknown callback {name!r}, expected one of {', '.join(CALLBACKS)}."
+        )
+    try:
+        return factory(sink, **kwargs)
+    except TypeError as ex:
+        raise JobFileError(f"Bad args for callback {name!r}: {ex}") from ex
+
+
+class Job:
+    """The settings and actions of a job file.
+
+    Args:
+        path: The job file.
+        overrides: Settings that replace the file's, eg. from command line options.
+            None values are ignored.
+    """
+
+    def __init__(self, path: Path, overrides: Optional[Dict[str, Any]] = None) -> None:
+        self.path = path
+        self._items = iter_job_items(path)
+        first = next(self._items, None)
+        file_settings: Dict[str, Any] = {}
+        if isinstance(first, dict) and JOB_KEY in first:
+            file_settings = first[JOB_KEY] or {}
+            first = None
+        unknown = set(file_settings) - set(DEFAULT_SETTINGS)
+        if unknown:
+            raise JobFileError(f"{path}: unknown job settings {sorted(unknown)}.")
+        self.settings: Dict[str, Any] = {**DEFAULT_SETTINGS, **file_settings}
+        for key, value in (overrides or {}).items():
+            if value is not None:
+                self.settings[key] = value
+        if first is not None:
+            self._items = chain([first], self._items)
+        self.sink: Optional[AsyncSink] = None
+        if self.settings["output"] is not None:
+            self.sink = make_output_sink(
+                Path(self.settings["output"]), self.settings["output_table"]
+            )
+        self.callbacks: List[CallbackSpec] = self.settings["callbacks"] or (
+            ["json", "sink"] if self.sink is not None else ["json"]
+        )
+        self.request_count = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"path={self.path!r}, settings={self.settings!r}, "
+            f"request_count={self.request_count!r}"
+            ")"
+        )
+
+    def make_action(self, item: Any) -> AiohttpAction:
+        if not isinstance(item, dict):
+            raise JobFileError(f"A request is a mapping, got {item!r}")
+        defaults: Dict[str, Any] = self.settings["defaults"] or {}
+        request = {**defaults, **item}
+        for key in ("headers", "params"):
+            if isinstance(defaults.get(key), dict) and isinstance(item.get(key), dict):
+                request[key] = {**defaults[key], **item[key]}
+        unknown = set(request) - REQUEST_KEYS
+        if unknown:
+            raise JobFileError(f"Unknown request keys {sorted(unknown)} in {item!r}")
+        if "url" not in request:
+            raise JobFileError(f"A request needs a url: {item!r}")
+        callbacks = [
+            make_callback(spec, self.sink)
+            for spec in request.get("callbacks") or self.callbacks
+        ]
+        return AiohttpAction(
+            AiohttpRequest(
+                method=request.get("method", "get"),
+                url=request["url"],
+                params=request.get("params"),
+                data=request.get("data"),
+                json=request.get("json"),
+                headers=request.get("headers"),
+            ),
+            name=str(request.get("name", "")),
+            id_=str(request.get("id", "")),
+            max_attempts=request.get("max_attempts", self.settings["max_attempts"]),
+            context=request.get("context"),
+            callbacks=ActionCallbacks(success=callbacks),
+            retry_codes=request.get("retry_codes"),
+        )
+
+    def actions(self) -> Iterator[AiohttpAction]:
+        """Make an action for each request, as they are read."""
+        for item in self._items:
+            self.request_count += 1
+            yield self.make_action(item)
+
+    def session_factory(self) -> SessionFactory:
+        """Sessions with the job's connector limits."""
+        limit = self.settings["limit"]
+        limit_per_host = self.settings["limit_per_host"]
+
+        def make_session(**session_kwargs) -> ClientSession:
+            # The connector is made in the runner's loop.
+            connector = TCPConnector(limit=limit, limit_per_host=limit_per_host)
+            return ClientSession(connector=connector, **session_kwargs)
+
+        return make_session
+
+    def run(self, progress: Optional[ProgressReporter] = None) -> Dict[str, Any]:
+        """Run the job with the streaming queue runner, and return its summary."""
+        timeout = self.settings["timeout"]
+        return do_streaming_queue_runner(
+            self.actions(),
+            [AiohttpQueueWorker() for _ in range(self.settings["workers"])],
+            session_kwargs={"timeout": ClientTimeout(total=timeout)},
+            sinks=[self.sink] if self.sink is not None else None,
+            progress=progress,
+            session_factory=self.session_factory(),
+            max_queued=self.settings["max_queued"],
+            rate=self.settings["rate"],
+        )
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    return (
+        f"{summary['actions']} actions in {summary['seconds']:.2f} seconds, "
+        f"{summary['actions_per_second']:.2f} actions per second "
+        f"with {summary['workers']} workers. "
+        f"ok={summary['succeeded']} failed={summary['failed']} "
+        f"retries={summary['retries']} "
+        f"received {format_bytes(summary['bytes_received'])}."
+    )
+
+
+@click.group()
+@click.option("-v", "--verbose", count=True, help="Log more, -vv for debug logs.")
+def main(verbose: int):
+    """Run aiohttp request jobs."""
+    levels = (logging.WARNING, logging.INFO, logging.DEBUG)
+    logging.basicConfig(
+        level=levels[min(verbose, len(levels) - 1)],
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+    )
+
+
+@main.command()
+@click.argument(
+    "job_file", type=click.Path(exists=True, dir_okay=False, path_type=Path)
+)
+@click.option("-w", "--workers", type=click.IntRange(min=1), help="Queue workers.")
+@click.option(
+    "--limit", type=click.IntRange(min=0), help="Connections, 0 for no limit."
+)
+@click.option(
+    "--limit-per-host",
+    type=click.IntRange(min=0),
+    help="Connections to one host, 0 for no limit.",
+)
+@click.option(
+    "--rate",
+    type=click.FloatRange(min=0, min_open=True),
+    help="New requests per second.",
+)
+@click.option(
+    "--max-queued",
+    type=click.IntRange(min=1),
+    help="Requests read ahead of the workers.",
+)
+@click.option("--timeout", type=float, help="Seconds for each request.")
+@click.option(
+    "--max-attempts", type=click.IntRange(min=1), help="Attempts per request."
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Save results to a .jsonl, .sqlite or .parquet file.",
+)
+@click.option("--output-table", help="The table, for a .sqlite output.")
+@click.option(
+    "--progress/--no-progress", default=True, help="Show a progress line on stderr."
+)
+@click.option("--json", "as_json", is_flag=True, help="Print the summary as JSON.")
+def run(
+    job_file: Path,
+    workers: Optional[int],
+    limit: Optional[int],
+    limit_per_host: Optional[int],
+    rate: Optional[float],
+    max_queued: Optional[int],
+    timeout: Optional[float],
+    max_attempts: Optional[int],
+    output: Optional[Path],
+    output_table: Optional[str],
+    progress: bool,
+    as_json: bool,
+):
+    """Run the requests in JOB_FILE, a .jsonl, .json or .yaml job file."""
+    overrides = {
+        "workers": workers,
+        "limit": limit,
+        "limit_per_host": limit_per_host,
+        "rate": rate,
+        "max_queued": max_queued,
+        "timeout": timeout,
+        "max_attempts": max_attempts,
+        "output": output,
+        "output_table": output_table,
+    }
+    try:
+        job = Job(job_file, overrides)
+        reporter = ProgressReporter(
+            interval=1.0, window=10.0, stream=sys.stderr if progress else None
+        )
+        summary = job.run(reporter)
+    except JobFileError as ex:
+        raise click.ClickException(str(ex)) from ex
+    summary.update(
+        {
+            "succeeded": reporter.succeeded,
+            "failed": reporter.failed,
+            "retries": reporter.retries,
+            "bytes_received": reporter.bytes_received,
+        }
+    )
+    if as_json:
+        click.echo(json.dumps(summary))
+    else:
+        click.echo(format_summary(summary))
@@ -0,0 +1,242 @@
+"""Compressed file output, and content encoding negotiation for requests.
+
+The file saving callbacks write through an :class:`AsyncFileWriter`, or a
+:class:`FileWriter` when writing from a worker thread, which compress with a
+streaming :class:`StreamEncoder` as data is written. gzip is
+always available, zstd needs the optional `zstandard` package.
+
+aiohttp decompresses responses transparently. :func:`accept_encoding` builds an
+Accept-Encoding header for the encodings aiohttp can decode in this environment,
+adding brotli when the `Brotli` package is installed.
+"""
+import logging
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+
+import aiofiles
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+#: File suffixes that select a compression.
+COMPRESSION_SUFFIXES: Dict[str, str] = {".gz": "gzip", ".zst": "zstd"}
+#: The file suffix for each compression.
+SUFFIX_FOR_COMPRESSION: Dict[str, str] = {
+    value: key for key, value in COMPRESSION_SUFFIXES.items()
+}
+#: Use the file suffix to choose the compression.
+AUTO = "auto"
+
+
+class StreamEncoder:
+    """Pass through encoder, and the base class for compressing encoders."""
+
+    name: Optional[str] = None
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(" f"name={self.name!r}" ")"
+
+
+class GzipEncoder(StreamEncoder):
+    name = "gzip"
+
+    def __init__(self, level: Optional[int] = None) -> None:
+        # wbits of 31 writes a gzip header and trailer.
+        self._compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION if level is None else level, zlib.DEFLATED, 31
+        )
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class ZstdEncoder(StreamEncoder):
+    name = "zstd"
+
+    def __init__(self, level: Optional[int] = None) -> None:
+        import zstandard  # pylint: disable=import-outside-toplevel
+
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+        self._compressor = compressor.compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+ENCODER_FACTORIES: Dict[str, Callable[..., StreamEncoder]] = {
+    "gzip": GzipEncoder,
+    "zstd": ZstdEncoder,
+}
+
+
+def compression_from_path(file_path: Path) -> Optional[str]:
+    """The compression selected by the file suffix, or None."""
+    return COMPRESSION_SUFFIXES.get(file_path.suffix.lower())
+
+
+def resolve_compression(
+    compression: Optional[str], file_path: Optional[Path]
+) -> Optional[str]:
+    """Resolve `AUTO` to the compression for the file suffix."""
+    if compression == AUTO:
+        if file_path is None:
+            return None
+        return compression_from_path(file_path)
+    if compression is not None and compression not in ENCODER_FACTORIES:
+        raise ValueError(
+            f"Unknown compression {compression!r}, expected one of "
+            f"{[AUTO, None, *ENCODER_FACTORIES]}"
+        )
+    return compression
+
+
+def get_encoder(
+    compression: Optional[str], level: Optional[int] = None
+) -> StreamEncoder:
+    """Make a new encoder. A compression of None gives a pass through encoder."""
+    if compression is None:
+        return StreamEncoder()
+    return ENCODER_FACTORIES[compression](level)
+
+
+class AsyncFileWriter:
+    """Write str or bytes to a file, through a :class:`StreamEncoder`.
+
+    The file is always opened in binary mode, str is encoded as utf-8.
+
+    .. code:: python
+
+        async with AsyncFileWriter(path, "w", get_encoder("gzip")) as writer:
+            await writer.write("some text")
+    """
+
+    def __init__(
+        self,
+        file_path: Path,
+        mode: str = "w",
+        encoder: Optional[StreamEncoder] = None,
+    ) -> None:
+        self.file_path = file_path
+        self.mode = mode if "b" in mode else mode + "b"
+        self.encoder: StreamEncoder = (
+            encoder if encoder is not None else StreamEncoder()
+        )
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._file: Any = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"file_path={self.file_path!r}, mode={self.mode!r}, "
+            f"encoder={self.encoder!r}, bytes_in={self.bytes_in!r}, "
+            f"bytes_out={self.bytes_out!r}"
+            ")"
+        )
+
+    async def __aenter__(self) -> "AsyncFileWriter":
+        self._file = await aiofiles.open(str(self.file_path), mode=self.mode)
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is None:
+                await self._write_raw(self.encoder.flush())
+        finally:
+            await self._file.close()
+
+    async def write(self, data: Union[str, bytes]):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.bytes_in += len(data)
+        await self._write_raw(self.encoder.compress(data))
+
+    async def _write_raw(self, data: bytes):
+        if data:
+            self.bytes_out += len(data)
+            await self._file.write(data)
+
+
+class FileWriter:
+    """The blocking version of :class:`AsyncFileWriter`, for use in a worker thread."""
+
+    def __init__(
+        self,
+        file_path: Path,
+        mode: str = "w",
+        encoder: Optional[StreamEncoder] = None,
+    ) -> None:
+        self.file_path = file_path
+        self.mode = mode if "b" in mode else mode + "b"
+        self.encoder: StreamEncoder = (
+            encoder if encoder is not None else StreamEncoder()
+        )
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._file: Any = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"file_path={self.file_path!r}, mode={self.mode!r}, "
+            f"encoder={self.encoder!r}, bytes_in={self.bytes_in!r}, "
+            f"bytes_out={self.bytes_out!r}"
+            ")"
+        )
+
+    def __enter__(self) -> "FileWriter":
+        self._file = open(str(self.file_path), mode=self.mode)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is None:
+                self._write_raw(self.encoder.flush())
+        finally:
+            self._file.close()
+
+    def write(self, data: Union[str, bytes]):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.bytes_in += len(data)
+        self._write_raw(self.encoder.compress(data))
+
+    def _write_raw(self, data: bytes):
+        if data:
+            self.bytes_out += len(data)
+            self._file.write(data)
+
+
+def available_content_encodings() -> Dict[str, bool]:
+    """The content encodings aiohttp can decode in this environment."""
+    encodings = {"gzip": True, "deflate": True, "br": False}
+    for module_name in ("brotli", "brotlicffi"):
+        try:
+            __import__(module_name)
+            encodings["br"] = True
+            break
+        except ImportError:
+            pass
+    return encodings
+
+
+def accept_encoding() -> str:
+    """An Accept-Encoding header value, for the encodings aiohttp can decode."""
+    return ", ".join(
+        encoding
+        for encoding, available in available_content_encodings().items()
+        if available
+    )
@@ -0,0 +1,206 @@
+"""Atomic file writes, and how hard to try to get them onto the disk.
+
+The file saving callbacks write to a temporary file next to the target, and
+rename it into place when the write is complete, so a crash never leaves a
+truncated file at the target path. Only files opened in a "w" mode are written
+this way. Append, exclusive create ("x") and update modes are written in place,
+so eg. "x" still raises FileExistsError for an existing file.
+
+A durability policy chooses the fsync cost:
+
+- :class:`DurabilityPolicy`, no fsync. The rename is atomic, but a power loss may
+  lose recent files. The default.
+- :class:`FsyncDurability`, fsync each file, and its directory, before the callback
+  succeeds.
+- :class:`GroupCommitDurability`, collect the files written in `interval` seconds,
+  and fsync them, and their directories once each, as a batch. Callbacks still
+  wait for their file to be committed, but share the syncs.
+
+.. code:: python
+
+    durability = GroupCommitDurability(interval=0.05)
+    callback = SaveResultToJsonFile(file_path, durability=durability)
+    ...
+    do_queue_runner(actions, workers, sinks=[durability])
+"""
+import asyncio
+import logging
+import os
+import uuid
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Any, List, Optional, Sequence, Set, Tuple
+
+from pfmsoft.aiohttp_queue.sinks import AsyncSink
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def fsync_path(file_path: Path):
+    """Flush a closed file's data to disk."""
+    file_descriptor = os.open(str(file_path), os.O_RDONLY)
+    try:
+        os.fsync(file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+
+def fsync_directory(directory: Path):
+    """Flush a directory's entries to disk, so a rename survives a crash."""
+    if os.name == "nt":
+        # Directories can not be opened for fsync on Windows.
+        return
+    fsync_path(directory)
+
+
+def commit_files(paths: Sequence[Tuple[Path, Path]], sync: bool = True):
+    """Rename each written path to its target path. Blocking.
+
+    With `sync`, the files are fsynced before the renames, and each directory
+    once after them.
+
+    Args:
+        paths: Pairs of (write_path, file_path). When they are equal the file
+            was written in place and is only synced.
+        sync: Fsync the files and directories.
+    """
+    if sync:
+        for write_path, _ in paths:
+            fsync_path(write_path)
+    directories: Set[Path] = set()
+    for write_path, file_path in paths:
+        if write_path != file_path:
+            os.replace(write_path, file_path)
+        directories.add(file_path.parent)
+    if sync:
+        for directory in directories:
+            fsync_directory(directory)
+
+
+class DurabilityPolicy:
+    """Atomic writes, without fsync.
+
+    Args:
+        atomic: Write to a temporary file and rename it into place. If False,
+            files are written in place.
+    """
+
+    def __init__(self, atomic: bool = True) -> None:
+        self.atomic = atomic
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(" f"atomic={self.atomic!r}" ")"
+
+    def write_path(self, file_path: Path, mode: str) -> Path:
+        """The path to write to, before the file is committed to `file_path`."""
+        if not self.atomic or "w" not in mode:
+            # A rename would replace the file that "x" must not touch, and "a" and
+            # "r+" need its contents.
+            return file_path
+        return file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex[:12]}.tmp")
+
+    async def commit(self, write_path: Path, file_path: Path):
+        """Move a completely written file into place."""
+        commit_files([(write_path, file_path)], sync=False)
+
+    def discard(self, write_path: Optional[Path], file_path: Optional[Path]):
+        """Remove the temporary file after a failed write."""
+        if write_path is None or write_path == file_path:
+            return
+        try:
+            write_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class FsyncDurability(DurabilityPolicy):
+    """Fsync every file, and its directory, as it is committed.
+
+    The syncs run in `executor`, the loop's default executor if None.
+    """
+
+    def __init__(self, atomic: bool = True, executor: Optional[Executor] = None):
+        super().__init__(atomic=atomic)
+        self.executor = executor
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"atomic={self.atomic!r}, executor={self.executor!r}"
+            ")"
+        )
+
+    async def commit(self, write_path: Path, file_path: Path):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self.executor, commit_files, [(write_path, file_path)]
+        )
+
+
+class GroupCommitDurability(AsyncSink, DurabilityPolicy):
+    """Fsync files in batches, collected over `interval` seconds.
+
+    A commit waits until its batch is synced and renamed. A batch is committed
+    `interval` seconds after its first file, or when it holds `max_batch` files.
+    The committer is an :class:`~pfmsoft.aiohttp_queue.sinks.AsyncSink`, pass it
+    to the runner with the other sinks so it is closed.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.05,
+        max_batch: int = 1000,
+        atomic: bool = True,
+        executor: Optional[Executor] = None,
+        max_queue_size: int = 10000,
+    ) -> None:
+        AsyncSink.__init__(
+            self,
+            flush_size=max_batch,
+            flush_interval=interval,
+            max_queue_size=max_queue_size,
+        )
+        DurabilityPolicy.__init__(self, atomic=atomic)
+        self.executor = executor
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"interval={self.flush_interval!r}, max_batch={self.flush_size!r}, "
+            f"atomic={self.atomic!r}, executor={self.executor!r}, "
+            f"records_written={self.records_written!r}, "
+            f"batches_written={self.batches_written!r}, closed={self.closed!r}"
+            ")"
+        )
+
+    async def commit(self, write_path: Path, file_path: Path):
+        future = asyncio.get_running_loop().create_future()
+        await self.put((write_path, file_path, future))
+        await future
+
+    async def write_batch(self, batch: List[Any]):
+        loop = asyncio.get_running_loop()
+        paths = [(write_path, file_path) for write_path, file_path, _ in batch]
+        try:
+            await loop.run_in_executor(self.executor, commit_files, paths)
+        except Exception as ex:  # pylint: disable=broad-except
+            # Fail the waiting commits, but keep the committer running.
+            logger.exception("Exception committing %s files in %r", len(batch), self)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(ex)
+            return
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+
+#: The policy used by file callbacks that are not given one.
+DEFAULT_DURABILITY = DurabilityPolicy()
+
+
+def get_durability(durability: Optional[DurabilityPolicy] = None) -> DurabilityPolicy:
+    if durability is None:
+        return DEFAULT_DURABILITY
+    return durability
@@ -0,0 +1,309 @@
+"""Structured action lifecycle events.
+
+An action given an :class:`EventBus` emits an :class:`ActionEvent` when it is
+enqueued, starts an attempt, gets a response, succeeds, retries or fails, when
+each callback starts and ends, and when the attempt finishes. Subscribers get
+every event:
+
+- :class:`EventRingBuffer` keeps the last `capacity` events in a preallocated
+  buffer, for inspection during or after a run.
+- :class:`SinkSubscriber` forwards events to an
+  :class:`~pfmsoft.aiohttp_queue.sinks.AsyncSink`, which consumes them in batches
+  in its own task. With a JsonLinesSink this is a JSONL event stream.
+
+.. code:: python
+
+    events = EventBus()
+    ring = events.subscribe(EventRingBuffer(capacity=10000))
+    sink = JsonLinesSink(Path("events.jsonl"))
+    events.subscribe(SinkSubscriber(sink, to_dict=True))
+    actions = [AiohttpAction(request, events=events) for request in requests]
+    do_queue_runner(actions, workers, sinks=[sink])
+
+Actions without a bus, or with a bus that has no subscribers, do not build
+events at all.
+"""
+import asyncio
+import logging
+from enum import Enum
+from time import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, TypeVar
+from uuid import UUID
+
+from pfmsoft.aiohttp_queue.sinks import AsyncSink
+from pfmsoft.aiohttp_queue.utilities import optional_object
+
+if TYPE_CHECKING:
+    from pfmsoft.aiohttp_queue.aiohttp import AiohttpAction
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class EventKind(Enum):
+    ENQUEUE = "enqueue"
+    START = "start"
+    RESPONSE = "response"
+    SUCCESS = "success"
+    RETRY = "retry"
+    FAIL = "fail"
+    CALLBACK_FAIL = "callback_fail"
+    CALLBACK_START = "callback_start"
+    CALLBACK_END = "callback_end"
+    EXCEPTION = "exception"
+    FINISH = "finish"
+
+
+class ActionEvent:
+    """Something that happened to an action.
+
+    Args:
+        kind: What happened.
+        timestamp: When it happened, seconds since the epoch.
+        uid: The action's uid.
+        name: The action's name.
+        id_: The action's id_.
+        attempt: The action's attempt count when it happened.
+        status: The response status, if there was a response.
+        source: What emitted the event, "action", "queue" or a callback class name.
+        detail: Extra detail, eg. the callback state or the exception class name.
+    """
+
+    __slots__ = (
+        "kind",
+        "timestamp",
+        "uid",
+        "name",
+        "id_",
+        "attempt",
+        "status",
+        "source",
+        "detail",
+    )
+
+    def __init__(
+        self,
+        kind: EventKind,
+        timestamp: float,
+        uid: UUID,
+        name: str,
+        id_: str,
+        attempt: int,
+        status: Optional[int] = None,
+        source: str = "action",
+        detail: str = "",
+    ) -> None:
+        self.kind = kind
+        self.timestamp = timestamp
+        self.uid = uid
+        self.name = name
+        self.id_ = id_
+        self.attempt = attempt
+        self.status = status
+        self.source = source
+        self.detail = detail
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"kind={self.kind!r}, timestamp={self.timestamp!r}, uid={self.uid!r}, "
+            f"name={self.name!r}, id_={self.id_!r}, attempt={self.attempt!r}, "
+            f"status={self.status!r}, source={self.source!r}, "
+            f"detail={self.detail!r}"
+            ")"
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        """A JSON serializable dict of the event."""
+        return {
+            "kind": self.kind.value,
+            "timestamp": self.timestamp,
+            "uid": str(self.uid),
+            "name": self.name,
+            "id": self.id_,
+            "attempt": self.attempt,
+            "status": self.status,
+            "source": self.source,
+            "detail": self.detail,
+        }
+
+
+class EventSubscriber:
+    """Base class for event subscribers.
+
+    :meth:`handle` is called in the event loop, for every event, so it should be
+    quick. Hand slow work to a task, as :class:`SinkSubscriber` does.
+    """
+
+    def handle(self, event: ActionEvent):
+        raise NotImplementedError()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(" ")"
+
+
+S = TypeVar("S", bound=EventSubscriber)
+
+
+class EventBus:
+    """Dispatch action events to subscribers.
+
+    One bus is usually shared by all the actions in a run. Events are only built
+    while the bus has subscribers.
+    """
+
+    def __init__(self, subscribers: Optional[Sequence[EventSubscriber]] = None):
+        self.subscribers: List[EventSubscriber] = list(
+            optional_object(subscribers, list)
+        )
+        #: True when there are subscribers, checked before building an event.
+        self.active = bool(self.subscribers)
+        self.events_emitted = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"subscribers={self.subscribers!r}, "
+            f"events_emitted={self.events_emitted!r}"
+            ")"
+        )
+
+    def subscribe(self, subscriber: S) -> S:
+        """Add a subscriber, and return it."""
+        self.subscribers.append(subscriber)
+        self.active = True
+        return subscriber
+
+    def unsubscribe(self, subscriber: EventSubscriber):
+        self.subscribers.remove(subscriber)
+        self.active = bool(self.subscribers)
+
+    def emit(
+        self,
+        kind: EventKind,
+        action: "AiohttpAction",
+        status: Optional[int] = None,
+        source: str = "action",
+        detail: str = "",
+    ):
+        if not self.active:
+            return
+        event = ActionEvent(
+            kind,
+            time(),
+            action.uid,
+            action.name,
+            action.id_,
+            action.attempts,
+            status,
+            source,
+            detail,
+        )
+        self.events_emitted += 1
+        for subscriber in self.subscribers:
+            try:
+                subscriber.handle(event)
+            except Exception:  # pylint: disable=broad-except
+                # A broken subscriber must not break the action.
+                logger.exception("Exception in %r handling %r", subscriber, event)
+
+
+class EventRingBuffer(EventSubscriber):
+    """Keep the last `capacity` events.
+
+    The buffer is allocated up front, and old events are overwritten, so memory
+    use does not grow with the length of a run.
+    """
+
+    def __init__(self, capacity: int = 10000) -> None:
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1, got {capacity}.")
+        self.capacity = capacity
+        self._buffer: List[Optional[ActionEvent]] = [None] * capacity
+        #: The number of events handled.
+        self.total = 0
+        #: The number of events overwritten before a :meth:`drain` returned them.
+        self.dropped = 0
+        self._drained = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"capacity={self.capacity!r}, total={self.total!r}, "
+            f"dropped={self.dropped!r}"
+            ")"
+        )
+
+    def __len__(self) -> int:
+        return min(self.total, self.capacity)
+
+    def handle(self, event: ActionEvent):
+        self._buffer[self.total % self.capacity] = event
+        self.total += 1
+
+    def _since(self, start: int) -> List[ActionEvent]:
+        start = max(start, self.total - self.capacity)
+        events = []
+        for index in range(start, self.total):
+            event = self._buffer[index % self.capacity]
+            assert event is not None
+            events.append(event)
+        return events
+
+    def events(self) -> List[ActionEvent]:
+        """The buffered events, oldest first."""
+        return self._since(0)
+
+    def drain(self) -> List[ActionEvent]:
+        """The events since the last drain, oldest first."""
+        oldest = self.total - self.capacity
+        if self._drained < oldest:
+            self.dropped += oldest - self._drained
+        events = self._since(self._drained)
+        self._drained = self.total
+        return events
+
+
+class SinkSubscriber(EventSubscriber):
+    """Forward events to an AsyncSink, which consumes them in batches.
+
+    Events are put without waiting. If the sink's queue is full the event is
+    dropped and counted, so a slow consumer never holds up the actions. Pass the
+    sink to the runner, so it is closed.
+
+    Args:
+        sink: The sink to put events in. Subclass AsyncSink and implement
+            write_batch for a custom batch consumer.
+        to_dict: Put :meth:`ActionEvent.as_dict` instead of the event, eg. for a
+            JsonLinesSink.
+        kinds: Only forward these kinds of event. None forwards all of them.
+    """
+
+    def __init__(
+        self,
+        sink: AsyncSink,
+        to_dict: bool = False,
+        kinds: Optional[Sequence[EventKind]] = None,
+    ) -> None:
+        self.sink = sink
+        self.to_dict = to_dict
+        self.kinds = set(kinds) if kinds is not None else None
+        self.dropped = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"sink={self.sink!r}, to_dict={self.to_dict!r}, kinds={self.kinds!r}, "
+            f"dropped={self.dropped!r}"
+            ")"
+        )
+
+    def handle(self, event: ActionEvent):
+        if self.kinds is not None and event.kind not in self.kinds:
+            return
+        try:
+            self.sink.put_nowait(event.as_dict() if self.to_dict else event)
+        except asyncio.QueueFull:
+            if not self.dropped:
+                logger.warning("%r is full, dropping events.", self.sink)
+            self.dropped += 1
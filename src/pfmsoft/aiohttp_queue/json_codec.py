@@ -0,0 +1,162 @@
+"""Pluggable JSON encoding and decoding.
+
+The JSON callbacks decode response bodies and encode results through a
+:class:`JsonCodec`. :func:`get_json_codec` picks the fastest installed library,
+in the order orjson, msgspec, ujson, falling back to the standard library.
+
+Codecs decode from bytes or str, and always encode to utf-8 bytes, so response
+bodies and file output never need a round trip through str.
+
+The output of the codecs is not identical. The standard library escapes
+non-ASCII text as \\u escapes, and writes NaN and Infinity as bare words that
+are not valid json. orjson writes non-ASCII text as utf-8, and NaN and Infinity
+as null. Pass `get_json_codec("json")` where the exact standard library output
+matters.
+"""
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+#: Preferred codecs, fastest first.
+CODEC_PREFERENCE = ["orjson", "msgspec", "ujson", "json"]
+
+
+class JsonCodec:
+    """Standard library codec, and the base class for the other codecs.
+
+    An indent of None gives compact output, with no whitespace between items.
+    """
+
+    name = "json"
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+    def dumps(self, obj: Any, indent: Optional[int] = None) -> bytes:
+        if indent is None:
+            return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+        return json.dumps(obj, indent=indent).encode("utf-8")
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(" f"name={self.name!r}" ")"
+
+    def __reduce__(self):
+        # Codecs may hold a module, so pickle by name, eg. for a process pool.
+        return (get_json_codec, (self.name,))
+
+
+class OrjsonCodec(JsonCodec):
+    """orjson only supports an indent of 2, other indents use the standard library.
+
+    Objects orjson cannot encode, like integers wider than 64 bits, also fall
+    back to the standard library.
+    """
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson  # pylint: disable=import-outside-toplevel
+
+        self._orjson = orjson
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return self._orjson.loads(data)
+
+    def dumps(self, obj: Any, indent: Optional[int] = None) -> bytes:
+        option = self._orjson.OPT_NON_STR_KEYS
+        try:
+            if indent is None:
+                return self._orjson.dumps(obj, option=option)
+            if indent == 2:
+                return self._orjson.dumps(
+                    obj, option=option | self._orjson.OPT_INDENT_2
+                )
+        except TypeError as ex:
+            logger.debug("orjson could not encode, using the standard library: %s", ex)
+        return super().dumps(obj, indent)
+
+
+class MsgspecCodec(JsonCodec):
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        import msgspec  # pylint: disable=import-outside-toplevel
+
+        self._json = msgspec.json
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return self._json.decode(data)
+
+    def dumps(self, obj: Any, indent: Optional[int] = None) -> bytes:
+        encoded = self._json.encode(obj)
+        if indent is None:
+            return encoded
+        return self._json.format(encoded, indent=indent)
+
+
+class UjsonCodec(JsonCodec):
+    name = "ujson"
+
+    def __init__(self) -> None:
+        import ujson  # pylint: disable=import-outside-toplevel
+
+        self._ujson = ujson
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return self._ujson.loads(data)
+
+    def dumps(self, obj: Any, indent: Optional[int] = None) -> bytes:
+        return self._ujson.dumps(
+            obj,
+            indent=0 if indent is None else indent,
+            escape_forward_slashes=False,
+        ).encode("utf-8")
+
+
+CODEC_FACTORIES: Dict[str, Callable[[], JsonCodec]] = {
+    "orjson": OrjsonCodec,
+    "msgspec": MsgspecCodec,
+    "ujson": UjsonCodec,
+    "json": JsonCodec,
+}
+
+_CODEC_CACHE: Dict[str, JsonCodec] = {}
+
+
+def get_json_codec(name: Optional[str] = None) -> JsonCodec:
+    """Get a codec by name, or the fastest available codec if name is None.
+
+    Raises:
+        ValueError: If name is not a known codec.
+        ImportError: If the library for a named codec is not installed.
+    """
+    if name is not None:
+        if name not in CODEC_FACTORIES:
+            raise ValueError(
+                f"Unknown json codec {name!r}, expected one of {list(CODEC_FACTORIES)}"
+            )
+        if name not in _CODEC_CACHE:
+            _CODEC_CACHE[name] = CODEC_FACTORIES[name]()
+        return _CODEC_CACHE[name]
+    for codec_name in CODEC_PREFERENCE:
+        try:
+            return get_json_codec(codec_name)
+        except ImportError:
+            logger.debug("Json codec %s is not available.", codec_name)
+    # The standard library codec is always available.
+    raise AssertionError("No json codec available.")
+
+
+def available_codecs() -> List[str]:
+    """The names of the codecs that can be used in this environment."""
+    names = []
+    for codec_name in CODEC_PREFERENCE:
+        try:
+            get_json_codec(codec_name)
+            names.append(codec_name)
+        except ImportError:
+            pass
+    return names
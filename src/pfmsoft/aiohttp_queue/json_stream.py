@@ -0,0 +1,159 @@
+"""Incremental parsing of JSON arrays.
+
+Large list responses can be decoded one item at a time, so peak memory is
+bounded by one item plus the read buffer instead of the whole list.
+
+:class:`JsonArrayScanner` finds the byte span of each top level item as data
+arrives, and each span is decoded with a :class:`~pfmsoft.aiohttp_queue.json_codec.JsonCodec`.
+"""
+import logging
+import re
+from typing import TYPE_CHECKING, Any, AsyncIterator, List, Optional
+
+from aiohttp import StreamReader
+
+from pfmsoft.aiohttp_queue.json_codec import JsonCodec, get_json_codec
+from pfmsoft.aiohttp_queue.utilities import optional_object
+
+if TYPE_CHECKING:
+    from pfmsoft.aiohttp_queue.aiohttp import AiohttpAction
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Skip over everything that is not structure, including whole strings, in one match.
+# The match stops at a bracket, a comma (at the top level), the opening quote of an
+# incomplete string, or the end of the buffer.
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_SKIP_TOP_LEVEL = re.compile(rb'(?:[^"\[\]{},]+|' + _STRING + rb")*", re.DOTALL)
+_SKIP_NESTED = re.compile(rb'(?:[^"\[\]{}]+|' + _STRING + rb")*", re.DOTALL)
+_WHITESPACE = b" \t\r\n"
+
+
+class JsonArrayScanner:
+    """Split a JSON array into the raw bytes of its items, as data is fed in.
+
+    Only the structure of the array is checked. Each item is validated when it
+    is decoded.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.position = 0
+        self.item_start = 0
+        self.depth = 0
+        self.started = False
+        self.ended = False
+        self.item_count = 0
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Add data, and return the raw bytes of any items it completed."""
+        if self.ended:
+            if data.strip(_WHITESPACE):
+                raise ValueError("Unexpected data after the end of the JSON array.")
+            return []
+        self.buffer.extend(data)
+        items: List[bytes] = []
+        if not self.started and not self._find_start():
+            return items
+        self._scan(items)
+        # Drop everything before the current item to keep the buffer small.
+        del self.buffer[: self.item_start]
+        self.position -= self.item_start
+        self.item_start = 0
+        return items
+
+    def close(self):
+        """Check that the whole array was seen."""
+        if not self.ended:
+            raise ValueError("Incomplete JSON array.")
+
+    def _find_start(self) -> bool:
+        stripped = self.buffer.lstrip(_WHITESPACE)
+        if not stripped:
+            self.buffer.clear()
+            return False
+        if stripped[0:1] != b"[":
+            raise ValueError(f"Expected a JSON array, got {bytes(stripped[:20])!r}")
+        self.buffer = bytearray(stripped[1:])
+        self.started = True
+        return True
+
+    def _scan(self, items: List[bytes]):
+        buffer = self.buffer
+        while not self.ended:
+            skip = _SKIP_TOP_LEVEL if self.depth == 0 else _SKIP_NESTED
+            index = skip.match(buffer, self.position).end()  # type: ignore
+            if index >= len(buffer) or buffer[index] == 0x22:  # "
+                # Wait for more data, only the incomplete string is scanned again.
+                self.position = index
+                return
+            char = buffer[index]
+            self.position = index + 1
+            if char in (0x5B, 0x7B):  # [ {
+                self.depth += 1
+            elif self.depth > 0:  # ] }
+                self.depth -= 1
+            elif char == 0x7D:  # }
+                raise ValueError("Unbalanced '}' in JSON array.")
+            else:  # , ]
+                item = bytes(buffer[self.item_start : index].strip(_WHITESPACE))
+                if item:
+                    items.append(item)
+                    self.item_count += 1
+                elif char == 0x2C or self.item_count:
+                    raise ValueError("Empty item in JSON array.")
+                self.item_start = index + 1
+                if char == 0x5D:
+                    self.ended = True
+                    if buffer[index + 1 :].strip(_WHITESPACE):
+                        raise ValueError(
+                            "Unexpected data after the end of the JSON array."
+                        )
+                    self.item_start = len(buffer)
+
+
+async def iter_json_array(
+    content: StreamReader,
+    codec: Optional[JsonCodec] = None,
+    chunk_size: int = 65536,
+) -> AsyncIterator[Any]:
+    """Decode the items of a JSON array from a stream, one at a time."""
+    codec = optional_object(codec, get_json_codec)
+    scanner = JsonArrayScanner()
+    async for chunk in content.iter_chunked(chunk_size):
+        for raw_item in scanner.feed(chunk):
+            yield codec.loads(raw_item)
+    scanner.close()
+
+
+class JsonArrayItemHandler:
+    """Receives the items of a streamed JSON array, one at a time."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        _, _ = args, kwargs
+
+    async def handle_item(self, caller: "AiohttpAction", item: Any):
+        raise NotImplementedError()
+
+    async def finish(self, caller: "AiohttpAction"):
+        """Called after the last item."""
+        _ = caller
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(" ")"
+
+
+class CollectJsonArrayItems(JsonArrayItemHandler):
+    """Collect the items into a list, and store it as `caller.response_data`."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.items: List[Any] = []
+
+    async def handle_item(self, caller: "AiohttpAction", item: Any):
+        _ = caller
+        self.items.append(item)
+
+    async def finish(self, caller: "AiohttpAction"):
+        caller.response_data = self.items
@@ -0,0 +1,434 @@
+"""Runtime metrics, exported in the OpenMetrics text format.
+
+A :class:`MetricsRegistry` holds counters, gauges and histograms. Updates are
+plain dict operations on the event loop thread, with no locking, so they are
+cheap enough to make for every request.
+
+:class:`RunnerMetrics` defines the metrics the runners record when they are
+given one: request latency by host and status, attempts by outcome, queue depth,
+actions in flight, worker busy and idle time, and the phase timings of each
+attempt, see :mod:`pfmsoft.aiohttp_queue.tracing`.
+
+.. code:: python
+
+    metrics = RunnerMetrics()
+    async with MetricsServer(metrics.registry, port=9464):
+        await queue_runner(actions, workers, metrics=metrics)
+    metrics.registry.write(Path("metrics.txt"))
+
+Use :class:`MetricsFileExporter` to rewrite a file on an interval instead, eg.
+for the node exporter textfile collector.
+"""
+import asyncio
+import logging
+import os
+from bisect import bisect_left
+from functools import lru_cache
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+from yarl import URL
+
+from pfmsoft.aiohttp_queue.aiohttp import AiohttpAction
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+#: Content type for the OpenMetrics text format.
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+#: Latency buckets, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base class for a metric family, with a value for each set of label values."""
+
+    metric_type = "unknown"
+
+    def __init__(
+        self, name: str, help_text: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"name={self.name!r}, labelnames={self.labelnames!r}"
+            ")"
+        )
+
+    def label_string(
+        self, labels: LabelValues, extra: Optional[Tuple[str, str]] = None
+    ) -> str:
+        pairs = [
+            f'{name}="{escape_label_value(str(value))}"'
+            for name, value in zip(self.labelnames, labels)
+        ]
+        if extra is not None:
+            pairs.append(f'{extra[0]}="{extra[1]}"')
+        if not pairs:
+            return ""
+        return "{" + ",".join(pairs) + "}"
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError()
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# TYPE {self.name} {self.metric_type}",
+            f"# HELP {self.name} {self.help_text}",
+        ]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    metric_type = "counter"
+
+    def __init__(
+        self, name: str, help_text: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, labels: LabelValues = ()):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        return self.values.get(labels, 0.0)
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}_total{self.label_string(labels)} {format_value(value)}"
+
+
+class Gauge(Metric):
+    """A value that goes up and down."""
+
+    metric_type = "gauge"
+
+    def __init__(
+        self, name: str, help_text: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, labels: LabelValues = ()):
+        self.values[labels] = value
+
+    def inc(self, amount: float = 1.0, labels: LabelValues = ()):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, labels: LabelValues = ()):
+        self.values[labels] = self.values.get(labels, 0.0) - amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        return self.values.get(labels, 0.0)
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{self.label_string(labels)} {format_value(value)}"
+
+
+class Histogram(Metric):
+    """Counts of observations in buckets, with their sum and count."""
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per bucket counts, the last one is +Inf. Made cumulative when rendered.
+        self.counts: Dict[LabelValues, List[int]] = {}
+        self.sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, labels: LabelValues = ()):
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def count(self, labels: LabelValues = ()) -> int:
+        return sum(self.counts.get(labels, ()))
+
+    def samples(self) -> Iterator[str]:
+        bounds = [*self.buckets, float("inf")]
+        for labels, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                label_string = self.label_string(labels, ("le", format_value(bound)))
+                yield f"{self.name}_bucket{label_string} {cumulative}"
+            label_string = self.label_string(labels)
+            yield f"{self.name}_count{label_string} {cumulative}"
+            yield f"{self.name}_sum{label_string} {format_value(self.sums[labels])}"
+
+
+class MetricsRegistry:
+    """The metrics of a process, by name."""
+
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(" f"metrics={list(self.metrics)!r}" ")"
+
+    def register(self, metric: Metric) -> Metric:
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric):
+                raise ValueError(f"{metric.name} is already a {existing!r}")
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, help_text: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))  # type: ignore
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames))  # type: ignore
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.register(  # type: ignore
+            Histogram(name, help_text, labelnames, buckets)
+        )
+
+    def render(self) -> str:
+        """All the metrics in the OpenMetrics text format."""
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, file_path: Path):
+        """Write the metrics to a file, replacing it atomically."""
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = file_path.with_name(f".{file_path.name}.tmp")
+        temp_path.write_text(self.render(), encoding="utf-8")
+        os.replace(temp_path, file_path)
+
+
+@lru_cache(maxsize=4096)
+def host_of(url: str) -> str:
+    return URL(url).host or ""
+
+
+class RunnerMetrics:
+    """The metrics recorded by the runners and queue workers."""
+
+    def __init__(
+        self,
+        registry: Optional[MetricsRegistry] = None,
+        prefix: str = "aiohttp_queue",
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.registry = registry if registry is not None else MetricsRegistry()
+        self.prefix = prefix
+        self.request_seconds = self.registry.histogram(
+            f"{prefix}_request_duration_seconds",
+            "Time from sending a request to receiving the response headers.",
+            ("host", "status"),
+            buckets,
+        )
+        self.action_seconds = self.registry.histogram(
+            f"{prefix}_action_duration_seconds",
+            "Time for an attempt at an action, including its callbacks.",
+            ("host",),
+            buckets,
+        )
+        self.phase_seconds = self.registry.histogram(
+            f"{prefix}_phase_duration_seconds",
+            "Time in each phase of an attempt, see pfmsoft.aiohttp_queue.tracing.",
+            ("phase",),
+            buckets,
+        )
+        self.attempts = self.registry.counter(
+            f"{prefix}_attempts",
+            "Attempts at actions, by the state after the attempt.",
+            ("state",),
+        )
+        self.exceptions = self.registry.counter(
+            f"{prefix}_exceptions", "Attempts that raised an exception.", ("host",)
+        )
+        self.queue_depth = self.registry.gauge(
+            f"{prefix}_queue_depth", "Actions waiting in the queue."
+        )
+        self.in_flight = self.registry.gauge(
+            f"{prefix}_in_flight", "Actions being done now."
+        )
+        self.workers = self.registry.gauge(f"{prefix}_workers", "Running workers.")
+        self.busy_seconds = self.registry.counter(
+            f"{prefix}_worker_busy_seconds", "Time workers spent doing actions."
+        )
+        self.idle_seconds = self.registry.counter(
+            f"{prefix}_worker_idle_seconds", "Time workers spent waiting for actions."
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"registry={self.registry!r}, prefix={self.prefix!r}"
+            ")"
+        )
+
+    def action_started(self) -> float:
+        """Call before an attempt, returns the start time for action_finished."""
+        self.in_flight.inc()
+        return perf_counter()
+
+    def action_finished(
+        self, action: AiohttpAction, start: float, exception: bool = False
+    ):
+        seconds = perf_counter() - start
+        self.in_flight.dec()
+        self.busy_seconds.inc(seconds)
+        host = host_of(action.aiohttp_args.url)
+        self.action_seconds.observe(seconds, (host,))
+        if exception:
+            self.exceptions.inc(1, (host,))
+        self.attempts.inc(1, (action.state.value,))
+        if action.response is not None and action.request_seconds is not None:
+            self.request_seconds.observe(
+                action.request_seconds, (host, str(action.response.status))
+            )
+        if action.timings is not None:
+            for phase, phase_seconds in action.timings.phases().items():
+                self.phase_seconds.observe(phase_seconds, (phase,))
+
+    def worker_idle(self, seconds: float):
+        self.idle_seconds.inc(seconds)
+
+    def utilization(self) -> float:
+        """The fraction of worker time spent busy."""
+        busy = self.busy_seconds.value()
+        total = busy + self.idle_seconds.value()
+        return busy / total if total else 0.0
+
+
+class MetricsServer:
+    """Serve the metrics over http, at `/metrics`."""
+
+    def __init__(
+        self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9464
+    ) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(" f"host={self.host!r}, port={self.port!r}" ")"
+        )
+
+    async def __aenter__(self) -> "MetricsServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.stop()
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        _ = request
+        return web.Response(
+            body=self.registry.render().encode("utf-8"),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if self.port == 0:
+            self.port = site._server.sockets[0].getsockname()[1]  # type: ignore
+        logger.info("Serving metrics at http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class MetricsFileExporter:
+    """Rewrite a metrics file every `interval` seconds, and once more on stop."""
+
+    def __init__(
+        self, registry: MetricsRegistry, file_path: Path, interval: float = 10.0
+    ) -> None:
+        self.registry = registry
+        self.file_path = file_path
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"file_path={self.file_path!r}, interval={self.interval!r}"
+            ")"
+        )
+
+    async def __aenter__(self) -> "MetricsFileExporter":
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.stop()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._export())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.registry.write(self.file_path)
+
+    async def _export(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.registry.write(self.file_path)
+            except OSError:
+                logger.exception("Exception writing metrics to %s", self.file_path)
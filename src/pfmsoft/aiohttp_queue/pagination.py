@@ -0,0 +1,447 @@
+"""Pagination strategies, used by the Paginate callback to fetch the other pages.
+
+A strategy looks at a fetched page, and says how to request more pages:
+
+- :meth:`PaginationStrategy.page_requests`, the requests for all the remaining
+  pages, when the first page tells how many there are. These are fetched
+  concurrently.
+- :meth:`PaginationStrategy.next_request`, the request for the next page, when
+  pages have to be followed one at a time.
+- :meth:`PaginationStrategy.early_request`, the request for the next page, known
+  from the response headers alone. The next page is requested as soon as the
+  headers arrive, while the body of the current page is still being read and
+  decoded. It may be a guess, if it turns out not to match
+  :meth:`~PaginationStrategy.next_request` the prefetched page is dropped.
+
+Strategies:
+
+- :class:`XPagesStrategy`, an `x-pages` header and a page number parameter.
+- :class:`LinkHeaderStrategy`, RFC 5988 `Link` headers with `rel="next"`.
+- :class:`CursorStrategy`, a cursor token in the body or a header.
+- :class:`OffsetLimitStrategy`, offset and limit parameters, with an optional
+  total count.
+
+Fetched pages pass through a :class:`PageReorderBuffer`, so they are handled in
+page order, and are collected or put into a sink by :class:`PageResults`.
+"""
+import asyncio
+import logging
+from copy import deepcopy
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from yarl import URL
+
+from pfmsoft.aiohttp_queue.aiohttp import ActionState, AiohttpAction, AiohttpRequest
+from pfmsoft.aiohttp_queue.sinks import AsyncSink
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def with_params(request: AiohttpRequest, **params: Any) -> AiohttpRequest:
+    """A copy of the request, with query parameters added or replaced."""
+    new_request = deepcopy(request)
+    new_request.params = {**(new_request.params or {}), **params}
+    return new_request
+
+
+def with_url(request: AiohttpRequest, url: str) -> AiohttpRequest:
+    """A copy of the request for a new url, that already holds the query."""
+    new_request = deepcopy(request)
+    new_request.url = url
+    new_request.params = None
+    return new_request
+
+
+def lookup(data: Any, field_path: Optional[str]) -> Any:
+    """Get a value by a dotted path, eg. "meta.next", or None if it is missing."""
+    if field_path is None:
+        return data
+    for key in field_path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+class PaginationStrategy:
+    """Base class for pagination strategies.
+
+    Args:
+        items_field: A dotted path to the list of items in a decoded page, eg.
+            "data". None if the page is the list.
+    """
+
+    def __init__(self, items_field: Optional[str] = None) -> None:
+        self.items_field = items_field
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(" f"items_field={self.items_field!r}" ")"
+
+    def page_requests(self, first: AiohttpAction) -> Optional[List[AiohttpRequest]]:
+        """The requests for all the pages after `first`, if they can be known."""
+        _ = first
+        return None
+
+    def early_request(self, action: AiohttpAction) -> Optional[AiohttpRequest]:
+        """The next request, from the response headers, before the body is read."""
+        _ = action
+        return None
+
+    def next_request(self, action: AiohttpAction) -> Optional[AiohttpRequest]:
+        """The next request, after the page is decoded. None for the last page."""
+        raise NotImplementedError()
+
+    def page_items(self, action: AiohttpAction) -> List[Any]:
+        """The items of a decoded page."""
+        items = lookup(action.response_data, self.items_field)
+        if items is None:
+            return []
+        return items
+
+
+class XPagesStrategy(PaginationStrategy):
+    """The page count is in a header, pages are selected by a query parameter."""
+
+    def __init__(
+        self,
+        page_param: str = "page",
+        header: str = "x-pages",
+        items_field: Optional[str] = None,
+    ) -> None:
+        super().__init__(items_field=items_field)
+        self.page_param = page_param
+        self.header = header
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"page_param={self.page_param!r}, header={self.header!r}, "
+            f"items_field={self.items_field!r}"
+            ")"
+        )
+
+    def page_requests(self, first: AiohttpAction) -> Optional[List[AiohttpRequest]]:
+        if first.response is None:
+            return None
+        pages = first.response.headers.get(self.header)
+        if pages is None:
+            logger.warning(
+                "No %s header for %s, Are you sure this api offers pages?",
+                self.header,
+                first.aiohttp_args.url,
+            )
+            return None
+        current = int((first.aiohttp_args.params or {}).get(self.page_param, 1))
+        return [
+            with_params(first.aiohttp_args, **{self.page_param: page})
+            for page in range(current + 1, int(pages) + 1)
+        ]
+
+    def next_request(self, action: AiohttpAction) -> Optional[AiohttpRequest]:
+        _ = action
+        return None
+
+
+class LinkHeaderStrategy(PaginationStrategy):
+    """Follow `Link: <url>; rel="next"` headers.
+
+    If `page_param` is given, and the first page has a `rel="last"` link, the
+    pages in between are built from the last link and fetched concurrently.
+    """
+
+    def __init__(
+        self,
+        rel: str = "next",
+        page_param: Optional[str] = None,
+        items_field: Optional[str] = None,
+    ) -> None:
+        super().__init__(items_field=items_field)
+        self.rel = rel
+        self.page_param = page_param
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"rel={self.rel!r}, page_param={self.page_param!r}, "
+            f"items_field={self.items_field!r}"
+            ")"
+        )
+
+    def page_requests(self, first: AiohttpAction) -> Optional[List[AiohttpRequest]]:
+        if self.page_param is None or first.response is None:
+            return None
+        last = first.response.links.get("last")
+        next_link = first.response.links.get(self.rel)
+        if last is None or next_link is None:
+            return None
+        last_url = URL(str(last["url"]))
+        try:
+            last_page = int(last_url.query[self.page_param])
+            next_page = int(URL(str(next_link["url"])).query[self.page_param])
+        except (KeyError, ValueError):
+            return None
+        return [
+            with_url(
+                first.aiohttp_args,
+                str(last_url.update_query({self.page_param: page})),
+            )
+            for page in range(next_page, last_page + 1)
+        ]
+
+    def early_request(self, action: AiohttpAction) -> Optional[AiohttpRequest]:
+        return self.next_request(action)
+
+    def next_request(self, action: AiohttpAction) -> Optional[AiohttpRequest]:
+        if action.response is None:
+            return None
+        link = action.response.links.get(self.rel)
+        if link is None:
+            return None
+        return with_url(action.aiohttp_args, str(link["url"]))
+
+
+class CursorStrategy(PaginationStrategy):
+    """An opaque cursor for the next page, in a header or the body.
+
+    Args:
+        cursor_param: The query parameter to send the cursor in.
+        body_field: A dotted path to the cursor in the decoded body.
+        header: The header holding the cursor. Takes priority over body_field,
+            and lets the next page be requested before the body is read.
+        items_field: A dotted path to the list of items in a decoded page.
+    """
+
+    def __init__(
+        self,
+        cursor_param: str = "cursor",
+        body_field: Optional[str] = "next_cursor",
+        header: Optional[str] = None,
+        items_field: Optional[str] = None,
+    ) -> None:
+        super().__init__(items_field=items_field)
+        self.cursor_param = cursor_param
+        self.body_field = body_field
+        self.header = header
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"cursor_param={self.cursor_param!r}, body_field={self.body_field!r}, "
+            f"header={self.header!r}, items_field={self.items_field!r}"
+            ")"
+        )
+
+    def header_cursor(self, action: AiohttpAction) -> Optional[str]:
+        if self.header is None or action.response is None:
+            return None
+        return action.response.headers.get(self.header)
+
+    def early_request(self, action: AiohttpAction) -> Optional[AiohttpRequest]:
+        cursor = self.header_cursor(action)
+        if not cursor:
+            return None
+        return with_params(action.aiohttp_args, **{self.cursor_param: cursor})
+
+    def next_request(self, action: AiohttpAction) -> Optional[AiohttpRequest]:
+        if self.header is not None:
+            cursor = self.header_cursor(action)
+        else:
+            cursor = lookup(action.response_data, self.body_field)
+        if not cursor:
+            return None
+        return with_params(action.aiohttp_args, **{self.cursor_param: cursor})
+
+
+class OffsetLimitStrategy(PaginationStrategy):
+    """Offset and limit query parameters.
+
+    When the total is in a header or the body, the remaining pages are fetched
+    concurrently. Otherwise pages are followed until one is short, and with
+    `speculative` the next page is requested before the current page is read,
+    on the guess that it will be full.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        offset_param: str = "offset",
+        limit_param: str = "limit",
+        total_header: Optional[str] = None,
+        total_field: Optional[str] = None,
+        items_field: Optional[str] = None,
+        speculative: bool = True,
+    ) -> None:
+        super().__init__(items_field=items_field)
+        self.limit = limit
+        self.offset_param = offset_param
+        self.limit_param = limit_param
+        self.total_header = total_header
+        self.total_field = total_field
+        self.speculative = speculative
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"limit={self.limit!r}, offset_param={self.offset_param!r}, "
+            f"limit_param={self.limit_param!r}, total_header={self.total_header!r}, "
+            f"total_field={self.total_field!r}, items_field={self.items_field!r}, "
+            f"speculative={self.speculative!r}"
+            ")"
+        )
+
+    def offset(self, action: AiohttpAction) -> int:
+        return int((action.aiohttp_args.params or {}).get(self.offset_param, 0))
+
+    def request_at(self, action: AiohttpAction, offset: int) -> AiohttpRequest:
+        return with_params(
+            action.aiohttp_args,
+            **{self.offset_param: offset, self.limit_param: self.limit},
+        )
+
+    def total(self, action: AiohttpAction) -> Optional[int]:
+        total: Any = None
+        if self.total_header is not None and action.response is not None:
+            total = action.response.headers.get(self.total_header)
+        if total is None and self.total_field is not None:
+            total = lookup(action.response_data, self.total_field)
+        return int(total) if total is not None else None
+
+    def page_requests(self, first: AiohttpAction) -> Optional[List[AiohttpRequest]]:
+        total = self.total(first)
+        if total is None:
+            return None
+        return [
+            self.request_at(first, offset)
+            for offset in range(self.offset(first) + self.limit, total, self.limit)
+        ]
+
+    def early_request(self, action: AiohttpAction) -> Optional[AiohttpRequest]:
+        if not self.speculative:
+            return None
+        return self.request_at(action, self.offset(action) + self.limit)
+
+    def next_request(self, action: AiohttpAction) -> Optional[AiohttpRequest]:
+        if len(self.page_items(action)) < self.limit:
+            return None
+        return self.request_at(action, self.offset(action) + self.limit)
+
+
+class PageReorderBuffer:
+    """Pass pages that finish out of order to `emit`, in page order.
+
+    Before fetching a page, :meth:`reserve` waits until the page is less than
+    `window` pages ahead of the next page to emit, so at most `window` finished
+    pages are held.
+    """
+
+    def __init__(
+        self,
+        emit: Callable[[AiohttpAction, int], Awaitable[None]],
+        window: int = 20,
+        next_page: int = 1,
+    ) -> None:
+        self.emit = emit
+        self.window = window
+        self.next_page = next_page
+        self.max_held = 0
+        self._held: Dict[int, AiohttpAction] = {}
+        self._condition = asyncio.Condition()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"window={self.window!r}, next_page={self.next_page!r}, "
+            f"held={len(self._held)!r}, max_held={self.max_held!r}"
+            ")"
+        )
+
+    async def reserve(self, page_number: int):
+        """Wait until `page_number` is inside the window."""
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: page_number < self.next_page + self.window
+            )
+
+    async def add(self, page_number: int, action: AiohttpAction):
+        """Hold a finished page, and emit the pages that are now in order."""
+        async with self._condition:
+            self._held[page_number] = action
+            self.max_held = max(self.max_held, len(self._held))
+            while self.next_page in self._held:
+                await self.emit(self._held.pop(self.next_page), self.next_page)
+                self.next_page += 1
+            self._condition.notify_all()
+
+
+class PageResults:
+    """Collect the items of pages, or put them in a sink, and report on the pages.
+
+    Pages must be added in page order.
+    """
+
+    def __init__(
+        self,
+        strategy: PaginationStrategy,
+        sink: Optional[AsyncSink] = None,
+        explode: bool = True,
+    ) -> None:
+        self.strategy = strategy
+        self.sink = sink
+        self.explode = explode
+        self.items: List[Any] = []
+        self.pages: List[Dict[str, Any]] = []
+        self.item_count = 0
+        self.truncated = False
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"strategy={self.strategy!r}, sink={self.sink!r}, "
+            f"explode={self.explode!r}, page_count={len(self.pages)!r}, "
+            f"item_count={self.item_count!r}, truncated={self.truncated!r}"
+            ")"
+        )
+
+    async def add(self, action: AiohttpAction, page_number: int):
+        status = action.response.status if action.response is not None else None
+        page: Dict[str, Any] = {
+            "page": page_number,
+            "uid": str(action.uid),
+            "url": str(action.aiohttp_args.url),
+            "status": status,
+            "count": -1,
+        }
+        self.pages.append(page)
+        if action.state != ActionState.SUCCESS:
+            logger.warning(
+                "An attempt to get page %s failed. Data is incomplete. Action: %s",
+                page_number,
+                action,
+            )
+            return
+        items = self.strategy.page_items(action)
+        page["count"] = len(items)
+        self.item_count += len(items)
+        if self.sink is None:
+            self.items.extend(items)
+        elif self.explode:
+            await self.sink.put_many(items)
+        else:
+            await self.sink.put(items)
+
+    def report(self) -> Dict[str, Any]:
+        """A summary of the pages.
+
+        complete is False if a page failed, or `max_pages` stopped the fetching
+        early.
+        """
+        failed_pages = [page["page"] for page in self.pages if page["count"] < 0]
+        return {
+            "complete": not failed_pages and not self.truncated,
+            "page_count": len(self.pages),
+            "item_count": self.item_count,
+            "failed_pages": failed_pages,
+            "truncated": self.truncated,
+            "pages": self.pages,
+        }
@@ -0,0 +1,118 @@
+"""Path resolution for the file saving callbacks.
+
+A :class:`PathResolver` caches compiled path templates and the directories it
+has already made, so writing many files into the same few directories does not
+repeat the template parsing and mkdir calls for every file. It can also shard
+files into hash named sub directories, eg. `out/3f/a2/result.json`, to keep
+directories small when writing very many files.
+
+All the file callbacks share :data:`DEFAULT_PATH_RESOLVER` unless given their own.
+If a directory is removed after it was made, the callbacks make it again when
+opening a file in it fails, see :meth:`PathResolver.remake_parent`.
+"""
+import hashlib
+import logging
+from pathlib import Path
+from string import Template
+from typing import Dict, Mapping, Optional, Set
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class PathResolver:
+    """Resolve file paths, and make their parent directories, with caching.
+
+    Args:
+        shard_depth: The number of hash named directory levels to add below the
+            file's parent directory. 0 for no sharding.
+        shard_width: The number of hex characters in each shard directory name.
+        max_templates: The number of compiled templates to keep.
+    """
+
+    def __init__(
+        self, shard_depth: int = 0, shard_width: int = 2, max_templates: int = 1024
+    ) -> None:
+        if shard_depth < 0 or shard_width < 1 or shard_depth * shard_width > 32:
+            raise ValueError(
+                f"Invalid sharding, shard_depth={shard_depth} shard_width={shard_width}"
+            )
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+        self.max_templates = max_templates
+        self.mkdir_count = 0
+        self._templates: Dict[str, Template] = {}
+        self._known_directories: Set[Path] = set()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"shard_depth={self.shard_depth!r}, shard_width={self.shard_width!r}, "
+            f"max_templates={self.max_templates!r}, mkdir_count={self.mkdir_count!r}"
+            ")"
+        )
+
+    def template(self, template_string: str) -> Template:
+        """A compiled template, from the cache if possible."""
+        template = self._templates.get(template_string)
+        if template is None:
+            if len(self._templates) >= self.max_templates:
+                self._templates.clear()
+            template = Template(template_string)
+            self._templates[template_string] = template
+        return template
+
+    def substitute(self, template_string: str, path_values: Mapping[str, str]) -> Path:
+        """Fill in a path template, leaving unknown placeholders as they are."""
+        return Path(self.template(template_string).safe_substitute(path_values))
+
+    def shard(self, file_path: Path) -> Path:
+        """Insert hash named directories, based on the file name, before the file."""
+        if not self.shard_depth:
+            return file_path
+        digest = hashlib.blake2b(
+            file_path.name.encode("utf-8"), digest_size=16
+        ).hexdigest()
+        width = self.shard_width
+        shards = [
+            digest[level * width : (level + 1) * width]
+            for level in range(self.shard_depth)
+        ]
+        return file_path.parent.joinpath(*shards, file_path.name)
+
+    def ensure_parent(self, file_path: Path):
+        """Make the parent directory, unless this resolver already made it."""
+        parent = file_path.parent
+        if parent in self._known_directories:
+            return
+        parent.mkdir(parents=True, exist_ok=True)
+        self.mkdir_count += 1
+        self._known_directories.add(parent)
+
+    def remake_parent(self, file_path: Path) -> bool:
+        """Make the parent directory again, if this resolver thought it existed.
+
+        For a write that failed with FileNotFoundError because the directory was
+        removed after it was made. Returns False, and does nothing, if the parent
+        was not a known directory.
+        """
+        parent = file_path.parent
+        if parent not in self._known_directories:
+            return False
+        self._known_directories.discard(parent)
+        self.ensure_parent(file_path)
+        return True
+
+    def forget_directories(self):
+        """Forget the known directories, eg. after they were removed."""
+        self._known_directories.clear()
+
+
+#: The resolver shared by file callbacks that are not given their own.
+DEFAULT_PATH_RESOLVER = PathResolver()
+
+
+def get_path_resolver(path_resolver: Optional[PathResolver] = None) -> PathResolver:
+    if path_resolver is None:
+        return DEFAULT_PATH_RESOLVER
+    return path_resolver
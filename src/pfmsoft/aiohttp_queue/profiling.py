@@ -0,0 +1,402 @@
+"""Tools to find out what is slowing down the event loop.
+
+:class:`LoopLagMonitor` measures how late the event loop runs timers.
+:class:`RunProfiler` adds the time spent in each callback class and for each
+action name, flags slow callbacks, and can record a cProfile or pyinstrument
+profile of the run. Pass one to a runner to profile it:
+
+.. code:: python
+
+    profiler = RunProfiler(slow_callback_seconds=0.05, profile_path=Path("run.prof"))
+    do_queue_runner(actions, workers, profiler=profiler)
+    print(profiler.report())
+"""
+import asyncio
+import cProfile
+import logging
+import weakref
+from collections import deque
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from pfmsoft.aiohttp_queue.events import (
+    ActionEvent,
+    EventBus,
+    EventKind,
+    EventSubscriber,
+)
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class LoopLagMonitor:
+    """Measure event loop lag, how late a timer fires compared to when it was due.
+
+    A blocked event loop shows up as large lag. The most recent `max_samples`
+    samples are kept for percentiles.
+
+    .. code:: python
+
+        async with LoopLagMonitor(interval=0.01) as monitor:
+            await do_some_work()
+        print(monitor.summary())
+    """
+
+    def __init__(self, interval: float = 0.01, max_samples: int = 10000) -> None:
+        self.interval = interval
+        self.samples: Deque[float] = deque(maxlen=max_samples)
+        self.sample_count = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._due: Optional[float] = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"interval={self.interval!r}, sample_count={self.sample_count!r}, "
+            f"max_lag={self.max_lag!r}"
+            ")"
+        )
+
+    async def __aenter__(self) -> "LoopLagMonitor":
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.stop()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sample())
+
+    async def stop(self):
+        if self._task is not None:
+            # Count a timer that is already late, eg. after a block at the end.
+            if self._due is not None and perf_counter() > self._due:
+                self.add_sample(perf_counter() - self._due)
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _sample(self):
+        while True:
+            self._due = due = perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self._due = None
+            self.add_sample(max(0.0, perf_counter() - due))
+
+    def add_sample(self, lag: float):
+        self.samples.append(lag)
+        self.sample_count += 1
+        self.total_lag += lag
+        if lag > self.max_lag:
+            self.max_lag = lag
+
+    def percentile(self, percent: float) -> float:
+        """A percentile of the recent samples, in seconds."""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+    def summary(self) -> Dict[str, float]:
+        """Lag statistics, in seconds."""
+        mean = self.total_lag / self.sample_count if self.sample_count else 0.0
+        return {
+            "samples": self.sample_count,
+            "mean": mean,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max_lag,
+        }
+
+
+class TimingStats:
+    """Count, total and max of a series of durations, in seconds."""
+
+    __slots__ = ("count", "total", "max", "lag")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        #: Loop lag seen while this was running, see :class:`RunProfiler`.
+        self.lag = 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"count={self.count!r}, total={self.total!r}, max={self.max!r}, "
+            f"lag={self.lag!r}"
+            ")"
+        )
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        mean = self.total / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": mean,
+            "max": self.max,
+            "lag": self.lag,
+        }
+
+
+class RunProfiler(LoopLagMonitor, EventSubscriber):
+    """Profile a run: loop lag, time per callback class and per action name.
+
+    Runners given a profiler attach it to the actions' event buses, giving an
+    action without one the profiler's own bus, and start and stop it around the
+    run. Stopping it detaches it again. Callback times are wall clock, from start
+    to end, including time spent waiting. A lag sample of at least
+    `lag_threshold` seconds is added to the `lag` of each callback class that was
+    running since the previous sample, which points at the callbacks blocking the
+    loop. :meth:`profile_summary` has the stats as a dict, :meth:`report` as text.
+
+    Args:
+        interval: Seconds between loop lag samples.
+        slow_callback_seconds: Callbacks that take longer are logged, and kept in
+            `slow_callbacks`.
+        lag_threshold: The smallest lag sample to attribute to callbacks.
+        max_names: The most action names to keep stats for, later names are
+            counted under "<other>".
+        profile_path: Record a profile of the run to this file.
+        profile_tool: "cprofile", for a file for pstats or snakeviz, or
+            "pyinstrument", for an html report. pyinstrument is an optional
+            package.
+    """
+
+    OTHER = "<other>"
+
+    def __init__(
+        self,
+        interval: float = 0.01,
+        slow_callback_seconds: float = 0.1,
+        lag_threshold: float = 0.01,
+        max_names: int = 1000,
+        profile_path: Optional[Path] = None,
+        profile_tool: str = "cprofile",
+        max_samples: int = 10000,
+    ) -> None:
+        super().__init__(interval=interval, max_samples=max_samples)
+        if profile_tool not in ("cprofile", "pyinstrument"):
+            raise ValueError(f"Unknown profile_tool {profile_tool!r}.")
+        self.slow_callback_seconds = slow_callback_seconds
+        self.lag_threshold = lag_threshold
+        self.max_names = max_names
+        self.profile_path = profile_path
+        self.profile_tool = profile_tool
+        self.events = EventBus([self])
+        self.callbacks: Dict[str, TimingStats] = {}
+        self.actions: Dict[str, TimingStats] = {}
+        self.slow_callbacks: Deque[Dict[str, Any]] = deque(maxlen=100)
+        self.slow_callback_count = 0
+        self._callback_starts: Dict[Tuple[UUID, str], List[float]] = {}
+        self._action_starts: Dict[UUID, float] = {}
+        self._running: Dict[str, int] = {}
+        self._ran_since_sample: Set[str] = set()
+        self._profiler: Any = None
+        self._given_bus: "weakref.WeakSet[Any]" = weakref.WeakSet()
+        self._subscribed: List[EventBus] = []
+        self.started: Optional[float] = None
+        self.elapsed = 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"interval={self.interval!r}, "
+            f"slow_callback_seconds={self.slow_callback_seconds!r}, "
+            f"lag_threshold={self.lag_threshold!r}, "
+            f"profile_path={self.profile_path!r}, "
+            f"profile_tool={self.profile_tool!r}, "
+            f"sample_count={self.sample_count!r}, max_lag={self.max_lag!r}"
+            ")"
+        )
+
+    def attach(self, actions: Iterable[Any]):
+        """Subscribe to the actions' event buses, or give them the profiler's."""
+        for action in actions:
+            if action.events is None:
+                action.events = self.events
+                self._given_bus.add(action)
+            elif (
+                action.events is not self.events
+                and self not in action.events.subscribers
+            ):
+                action.events.subscribe(self)
+                self._subscribed.append(action.events)
+
+    def detach(self):
+        """Undo :meth:`attach`, leaving the actions' event buses as they were."""
+        for action in list(self._given_bus):
+            if action.events is self.events:
+                action.events = None
+        self._given_bus.clear()
+        for bus in self._subscribed:
+            if self in bus.subscribers:
+                bus.unsubscribe(self)
+        self._subscribed.clear()
+
+    def start(self):
+        if self.started is None:
+            self.started = perf_counter()
+            self._start_profile()
+        super().start()
+
+    async def stop(self):
+        await super().stop()
+        self.detach()
+        if self.started is not None:
+            self.elapsed = perf_counter() - self.started
+            self.started = None
+            self._stop_profile()
+
+    def _start_profile(self):
+        if self.profile_path is None:
+            return
+        if self.profile_tool == "pyinstrument":
+            import pyinstrument  # pylint: disable=import-outside-toplevel
+
+            self._profiler = pyinstrument.Profiler(async_mode="enabled")
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def _stop_profile(self):
+        if self._profiler is None:
+            return
+        assert self.profile_path is not None
+        self.profile_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.profile_tool == "pyinstrument":
+            self._profiler.stop()
+            self.profile_path.write_text(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            self._profiler.dump_stats(str(self.profile_path))
+        self._profiler = None
+        logger.info("Wrote a %s profile to %s", self.profile_tool, self.profile_path)
+
+    def add_sample(self, lag: float):
+        super().add_sample(lag)
+        if lag >= self.lag_threshold:
+            for name in self._ran_since_sample.union(self._running):
+                self._stats(self.callbacks, name).lag += lag
+        self._ran_since_sample.clear()
+
+    def _stats(self, stats: Dict[str, TimingStats], name: str) -> TimingStats:
+        timing_stats = stats.get(name)
+        if timing_stats is None:
+            if len(stats) >= self.max_names:
+                name = self.OTHER
+                timing_stats = stats.get(name)
+            if timing_stats is None:
+                timing_stats = stats[name] = TimingStats()
+        return timing_stats
+
+    def handle(self, event: ActionEvent):
+        kind = event.kind
+        if kind is EventKind.CALLBACK_START:
+            key = (event.uid, event.source)
+            self._callback_starts.setdefault(key, []).append(perf_counter())
+            self._running[event.source] = self._running.get(event.source, 0) + 1
+        elif kind is EventKind.CALLBACK_END:
+            key = (event.uid, event.source)
+            starts = self._callback_starts.get(key)
+            if not starts:
+                return
+            seconds = perf_counter() - starts.pop(0)
+            if not starts:
+                del self._callback_starts[key]
+            running = self._running[event.source] - 1
+            if running:
+                self._running[event.source] = running
+            else:
+                del self._running[event.source]
+            self._ran_since_sample.add(event.source)
+            self._stats(self.callbacks, event.source).add(seconds)
+            if seconds >= self.slow_callback_seconds:
+                self._slow_callback(event, seconds)
+        elif kind is EventKind.START:
+            self._action_starts[event.uid] = perf_counter()
+        elif kind is EventKind.FINISH:
+            start = self._action_starts.pop(event.uid, None)
+            if start is not None:
+                name = event.name or "<unnamed>"
+                self._stats(self.actions, name).add(perf_counter() - start)
+
+    def _slow_callback(self, event: ActionEvent, seconds: float):
+        self.slow_callback_count += 1
+        self.slow_callbacks.append(
+            {
+                "callback": event.source,
+                "action_name": event.name,
+                "action_uid": str(event.uid),
+                "seconds": seconds,
+            }
+        )
+        logger.warning(
+            "Slow callback: %s took %.3f seconds for action %r %s",
+            event.source,
+            seconds,
+            event.name,
+            event.uid,
+        )
+
+    def profile_summary(self) -> Dict[str, Any]:
+        """The loop lag summary, and the callback and action stats."""
+        return {
+            "elapsed": self.elapsed,
+            "loop_lag": self.summary(),
+            "callbacks": {
+                name: stats.as_dict() for name, stats in self.callbacks.items()
+            },
+            "actions": {name: stats.as_dict() for name, stats in self.actions.items()},
+            "slow_callback_count": self.slow_callback_count,
+            "slow_callbacks": list(self.slow_callbacks),
+        }
+
+    def report(self, top: int = 10) -> str:
+        """A text summary, with the `top` callbacks and actions by total time."""
+        lag = self.summary()
+        lines = [
+            f"Profiled {self.elapsed:.2f} seconds.",
+            (
+                f"Loop lag: samples={lag['samples']} mean={lag['mean'] * 1000:.1f}ms "
+                f"p50={lag['p50'] * 1000:.1f}ms p99={lag['p99'] * 1000:.1f}ms "
+                f"max={lag['max'] * 1000:.1f}ms"
+            ),
+        ]
+        for title, stats in (("Callbacks", self.callbacks), ("Actions", self.actions)):
+            lines.append(f"{title} by total time:")
+            ordered = sorted(stats.items(), key=lambda item: -item[1].total)
+            for name, timing_stats in ordered[:top]:
+                values = timing_stats.as_dict()
+                lines.append(
+                    f"  {name}: count={timing_stats.count} "
+                    f"total={timing_stats.total:.3f}s "
+                    f"mean={values['mean'] * 1000:.1f}ms "
+                    f"max={timing_stats.max * 1000:.1f}ms "
+                    f"lag={timing_stats.lag:.3f}s"
+                )
+        lines.append(
+            f"Slow callbacks, over {self.slow_callback_seconds}s: "
+            f"{self.slow_callback_count}"
+        )
+        for slow in list(self.slow_callbacks)[-top:]:
+            lines.append(
+                f"  {slow['callback']} {slow['seconds']:.3f}s "
+                f"action {slow['action_name']!r} {slow['action_uid']}"
+            )
+        return "\n".join(lines)
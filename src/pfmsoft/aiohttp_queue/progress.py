@@ -0,0 +1,203 @@
+"""Live progress, throughput and ETA for long runs.
+
+A :class:`ProgressReporter` counts finished actions as the workers report them,
+and on a timer renders the counts, the rolling actions and bytes per second, and
+an estimate of the time remaining. Counting is a few additions per action, and
+rendering runs once per `interval`, so the overhead does not grow with the
+number of actions.
+
+.. code:: python
+
+    progress = ProgressReporter(interval=10)
+    do_queue_runner(actions, workers, progress=progress)
+
+By default each report is a log line at info level. Pass a terminal stream, eg.
+`sys.stderr`, to redraw a single status line instead.
+"""
+import asyncio
+import logging
+from collections import deque
+from time import perf_counter
+from typing import Any, Deque, Dict, Optional, TextIO, Tuple
+
+from pfmsoft.aiohttp_queue.aiohttp import ActionState, AiohttpAction
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def format_bytes(count: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(count) < 1024:
+            return f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} TiB"
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--:--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+class ProgressReporter:
+    """Report the progress of a run every `interval` seconds.
+
+    Args:
+        interval: Seconds between reports.
+        window: Rates are averaged over about this many seconds.
+        stream: Redraw a status line on this stream, eg. sys.stderr, instead of
+            logging each report.
+        total: The number of actions expected. Runners add the actions they are
+            given.
+    """
+
+    def __init__(
+        self,
+        interval: float = 5.0,
+        window: float = 30.0,
+        stream: Optional[TextIO] = None,
+        total: int = 0,
+    ) -> None:
+        self.interval = interval
+        self.window = window
+        self.stream = stream
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.bytes_received = 0
+        self.reports = 0
+        self.started: Optional[float] = None
+        # (time, finished, bytes_received), one per report, for the rolling rates.
+        self._samples: Deque[Tuple[float, int, int]] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self._line_length = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"interval={self.interval!r}, window={self.window!r}, "
+            f"stream={self.stream!r}, total={self.total!r}, "
+            f"succeeded={self.succeeded!r}, failed={self.failed!r}, "
+            f"retries={self.retries!r}"
+            ")"
+        )
+
+    async def __aenter__(self) -> "ProgressReporter":
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.stop()
+
+    @property
+    def finished(self) -> int:
+        return self.succeeded + self.failed
+
+    def add_total(self, count: int):
+        self.total += count
+
+    def start(self):
+        """Start the report timer."""
+        if self.started is None:
+            self.started = perf_counter()
+            self._samples.append((self.started, self.finished, self.bytes_received))
+        if self._task is None:
+            self._task = asyncio.create_task(self._report_loop())
+
+    async def stop(self):
+        """Stop the timer, and make a final report."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.report(final=True)
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.report()
+
+    def action_finished(self, action: AiohttpAction, exception: bool = False):
+        """Count an attempt at an action, called by the workers and runners."""
+        response = action.response
+        if response is not None:
+            self.bytes_received += getattr(response.content, "total_bytes", 0)
+        if exception:
+            self.failed += 1
+        elif action.state == ActionState.RETRY:
+            self.retries += 1
+        elif action.state == ActionState.SUCCESS:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """The current counts and rates. Rates are per second, eta in seconds."""
+        now = perf_counter()
+        finished = self.finished
+        samples = self._samples
+        while len(samples) > 1 and now - samples[1][0] >= self.window:
+            samples.popleft()
+        if samples:
+            then, then_finished, then_bytes = samples[0]
+        else:
+            then, then_finished, then_bytes = now, finished, self.bytes_received
+        elapsed = now - then
+        rate = (finished - then_finished) / elapsed if elapsed > 0 else 0.0
+        bytes_rate = (
+            (self.bytes_received - then_bytes) / elapsed if elapsed > 0 else 0.0
+        )
+        remaining = max(0, self.total - finished)
+        eta: Optional[float] = None
+        if remaining == 0:
+            eta = 0.0
+        elif rate > 0:
+            eta = remaining / rate
+        samples.append((now, finished, self.bytes_received))
+        return {
+            "total": self.total,
+            "finished": finished,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "bytes_received": self.bytes_received,
+            "rate": rate,
+            "bytes_rate": bytes_rate,
+            "eta": eta,
+            "elapsed": now - self.started if self.started is not None else 0.0,
+        }
+
+    def format(self, snapshot: Dict[str, Any]) -> str:
+        percent = (
+            100 * snapshot["finished"] / snapshot["total"] if snapshot["total"] else 0.0
+        )
+        return (
+            f"{snapshot['finished']}/{snapshot['total']} ({percent:.1f}%) "
+            f"ok={snapshot['succeeded']} failed={snapshot['failed']} "
+            f"retries={snapshot['retries']} "
+            f"{snapshot['rate']:.1f} actions/s "
+            f"{format_bytes(snapshot['bytes_rate'])}/s "
+            f"elapsed {format_duration(snapshot['elapsed'])} "
+            f"eta {format_duration(snapshot['eta'])}"
+        )
+
+    def report(self, final: bool = False) -> Dict[str, Any]:
+        """Render a report now, and return its snapshot."""
+        snapshot = self.snapshot()
+        line = self.format(snapshot)
+        self.reports += 1
+        if self.stream is None:
+            logger.info("Progress: %s", line)
+            return snapshot
+        padding = " " * max(0, self._line_length - len(line))
+        self._line_length = len(line)
+        self.stream.write(f"\r{line}{padding}")
+        if final:
+            self.stream.write("\n")
+            self._line_length = 0
+        self.stream.flush()
+        return snapshot
@@ -0,0 +1,526 @@
+"""Record responses to an archive, and replay them without the network.
+
+An archive is a directory with two files. `bodies.bin` holds the response
+bodies, one after another, and `index.jsonl` holds one line per response, with
+the request fingerprint, the status, reason and headers, and where the body is in
+`bodies.bin`. Bodies are stored decoded, so the Content-Encoding and length
+headers are not kept.
+
+Record a run by passing an :class:`ArchiveRecorder` to the runner as a session
+factory, and as a sink so it is closed:
+
+.. code:: python
+
+    recorder = ArchiveRecorder(Path("archive"))
+    do_queue_runner(actions, workers, sinks=[recorder], session_factory=recorder.session)
+
+Replay it with a :class:`ReplayArchive`. The bodies are memory mapped, so a
+replay runs at the speed of the page cache, and the callbacks see the recorded
+responses:
+
+.. code:: python
+
+    with ReplayArchive(Path("archive")) as archive:
+        do_queue_runner(actions, workers, session_factory=archive.session)
+
+Requests are matched by :func:`request_fingerprint`, the method, the URL with its
+sorted query, and the body. A request recorded more than once, eg. a retried
+request, replays its responses in the recorded order, and then repeats the last
+one. A request that is not in the archive raises :class:`ReplayMiss`.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+from contextlib import asynccontextmanager
+from http.cookies import SimpleCookie
+from pathlib import Path
+from typing import (
+    IO,
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from aiohttp import ClientError, ClientSession, RequestInfo
+from aiohttp.client_exceptions import ClientResponseError
+from multidict import CIMultiDict, CIMultiDictProxy, MultiDict, MultiDictProxy
+from yarl import URL
+
+from pfmsoft.aiohttp_queue.sinks import AsyncSink
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+INDEX_FILE_NAME = "index.jsonl"
+BODIES_FILE_NAME = "bodies.bin"
+#: Headers that describe the body on the wire, not the decoded body that is stored.
+DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+_LINK_PARAM_RE = re.compile(r"^(?P<key>[^=]+)=\"?(?P<value>[^\"]*)\"?$")
+
+
+class ReplayMiss(ClientError):
+    """The request is not in the replay archive."""
+
+
+def request_fingerprint(
+    method: str,
+    url: Union[str, URL],
+    params: Optional[Any] = None,
+    data: Any = None,
+    json_data: Any = None,
+) -> str:
+    """A key for a request, from the method, the URL and query, and the body."""
+    full_url = URL(str(url))
+    if params:
+        full_url = full_url.update_query(params)
+    query = sorted(full_url.query.items())
+    hasher = hashlib.sha256()
+    hasher.update(method.upper().encode())
+    hasher.update(b"\n")
+    hasher.update(str(full_url.with_query(None)).encode())
+    hasher.update(b"\n")
+    hasher.update(json.dumps(query).encode())
+    if json_data is not None:
+        hasher.update(b"\njson\n")
+        hasher.update(json.dumps(json_data, sort_keys=True).encode())
+    elif data is not None:
+        hasher.update(b"\ndata\n")
+        if isinstance(data, str):
+            data = data.encode()
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            hasher.update(data)
+        elif isinstance(data, dict):
+            hasher.update(json.dumps(sorted(data.items())).encode())
+        else:
+            hasher.update(repr(data).encode())
+    return hasher.hexdigest()[:32]
+
+
+class ReplayContent:
+    """A stand in for the response's StreamReader, reading from a recorded body."""
+
+    def __init__(self, body: Union[bytes, memoryview]) -> None:
+        self._body = body
+        self._position = 0
+        #: The whole body, as if it had been received.
+        self.total_bytes = len(body)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"total_bytes={self.total_bytes!r}, position={self._position!r}"
+            ")"
+        )
+
+    def at_eof(self) -> bool:
+        return self._position >= self.total_bytes
+
+    async def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            size = self.total_bytes - self._position
+        start = self._position
+        self._position = min(self.total_bytes, start + size)
+        return bytes(self._body[start : self._position])
+
+    async def readany(self) -> bytes:
+        return await self.read()
+
+    async def iter_chunked(self, size: int) -> AsyncIterator[bytes]:
+        while not self.at_eof():
+            yield await self.read(size)
+
+    async def iter_any(self) -> AsyncIterator[bytes]:
+        while not self.at_eof():
+            yield await self.read()
+
+
+class ReplayResponse:
+    """A recorded response, with the parts of the ClientResponse API callbacks use."""
+
+    def __init__(
+        self,
+        entry: Dict[str, Any],
+        body: Union[bytes, memoryview],
+        request_headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.entry = entry
+        self.method: str = entry["method"]
+        self.status: int = entry["status"]
+        self.reason: Optional[str] = entry["reason"]
+        self.url = URL(entry["url"])
+        self.real_url = self.url
+        self.headers = CIMultiDictProxy(CIMultiDict(entry["headers"]))
+        self.version = (1, 1)
+        self.cookies: SimpleCookie = SimpleCookie()
+        for value in self.headers.getall("Set-Cookie", []):
+            self.cookies.load(value)
+        self.request_info = RequestInfo(
+            self.url,
+            self.method,
+            CIMultiDictProxy(CIMultiDict(request_headers or {})),
+            self.url,
+        )
+        self.content = ReplayContent(body)
+        self._raw_body = body
+        self._body: Optional[bytes] = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"method={self.method!r}, url={self.url!r}, status={self.status!r}, "
+            f"reason={self.reason!r}"
+            ")"
+        )
+
+    @property
+    def content_type(self) -> str:
+        content_type = self.headers.get("Content-Type", "application/octet-stream")
+        return content_type.split(";")[0].strip()
+
+    @property
+    def charset(self) -> Optional[str]:
+        for param in self.headers.get("Content-Type", "").split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "charset":
+                return value.strip('"')
+        return None
+
+    @property
+    def links(self) -> MultiDictProxy:
+        """The Link header, parsed as ClientResponse.links does."""
+        links_str = ", ".join(self.headers.getall("Link", []))
+        links: MultiDict = MultiDict()
+        if not links_str:
+            return MultiDictProxy(links)
+        for value in re.split(r",(?=\s*<)", links_str):
+            match = re.match(r"\s*<(.*)>(.*)", value)
+            if match is None:
+                continue
+            url, params_str = match.groups()
+            link: MultiDict = MultiDict()
+            for param in params_str.split(";")[1:]:
+                param_match = _LINK_PARAM_RE.match(param.strip())
+                if param_match is not None:
+                    link.add(param_match.group("key"), param_match.group("value"))
+            key = link.get("rel", url)
+            link.add("url", self.url.join(URL(url)))
+            links.add(str(key), MultiDictProxy(link))
+        return MultiDictProxy(links)
+
+    async def read(self) -> bytes:
+        if self._body is None:
+            self._body = bytes(self._raw_body)
+        return self._body
+
+    async def text(self, encoding: Optional[str] = None) -> str:
+        body = await self.read()
+        return body.decode(encoding or self.charset or "utf-8")
+
+    async def json(
+        self,
+        *,
+        encoding: Optional[str] = None,
+        loads: Callable[[str], Any] = json.loads,
+        content_type: Optional[str] = None,
+    ) -> Any:
+        _ = content_type
+        text = await self.text(encoding)
+        if not text.strip():
+            return None
+        return loads(text)
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise ClientResponseError(
+                self.request_info,
+                (),
+                status=self.status,
+                message=self.reason or "",
+                headers=self.headers,
+            )
+
+    def release(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReplaySession:
+    """A session-like object that answers requests from a :class:`ReplayArchive`.
+
+    Takes and ignores the ClientSession kwargs, so runners can use it in place of
+    a ClientSession.
+    """
+
+    def __init__(self, archive: "ReplayArchive", **session_kwargs) -> None:
+        _ = session_kwargs
+        self.archive = archive
+        self.closed = False
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(" f"archive={self.archive!r}" ")"
+
+    async def __aenter__(self) -> "ReplaySession":
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    async def close(self):
+        self.closed = True
+
+    @asynccontextmanager
+    async def request(
+        self,
+        method: str,
+        url: Union[str, URL],
+        params: Optional[Any] = None,
+        data: Any = None,
+        json: Any = None,  # pylint: disable=redefined-outer-name
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs,
+    ) -> AsyncIterator[ReplayResponse]:
+        _ = kwargs
+        fingerprint = request_fingerprint(method, url, params, data, json)
+        entry = self.archive.lookup(fingerprint)
+        if entry is None:
+            raise ReplayMiss(f"No recorded response for {method} {url} {params!r}")
+        yield ReplayResponse(entry, self.archive.body(entry), headers)
+
+
+class ReplayArchive:
+    """Read an archive, with the bodies memory mapped.
+
+    Use as a context manager, or call :meth:`close`, to unmap the bodies.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.entries: Dict[str, List[Dict[str, Any]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._cursors: Dict[str, int] = {}
+        with open(directory / INDEX_FILE_NAME, "rb") as index_file:
+            for line in index_file:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries.setdefault(entry["fingerprint"], []).append(entry)
+        self._file: Optional[IO[bytes]] = open(directory / BODIES_FILE_NAME, "rb")
+        self._map: Optional[mmap.mmap] = None
+        if os.fstat(self._file.fileno()).st_size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"directory={self.directory!r}, requests={len(self.entries)!r}, "
+            f"hits={self.hits!r}, misses={self.misses!r}"
+            ")"
+        )
+
+    def __enter__(self) -> "ReplayArchive":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def session(self, **session_kwargs) -> ReplaySession:
+        """A session for the runners' `session_factory`."""
+        return ReplaySession(self, **session_kwargs)
+
+    def lookup(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """The next recorded response for a request, or None."""
+        entries = self.entries.get(fingerprint)
+        if not entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        cursor = self._cursors.get(fingerprint, 0)
+        self._cursors[fingerprint] = cursor + 1
+        return entries[min(cursor, len(entries) - 1)]
+
+    def body(self, entry: Dict[str, Any]) -> Union[bytes, memoryview]:
+        """The recorded body, a view into the memory mapped bodies file."""
+        if not entry["length"]:
+            return b""
+        assert self._map is not None
+        return memoryview(self._map)[
+            entry["offset"] : entry["offset"] + entry["length"]
+        ]
+
+    def rewind(self):
+        """Replay repeated requests from their first response again."""
+        self._cursors.clear()
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A response body is still referenced, the map is freed with it.
+                logger.debug("%r is still in use, leaving the map open.", self)
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class RecordingSession:
+    """A ClientSession wrapper that records each response to an ArchiveRecorder.
+
+    The whole body is read before the callbacks run, and they get a
+    :class:`ReplayResponse` of it, the same as in a replay.
+    """
+
+    def __init__(self, recorder: "ArchiveRecorder", **session_kwargs) -> None:
+        self.recorder = recorder
+        self.session = ClientSession(**session_kwargs)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(" f"recorder={self.recorder!r}" ")"
+
+    async def __aenter__(self) -> "RecordingSession":
+        await self.session.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.session.__aexit__(exc_type, exc, traceback)
+
+    @property
+    def closed(self) -> bool:
+        return self.session.closed
+
+    async def close(self):
+        await self.session.close()
+
+    @asynccontextmanager
+    async def request(
+        self,
+        method: str,
+        url: Union[str, URL],
+        params: Optional[Any] = None,
+        data: Any = None,
+        json: Any = None,  # pylint: disable=redefined-outer-name
+        headers: Optional[Dict[str, str]] = None,
+        **kwargs,
+    ) -> AsyncIterator[ReplayResponse]:
+        async with self.session.request(
+            method, url, params=params, data=data, json=json, headers=headers, **kwargs
+        ) as response:
+            body = await response.read()
+            entry = {
+                "fingerprint": request_fingerprint(method, url, params, data, json),
+                "method": method.upper(),
+                "url": str(response.url),
+                "status": response.status,
+                "reason": response.reason,
+                "headers": [
+                    [key, value]
+                    for key, value in response.headers.items()
+                    if key.lower() not in DROPPED_HEADERS
+                ],
+            }
+            await self.recorder.put((entry, body))
+            yield ReplayResponse(entry, body, dict(response.request_info.headers))
+
+
+class ArchiveRecorder(AsyncSink):
+    """Write recorded responses to an archive directory.
+
+    The recorder is an :class:`~pfmsoft.aiohttp_queue.sinks.AsyncSink`, the files
+    are written in batches in an executor. Pass it to the runner's sinks, so it
+    is closed, and its :meth:`session` as the runner's session_factory.
+
+    Args:
+        directory: The archive directory, made if needed.
+        mode: "w" to start a new archive, "a" to add to an existing one.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        mode: str = "w",
+        flush_size: int = 100,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 1000,
+    ) -> None:
+        super().__init__(
+            flush_size=flush_size,
+            flush_interval=flush_interval,
+            max_queue_size=max_queue_size,
+        )
+        if mode not in ("w", "a"):
+            raise ValueError(f"mode must be 'w' or 'a', got {mode!r}.")
+        self.directory = directory
+        self.mode = mode
+        self.bytes_written = 0
+        self._index: Optional[IO[bytes]] = None
+        self._bodies: Optional[IO[bytes]] = None
+        self._offset = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"directory={self.directory!r}, mode={self.mode!r}, "
+            f"records_written={self.records_written!r}, "
+            f"bytes_written={self.bytes_written!r}, closed={self.closed!r}"
+            ")"
+        )
+
+    def session(self, **session_kwargs) -> RecordingSession:
+        """A recording session for the runners' `session_factory`."""
+        return RecordingSession(self, **session_kwargs)
+
+    def _open_files(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._bodies = open(self.directory / BODIES_FILE_NAME, f"{self.mode}b")
+        self._index = open(self.directory / INDEX_FILE_NAME, f"{self.mode}b")
+        self._offset = self._bodies.seek(0, os.SEEK_END)
+
+    def _write_records(self, batch: Sequence[Tuple[Dict[str, Any], bytes]]):
+        assert self._bodies is not None and self._index is not None
+        lines = []
+        for entry, body in batch:
+            self._bodies.write(body)
+            lines.append(
+                json.dumps(
+                    {**entry, "offset": self._offset, "length": len(body)},
+                    separators=(",", ":"),
+                ).encode()
+            )
+            self._offset += len(body)
+            self.bytes_written += len(body)
+        self._index.write(b"\n".join(lines) + b"\n")
+        # Bodies first, so an index line never points past the end of the file.
+        self._bodies.flush()
+        self._index.flush()
+
+    def _close_files(self):
+        for file in (self._bodies, self._index):
+            if file is not None:
+                file.close()
+        self._bodies = None
+        self._index = None
+
+    async def open_sink(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._open_files)
+
+    async def write_batch(self, batch: List[Any]):
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._write_records, batch
+        )
+
+    async def close_sink(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._close_files)
@@ -3,31 +3,143 @@ import logging
 from asyncio import Task, create_task, gather
 from asyncio.queues import Queue
 from time import perf_counter_ns
-from typing import Dict, Optional, Sequence
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence
 
 from aiohttp import ClientSession
 
 from pfmsoft.aiohttp_queue import AiohttpAction, AiohttpQueueWorker
+from pfmsoft.aiohttp_queue.metrics import RunnerMetrics
+from pfmsoft.aiohttp_queue.profiling import RunProfiler
+from pfmsoft.aiohttp_queue.progress import ProgressReporter
+from pfmsoft.aiohttp_queue.sinks import AsyncSink
+from pfmsoft.aiohttp_queue.tracing import with_phase_tracing
 from pfmsoft.aiohttp_queue.utilities import optional_object
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
+#: Makes a session-like object from the ClientSession kwargs, eg.
+#: :meth:`pfmsoft.aiohttp_queue.replay.ReplayArchive.session`.
+SessionFactory = Callable[..., Any]
+
+
+async def close_sinks(sinks: Optional[Sequence[AsyncSink]]):
+    """Close shared sinks, writing any records they still hold."""
+    if sinks is None:
+        return
+    for sink in sinks:
+        await sink.close()
+
+
+async def do_with_metrics(
+    action: AiohttpAction,
+    session: ClientSession,
+    metrics: Optional[RunnerMetrics],
+    progress: Optional[ProgressReporter] = None,
+):
+    """Do an action, recording it in metrics and progress if there are any."""
+    if metrics is None and progress is None:
+        await action.do_action(session)
+        return
+    start = metrics.action_started() if metrics is not None else 0.0
+    exception = False
+    try:
+        await action.do_action(session)
+    except Exception:
+        exception = True
+        raise
+    finally:
+        if metrics is not None:
+            metrics.action_finished(action, start, exception)
+        if progress is not None:
+            progress.action_finished(action, exception)
+
+
+def start_progress(
+    progress: Optional[ProgressReporter], actions: Sequence[AiohttpAction]
+):
+    if progress is not None:
+        progress.add_total(len(actions))
+        progress.start()
+
+
+async def stop_progress(progress: Optional[ProgressReporter]):
+    if progress is not None:
+        await progress.stop()
+
+
+def start_profiler(profiler: Optional[RunProfiler], actions: Sequence[AiohttpAction]):
+    if profiler is not None:
+        profiler.attach(actions)
+        profiler.start()
+
+
+async def stop_profiler(profiler: Optional[RunProfiler]):
+    if profiler is not None:
+        await profiler.stop()
+        logger.info("Profile report:\n%s", profiler.report())
+
+
+def session_options(session_kwargs: Optional[Dict], trace: bool) -> Dict:
+    """The ClientSession kwargs, with the phase trace config if trace is True."""
+    if trace:
+        return with_phase_tracing(session_kwargs)
+    return optional_object(session_kwargs, dict)
+
+
+def open_session(session_kwargs: Dict, session_factory: Optional[SessionFactory]):
+    """A ClientSession, or the session_factory's session if there is one."""
+    if session_factory is None:
+        return ClientSession(**session_kwargs)
+    return session_factory(**session_kwargs)
+
 
 def do_single_action_runner(
     action: AiohttpAction,
     session_kwargs=None,
+    sinks: Optional[Sequence[AsyncSink]] = None,
+    metrics: Optional[RunnerMetrics] = None,
+    trace: bool = False,
+    progress: Optional[ProgressReporter] = None,
+    profiler: Optional[RunProfiler] = None,
+    session_factory: Optional[SessionFactory] = None,
 ):
-    asyncio.run(single_action_runner(action, session_kwargs))
+    asyncio.run(
+        single_action_runner(
+            action,
+            session_kwargs,
+            sinks,
+            metrics,
+            trace,
+            progress,
+            profiler,
+            session_factory,
+        )
+    )
 
 
 async def single_action_runner(
-    action: AiohttpAction, session_kwargs: Optional[Dict] = None
+    action: AiohttpAction,
+    session_kwargs: Optional[Dict] = None,
+    sinks: Optional[Sequence[AsyncSink]] = None,
+    metrics: Optional[RunnerMetrics] = None,
+    trace: bool = False,
+    progress: Optional[ProgressReporter] = None,
+    profiler: Optional[RunProfiler] = None,
+    session_factory: Optional[SessionFactory] = None,
 ):
     start = perf_counter_ns()
-    session_kwargs = optional_object(session_kwargs, dict)
-    async with ClientSession(**session_kwargs) as session:
-        await action.do_action(session)
+    session_kwargs = session_options(session_kwargs, trace)
+    start_progress(progress, [action])
+    start_profiler(profiler, [action])
+    try:
+        async with open_session(session_kwargs, session_factory) as session:
+            await do_with_metrics(action, session, metrics, progress)
+    finally:
+        # Also when the action raises, so the sinks write what they have.
+        await stop_progress(progress)
+        await stop_profiler(profiler)
+        await close_sinks(sinks)
     end = perf_counter_ns()
     seconds = (end - start) / 1000000000
     logger.info(
@@ -39,19 +151,50 @@ async def single_action_runner(
 def do_sequential_action_runner(
     actions: Sequence[AiohttpAction],
     session_kwargs=None,
+    sinks: Optional[Sequence[AsyncSink]] = None,
+    metrics: Optional[RunnerMetrics] = None,
+    trace: bool = False,
+    progress: Optional[ProgressReporter] = None,
+    profiler: Optional[RunProfiler] = None,
+    session_factory: Optional[SessionFactory] = None,
 ):
-    asyncio.run(sequential_action_runner(actions, session_kwargs))
+    asyncio.run(
+        sequential_action_runner(
+            actions,
+            session_kwargs,
+            sinks,
+            metrics,
+            trace,
+            progress,
+            profiler,
+            session_factory,
+        )
+    )
 
 
 async def sequential_action_runner(
     actions: Sequence[AiohttpAction],
     session_kwargs=None,
+    sinks: Optional[Sequence[AsyncSink]] = None,
+    metrics: Optional[RunnerMetrics] = None,
+    trace: bool = False,
+    progress: Optional[ProgressReporter] = None,
+    profiler: Optional[RunProfiler] = None,
+    session_factory: Optional[SessionFactory] = None,
 ):
     start = perf_counter_ns()
-    session_kwargs = optional_object(session_kwargs, dict)
-    async with ClientSession(**session_kwargs) as session:
-        for action in actions:
-            await action.do_action(session)
+    session_kwargs = session_options(session_kwargs, trace)
+    start_progress(progress, actions)
+    start_profiler(profiler, actions)
+    try:
+        async with open_session(session_kwargs, session_factory) as session:
+            for action in actions:
+                await do_with_metrics(action, session, metrics, progress)
+    finally:
+        # Also when an action raises, so the sinks write what they have.
+        await stop_progress(progress)
+        await stop_profiler(profiler)
+        await close_sinks(sinks)
     end = perf_counter_ns()
     seconds = (end - start) / 1000000000
     logger.info(
@@ -66,37 +209,78 @@ def do_queue_runner(
     actions: Sequence[AiohttpAction],
     workers: Sequence[AiohttpQueueWorker],
     session_kwargs=None,
+    sinks: Optional[Sequence[AsyncSink]] = None,
+    metrics: Optional[RunnerMetrics] = None,
+    trace: bool = False,
+    progress: Optional[ProgressReporter] = None,
+    profiler: Optional[RunProfiler] = None,
+    session_factory: Optional[SessionFactory] = None,
 ):
-    asyncio.run(queue_runner(actions, workers, session_kwargs))
+    asyncio.run(
+        queue_runner(
+            actions,
+            workers,
+            session_kwargs,
+            sinks,
+            metrics,
+            trace,
+            progress,
+            profiler,
+            session_factory,
+        )
+    )
 
 
 async def queue_runner(
     actions: Sequence[AiohttpAction],
     workers: Sequence[AiohttpQueueWorker],
     session_kwargs=None,
+    sinks: Optional[Sequence[AsyncSink]] = None,
+    metrics: Optional[RunnerMetrics] = None,
+    trace: bool = False,
+    progress: Optional[ProgressReporter] = None,
+    profiler: Optional[RunProfiler] = None,
+    session_factory: Optional[SessionFactory] = None,
 ):
     start = perf_counter_ns()
-    session_kwargs = optional_object(session_kwargs, dict)
+    session_kwargs = session_options(session_kwargs, trace)
     queue: Queue = Queue()
-    async with ClientSession(**session_kwargs) as session:
+    async with open_session(session_kwargs, session_factory) as session:
         worker_tasks = []
         for worker in workers:
-            worker_task: Task = create_task(worker.consumer(queue, session))
+            worker_task: Task = create_task(
+                worker.consumer(queue, session, metrics, progress)
+            )
             worker_tasks.append(worker_task)
+        if metrics is not None:
+            metrics.workers.set(len(workers))
         logger.info(
             "Adding %d actions to queue, with %d workers.", len(actions), len(workers)
         )
-        for action in actions:
-            queue.put_nowait(action)
-        await queue.join()
-        for worker_task in worker_tasks:
-            worker_task.cancel()
-        worker_report = [
-            f"Worker {worker.uid} accomplished {worker.task_count} tasks."
-            for worker in workers
-        ]
-        logger.info("Worker Report: %s", list(worker_report))
-        await gather(*worker_tasks, return_exceptions=True)
+        try:
+            start_profiler(profiler, actions)
+            for action in actions:
+                action.mark_enqueued()
+                queue.put_nowait(action)
+            if metrics is not None:
+                metrics.queue_depth.set(queue.qsize())
+            start_progress(progress, actions)
+            await queue.join()
+        finally:
+            # Also when the run is cancelled, so the sinks write what they have.
+            await stop_progress(progress)
+            await stop_profiler(profiler)
+            if metrics is not None:
+                metrics.workers.set(0)
+            for worker_task in worker_tasks:
+                worker_task.cancel()
+            worker_report = [
+                f"Worker {worker.uid} accomplished {worker.task_count} tasks."
+                for worker in workers
+            ]
+            logger.info("Worker Report: %s", list(worker_report))
+            await gather(*worker_tasks, return_exceptions=True)
+            await close_sinks(sinks)
         end = perf_counter_ns()
         seconds = (end - start) / 1000000000
         logger.info(
@@ -109,3 +293,154 @@ async def queue_runner(
             f"{(len(actions)/seconds):.2f}",
             len(worker_tasks),
         )
+
+
+class FeedQueue(Queue):
+    """An unbounded queue that a producer can wait on until it has room.
+
+    New actions wait in :meth:`wait_for_room` until fewer than `max_queued` are
+    queued. Retries are put by the workers without waiting, so a worker can not
+    block on a full queue that only the workers empty.
+    """
+
+    def __init__(self, max_queued: int) -> None:
+        super().__init__()
+        self.max_queued = max(max_queued, 1)
+        self._room = asyncio.Event()
+
+    def get_nowait(self):
+        # Queue.get ends with get_nowait, so this sees every get.
+        item = super().get_nowait()
+        if self.qsize() < self.max_queued:
+            self._room.set()
+        return item
+
+    async def wait_for_room(self):
+        while self.qsize() >= self.max_queued:
+            self._room.clear()
+            await self._room.wait()
+
+
+def do_streaming_queue_runner(
+    actions: Iterable[AiohttpAction],
+    workers: Sequence[AiohttpQueueWorker],
+    session_kwargs=None,
+    sinks: Optional[Sequence[AsyncSink]] = None,
+    metrics: Optional[RunnerMetrics] = None,
+    trace: bool = False,
+    progress: Optional[ProgressReporter] = None,
+    profiler: Optional[RunProfiler] = None,
+    session_factory: Optional[SessionFactory] = None,
+    max_queued: int = 1000,
+    rate: Optional[float] = None,
+) -> Dict[str, Any]:
+    return asyncio.run(
+        streaming_queue_runner(
+            actions,
+            workers,
+            session_kwargs,
+            sinks,
+            metrics,
+            trace,
+            progress,
+            profiler,
+            session_factory,
+            max_queued,
+            rate,
+        )
+    )
+
+
+async def streaming_queue_runner(
+    actions: Iterable[AiohttpAction],
+    workers: Sequence[AiohttpQueueWorker],
+    session_kwargs=None,
+    sinks: Optional[Sequence[AsyncSink]] = None,
+    metrics: Optional[RunnerMetrics] = None,
+    trace: bool = False,
+    progress: Optional[ProgressReporter] = None,
+    profiler: Optional[RunProfiler] = None,
+    session_factory: Optional[SessionFactory] = None,
+    max_queued: int = 1000,
+    rate: Optional[float] = None,
+) -> Dict[str, Any]:
+    """A queue runner that takes the actions from an iterable, as the queue has room.
+
+    Actions are only taken from `actions` while fewer than `max_queued` are
+    queued, so a generator, eg. reading a job file, is never loaded at once.
+    With a `rate`, new actions are started at no more than `rate` per second.
+    Retries are not rate limited.
+
+    Returns:
+        The number of actions, the seconds taken, actions per second, and the
+        number of workers.
+    """
+    start = perf_counter_ns()
+    session_kwargs = session_options(session_kwargs, trace)
+    queue = FeedQueue(max_queued)
+    action_count = 0
+    async with open_session(session_kwargs, session_factory) as session:
+        worker_tasks = []
+        for worker in workers:
+            worker_task: Task = create_task(
+                worker.consumer(queue, session, metrics, progress)
+            )
+            worker_tasks.append(worker_task)
+        if metrics is not None:
+            metrics.workers.set(len(workers))
+        logger.info(
+            "Streaming actions to a queue of %d, with %d workers.",
+            queue.max_queued,
+            len(workers),
+        )
+        start_progress(progress, [])
+        start_profiler(profiler, [])
+        loop = asyncio.get_running_loop()
+        interval = 1 / rate if rate else 0.0
+        next_start = loop.time()
+        try:
+            for action in actions:
+                await queue.wait_for_room()
+                if interval:
+                    delay = next_start - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    next_start = max(next_start, loop.time() - interval) + interval
+                if profiler is not None:
+                    profiler.attach([action])
+                if progress is not None:
+                    progress.add_total(1)
+                action.mark_enqueued()
+                queue.put_nowait(action)
+                action_count += 1
+                if metrics is not None:
+                    metrics.queue_depth.set(queue.qsize())
+            await queue.join()
+        finally:
+            # Also when reading the actions fails, so the sinks keep what they have.
+            await stop_progress(progress)
+            await stop_profiler(profiler)
+            if metrics is not None:
+                metrics.workers.set(0)
+            for worker_task in worker_tasks:
+                worker_task.cancel()
+            await gather(*worker_tasks, return_exceptions=True)
+            await close_sinks(sinks)
+    seconds = (perf_counter_ns() - start) / 1000000000
+    summary = {
+        "actions": action_count,
+        "seconds": seconds,
+        "actions_per_second": action_count / seconds if seconds else 0.0,
+        "workers": len(workers),
+    }
+    logger.info(
+        (
+            "%s Actions concurrently completed - took %s seconds, "
+            "%s actions per second using %s workers."
+        ),
+        action_count,
+        f"{seconds:.2f}",
+        f"{summary['actions_per_second']:.2f}",
+        len(workers),
+    )
+    return summary
@@ -0,0 +1,581 @@
+"""Shared sinks, that collect results from many actions.
+
+:class:`JsonLinesSink` writes JSON Lines files, :class:`ParquetSink` writes
+columnar Parquet files, and :class:`SqliteSink` writes rows to a SQLite table.
+
+A sink is shared between actions, and written by a single writer task. Records
+are put on a bounded queue, and the writer takes them off in batches, writing
+when `flush_size` records are waiting or `flush_interval` seconds after the
+first record of a batch arrived.
+
+The writer task starts with the first record. Pass sinks to a runner, so they
+are closed, and their last batch written, before the runner returns.
+
+.. code:: python
+
+    sink = JsonLinesSink(Path("results.jsonl.gz"))
+    callbacks = ActionCallbacks(
+        success=[ResponseContentToJson(), SaveResultToSink(sink)]
+    )
+    ...
+    do_queue_runner(actions, workers, sinks=[sink])
+"""
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import Executor, ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence
+
+from pfmsoft.aiohttp_queue.compression import (
+    AUTO,
+    AsyncFileWriter,
+    compression_from_path,
+    get_encoder,
+    resolve_compression,
+)
+from pfmsoft.aiohttp_queue.json_codec import JsonCodec, get_json_codec
+from pfmsoft.aiohttp_queue.json_stream import JsonArrayItemHandler
+from pfmsoft.aiohttp_queue.utilities import optional_object
+
+if TYPE_CHECKING:
+    from pfmsoft.aiohttp_queue.aiohttp import AiohttpAction
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+_CLOSE = object()
+
+
+def rows_from_records(records: List[Any]) -> List[Dict]:
+    """Flatten records that are a dict, or a list of dicts, into a list of rows."""
+    rows: List[Dict] = []
+    for record in records:
+        if isinstance(record, list):
+            rows.extend(record)
+        else:
+            rows.append(record)
+    return rows
+
+
+class AsyncSink:
+    """Base class for shared sinks with a single batching writer task.
+
+    Subclasses implement :meth:`write_batch`, and optionally :meth:`open_sink`
+    and :meth:`close_sink`.
+    """
+
+    def __init__(
+        self,
+        flush_size: int = 1000,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10000,
+    ) -> None:
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.records_written = 0
+        self.batches_written = 0
+        self.closed = False
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"flush_size={self.flush_size!r}, flush_interval={self.flush_interval!r}, "
+            f"max_queue_size={self.max_queue_size!r}, "
+            f"records_written={self.records_written!r}, "
+            f"batches_written={self.batches_written!r}, closed={self.closed!r}"
+            ")"
+        )
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    async def start(self):
+        """Start the writer task. Called by the first put."""
+        self._start_writer()
+
+    def _start_writer(self):
+        if self.closed:
+            raise RuntimeError(f"{self!r} is closed.")
+        if self._writer_task is None:
+            # No await before the task exists, so concurrent puts start one writer.
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._writer_task = asyncio.create_task(self._write_loop())
+
+    async def put(self, record: Any):
+        """Add a record. Waits if the queue is full."""
+        await self.start()
+        self._check_error()
+        assert self._queue is not None
+        await self._queue.put(record)
+
+    def put_nowait(self, record: Any):
+        """Add a record without waiting, from code running in the event loop.
+
+        Raises asyncio.QueueFull if the queue is full.
+        """
+        self._start_writer()
+        self._check_error()
+        assert self._queue is not None
+        self._queue.put_nowait(record)
+
+    async def put_many(self, records: Iterable[Any]):
+        for record in records:
+            await self.put(record)
+
+    async def close(self):
+        """Write the remaining records, and close the sink."""
+        if self.closed:
+            return
+        if self._writer_task is not None:
+            assert self._queue is not None
+            if not self._writer_task.done():
+                await self._queue.put(_CLOSE)
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+            await self.close_sink()
+        self.closed = True
+        logger.info(
+            "Closed %r, wrote %s records in %s batches.",
+            self,
+            self.records_written,
+            self.batches_written,
+        )
+        self._check_error()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise RuntimeError(f"Writer for {self!r} failed.") from self._error
+
+    async def _write_loop(self):
+        assert self._queue is not None
+        queue = self._queue
+        close_seen = False
+        try:
+            await self.open_sink()
+            while not close_seen:
+                batch, close_seen = await self._next_batch(queue)
+                if batch:
+                    await self.write_batch(batch)
+                    self.records_written += len(batch)
+                    self.batches_written += 1
+        except Exception as ex:  # pylint: disable=broad-except
+            logger.exception("Exception in the writer for %r", self)
+            self._error = ex
+            if not close_seen:
+                # Keep draining, so a put never waits on a failed writer.
+                while await queue.get() is not _CLOSE:
+                    pass
+
+    async def _next_batch(self, queue: asyncio.Queue):
+        """Wait for a record, then collect a batch.
+
+        Returns the batch, and True if the close marker was seen.
+        """
+        loop = asyncio.get_running_loop()
+        record = await queue.get()
+        if record is _CLOSE:
+            return [], True
+        batch = [record]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.flush_size:
+            try:
+                record = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if record is _CLOSE:
+                return batch, True
+            batch.append(record)
+        return batch, False
+
+    async def open_sink(self):
+        """Open any resources, called before the writer task starts."""
+
+    async def write_batch(self, batch: List[Any]):
+        raise NotImplementedError()
+
+    async def close_sink(self):
+        """Close any resources, called after the last batch is written."""
+
+
+class JsonLinesSink(AsyncSink):
+    """Write records to a JSON Lines file, one record per line.
+
+    If `rotate_bytes` or `rotate_records` are set, a new file is started when the
+    current one reaches that size. `rotate_bytes` is checked between batches,
+    and counts bytes before compression. Rotated files are numbered, eg.
+    `results-00001.jsonl`. Compression is selected as for the file callbacks, eg.
+    `results.jsonl.gz` is gzip compressed.
+    """
+
+    def __init__(
+        self,
+        file_path: Path,
+        mode: str = "w",
+        codec: Optional[JsonCodec] = None,
+        rotate_bytes: Optional[int] = None,
+        rotate_records: Optional[int] = None,
+        compression: Optional[str] = AUTO,
+        compression_level: Optional[int] = None,
+        flush_size: int = 1000,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10000,
+    ) -> None:
+        super().__init__(
+            flush_size=flush_size,
+            flush_interval=flush_interval,
+            max_queue_size=max_queue_size,
+        )
+        self.file_path = file_path
+        self.mode = mode
+        self.codec = optional_object(codec, get_json_codec)
+        self.rotate_bytes = rotate_bytes
+        self.rotate_records = rotate_records
+        self.compression = resolve_compression(compression, file_path)
+        self.compression_level = compression_level
+        self.file_paths: List[Path] = []
+        self._file: Optional[AsyncFileWriter] = None
+        self._file_records = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"file_path={self.file_path!r}, mode={self.mode!r}, "
+            f"codec={self.codec!r}, rotate_bytes={self.rotate_bytes!r}, "
+            f"rotate_records={self.rotate_records!r}, "
+            f"compression={self.compression!r}, "
+            f"records_written={self.records_written!r}, "
+            f"batches_written={self.batches_written!r}, closed={self.closed!r}"
+            ")"
+        )
+
+    @property
+    def rotating(self) -> bool:
+        return self.rotate_bytes is not None or self.rotate_records is not None
+
+    def next_file_path(self) -> Path:
+        if not self.rotating:
+            return self.file_path
+        # Number the file before the suffixes, keeping a compression suffix last.
+        suffix = self.file_path.suffix
+        stem_path = self.file_path.with_suffix("")
+        if compression_from_path(self.file_path) is not None:
+            suffix = stem_path.suffix + suffix
+            stem_path = stem_path.with_suffix("")
+        return stem_path.with_name(
+            f"{stem_path.name}-{len(self.file_paths) + 1:05d}{suffix}"
+        )
+
+    async def _open_file(self):
+        file_path = self.next_file_path()
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = AsyncFileWriter(
+            file_path,
+            mode=self.mode,
+            encoder=get_encoder(self.compression, self.compression_level),
+        )
+        await self._file.__aenter__()
+        self.file_paths.append(file_path)
+        self._file_records = 0
+
+    async def _close_file(self):
+        if self._file is not None:
+            await self._file.__aexit__(None, None, None)
+            self._file = None
+
+    def _file_full(self) -> bool:
+        if self._file is None:
+            return False
+        if self.rotate_bytes is not None and self._file.bytes_in >= self.rotate_bytes:
+            return True
+        if (
+            self.rotate_records is not None
+            and self._file_records >= self.rotate_records
+        ):
+            return True
+        return False
+
+    async def write_batch(self, batch: List[Any]):
+        lines = [self.codec.dumps(record) for record in batch]
+        start = 0
+        while start < len(lines):
+            if self._file is None or self._file_full():
+                await self._close_file()
+                await self._open_file()
+            assert self._file is not None
+            end = len(lines)
+            if self.rotate_records is not None:
+                end = min(end, start + self.rotate_records - self._file_records)
+            await self._file.write(b"\n".join(lines[start:end]) + b"\n")
+            self._file_records += end - start
+            start = end
+
+    async def close_sink(self):
+        await self._close_file()
+
+
+class ParquetSink(AsyncSink):
+    """Write List[Dict] results to a Parquet file, through Arrow record batches.
+
+    Needs the optional `pyarrow` package. Each record is a dict, or a list of dicts,
+    so a List[Dict] result can be put without exploding it. Rows are collected
+    until there are `row_group_size` of them, and then written as a row group.
+
+    The schema is inferred from the first row group, unless a `pyarrow.Schema` is
+    given. Later rows are cast to that schema, missing fields are null and extra
+    fields are dropped. Converting and writing run in `executor`, the event
+    loop's default executor if None.
+    """
+
+    def __init__(
+        self,
+        file_path: Path,
+        schema: Any = None,
+        row_group_size: int = 65536,
+        parquet_compression: str = "zstd",
+        executor: Optional[Executor] = None,
+        flush_size: int = 1000,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10000,
+    ) -> None:
+        import pyarrow  # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+
+        super().__init__(
+            flush_size=flush_size,
+            flush_interval=flush_interval,
+            max_queue_size=max_queue_size,
+        )
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.file_path = file_path
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.parquet_compression = parquet_compression
+        self.executor = executor
+        self.rows_written = 0
+        self.row_groups_written = 0
+        self._rows: List[Dict] = []
+        self._parquet_writer: Any = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"file_path={self.file_path!r}, row_group_size={self.row_group_size!r}, "
+            f"parquet_compression={self.parquet_compression!r}, "
+            f"rows_written={self.rows_written!r}, "
+            f"row_groups_written={self.row_groups_written!r}, "
+            f"records_written={self.records_written!r}, "
+            f"batches_written={self.batches_written!r}, closed={self.closed!r}"
+            ")"
+        )
+
+    async def write_batch(self, batch: List[Any]):
+        self._rows.extend(rows_from_records(batch))
+        while len(self._rows) >= self.row_group_size:
+            rows = self._rows[: self.row_group_size]
+            del self._rows[: self.row_group_size]
+            await self._run(self.write_row_group, rows)
+
+    async def close_sink(self):
+        if self._rows:
+            rows = self._rows
+            self._rows = []
+            await self._run(self.write_row_group, rows)
+        if self._parquet_writer is not None:
+            await self._run(self._parquet_writer.close)
+            self._parquet_writer = None
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def write_row_group(self, rows: List[Dict]):
+        """Convert rows to Arrow, and write them. Blocking, runs in the executor."""
+        table = self._pa.Table.from_pylist(rows, schema=self.schema)
+        if self._parquet_writer is None:
+            self.schema = table.schema
+            self.file_path.parent.mkdir(parents=True, exist_ok=True)
+            self._parquet_writer = self._pq.ParquetWriter(
+                str(self.file_path), self.schema, compression=self.parquet_compression
+            )
+        self._parquet_writer.write_table(table, row_group_size=len(rows))
+        self.rows_written += len(rows)
+        self.row_groups_written += 1
+
+
+def quote_identifier(name: str) -> str:
+    """Quote a SQLite table or column name."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SqliteSink(AsyncSink):
+    """Write List[Dict] or dict results to a SQLite table.
+
+    Each record is a dict, or a list of dicts. Every batch is inserted with
+    `executemany` in a single transaction, so use a large `flush_size` for fast
+    ingest. The database is opened in WAL mode, and all database work runs on a
+    single dedicated thread, off the event loop.
+
+    `columns` defaults to the keys of the first row. If `key_columns` is given,
+    rows with the same key are updated in place (upsert). The table is created
+    if it does not exist, with optional SQLite `column_types`. Values that are
+    lists or dicts are stored as JSON text.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        table: str,
+        columns: Optional[Sequence[str]] = None,
+        key_columns: Optional[Sequence[str]] = None,
+        column_types: Optional[Dict[str, str]] = None,
+        codec: Optional[JsonCodec] = None,
+        flush_size: int = 10000,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 100000,
+    ) -> None:
+        super().__init__(
+            flush_size=flush_size,
+            flush_interval=flush_interval,
+            max_queue_size=max_queue_size,
+        )
+        self.db_path = db_path
+        self.table = table
+        self.columns: Optional[List[str]] = list(columns) if columns else None
+        self.key_columns: List[str] = list(key_columns) if key_columns else []
+        self.column_types = optional_object(column_types, dict)
+        self.codec = optional_object(codec, get_json_codec)
+        self.rows_written = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._connection: Optional[sqlite3.Connection] = None
+        self._insert_sql: Optional[str] = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"db_path={self.db_path!r}, table={self.table!r}, "
+            f"columns={self.columns!r}, key_columns={self.key_columns!r}, "
+            f"rows_written={self.rows_written!r}, "
+            f"records_written={self.records_written!r}, "
+            f"batches_written={self.batches_written!r}, closed={self.closed!r}"
+            ")"
+        )
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def open_sink(self):
+        # sqlite3 connections belong to the thread that made them.
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"{self.__class__.__name__}"
+        )
+        await self._run(self._connect)
+
+    async def write_batch(self, batch: List[Any]):
+        rows = rows_from_records(batch)
+        if rows:
+            await self._run(self.insert_rows, rows)
+
+    async def close_sink(self):
+        if self._executor is not None:
+            await self._run(self._disconnect)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _connect(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(self.db_path))
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+    def _disconnect(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def create_table_sql(self) -> str:
+        assert self.columns is not None
+        column_defs = [
+            f"{quote_identifier(column)} {self.column_types.get(column, '')}".strip()
+            for column in self.columns
+        ]
+        if self.key_columns:
+            keys = ", ".join(quote_identifier(column) for column in self.key_columns)
+            column_defs.append(f"PRIMARY KEY ({keys})")
+        return (
+            f"CREATE TABLE IF NOT EXISTS {quote_identifier(self.table)} "
+            f"({', '.join(column_defs)})"
+        )
+
+    def insert_sql(self) -> str:
+        assert self.columns is not None
+        names = ", ".join(quote_identifier(column) for column in self.columns)
+        placeholders = ", ".join("?" for _ in self.columns)
+        sql = (
+            f"INSERT INTO {quote_identifier(self.table)} ({names}) "
+            f"VALUES ({placeholders})"
+        )
+        if self.key_columns:
+            keys = ", ".join(quote_identifier(column) for column in self.key_columns)
+            updates = ", ".join(
+                f"{quote_identifier(column)}=excluded.{quote_identifier(column)}"
+                for column in self.columns
+                if column not in self.key_columns
+            )
+            if updates:
+                sql += f" ON CONFLICT ({keys}) DO UPDATE SET {updates}"
+            else:
+                sql += f" ON CONFLICT ({keys}) DO NOTHING"
+        return sql
+
+    def _value(self, value: Any) -> Any:
+        if isinstance(value, (dict, list)):
+            return self.codec.dumps(value).decode("utf-8")
+        return value
+
+    def insert_rows(self, rows: List[Dict]):
+        """Insert rows in one transaction. Blocking, runs on the database thread."""
+        assert self._connection is not None
+        if self._insert_sql is None:
+            if self.columns is None:
+                self.columns = list(rows[0].keys())
+            self._connection.execute(self.create_table_sql())
+            self._insert_sql = self.insert_sql()
+        columns = self.columns
+        assert columns is not None
+        values = (
+            tuple(self._value(row.get(column)) for column in columns) for row in rows
+        )
+        with self._connection:
+            self._connection.executemany(self._insert_sql, values)
+        self.rows_written += len(rows)
+
+
+class SinkItemHandler(JsonArrayItemHandler):
+    """Put each item of a streamed JSON array into a sink."""
+
+    def __init__(self, sink: AsyncSink) -> None:
+        super().__init__()
+        self.sink = sink
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(" f"sink={self.sink!r}" ")"
+
+    async def handle_item(self, caller: "AiohttpAction", item: Any):
+        _ = caller
+        await self.sink.put(item)
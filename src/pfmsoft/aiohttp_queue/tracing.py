@@ -0,0 +1,142 @@
+"""Per request phase timings, recorded with an aiohttp TraceConfig.
+
+Each attempt at an action gets a :class:`PhaseTimings` in `action.timings`.
+The action records when it started and when its callbacks ran, and, when the
+session has the :func:`phase_trace_config` installed, the trace records the DNS
+lookup, connection, and response timestamps. Runners install it when called
+with `trace=True`.
+
+The phases, in seconds, from :meth:`PhaseTimings.phases`:
+
+- queue_wait, from being put on the queue to the attempt starting.
+- connection_queue, waiting for a free connection in the pool.
+- dns, resolving the host name, when not cached.
+- connect, making a new connection, including the TLS handshake for https.
+  aiohttp does not signal the end of the TCP connect separately.
+- ttfb, from sending the request headers to receiving the response headers.
+- body, reading the response body, when it was read with `response.read()`.
+- callbacks, running the callbacks, less the body read.
+- total, from the attempt starting to the callbacks finishing.
+
+Phases that did not happen, eg. dns and connect for a reused connection, are
+left out.
+"""
+import logging
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+from aiohttp import ClientSession, TraceConfig
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class PhaseTimings:
+    """perf_counter timestamps for one attempt at an action."""
+
+    __slots__ = (
+        "enqueued",
+        "started",
+        "dns_start",
+        "dns_end",
+        "queued_start",
+        "queued_end",
+        "connect_start",
+        "connect_end",
+        "headers_sent",
+        "response_start",
+        "body_end",
+        "callbacks_start",
+        "callbacks_end",
+    )
+
+    def __init__(self, enqueued: Optional[float] = None) -> None:
+        self.enqueued = enqueued
+        self.started = perf_counter()
+        self.dns_start: Optional[float] = None
+        self.dns_end: Optional[float] = None
+        self.queued_start: Optional[float] = None
+        self.queued_end: Optional[float] = None
+        self.connect_start: Optional[float] = None
+        self.connect_end: Optional[float] = None
+        self.headers_sent: Optional[float] = None
+        self.response_start: Optional[float] = None
+        self.body_end: Optional[float] = None
+        self.callbacks_start: Optional[float] = None
+        self.callbacks_end: Optional[float] = None
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(" f"phases={self.phases()!r}" ")"
+
+    def phases(self) -> Dict[str, float]:
+        """The duration of each phase that happened, in seconds."""
+        phases: Dict[str, float] = {}
+        if self.enqueued is not None:
+            phases["queue_wait"] = self.started - self.enqueued
+        if self.queued_start is not None and self.queued_end is not None:
+            phases["connection_queue"] = self.queued_end - self.queued_start
+        if self.dns_start is not None and self.dns_end is not None:
+            phases["dns"] = self.dns_end - self.dns_start
+        if self.connect_start is not None and self.connect_end is not None:
+            phases["connect"] = self.connect_end - self.connect_start
+        if self.response_start is not None:
+            request_sent = self.headers_sent or self.connect_end or self.started
+            phases["ttfb"] = self.response_start - request_sent
+        body = 0.0
+        if self.response_start is not None and self.body_end is not None:
+            body = self.body_end - self.response_start
+            phases["body"] = body
+        if self.callbacks_start is not None and self.callbacks_end is not None:
+            phases["callbacks"] = max(
+                0.0, self.callbacks_end - self.callbacks_start - body
+            )
+            phases["total"] = self.callbacks_end - self.started
+        return phases
+
+
+def _timings(trace_config_ctx: SimpleNamespace) -> Optional[PhaseTimings]:
+    timings = trace_config_ctx.trace_request_ctx
+    if isinstance(timings, PhaseTimings):
+        return timings
+    return None
+
+
+def _recorder(slot: str, first: bool = True):
+    """A trace signal handler that records the time in a PhaseTimings slot."""
+
+    async def record(session: ClientSession, trace_config_ctx: SimpleNamespace, params):
+        _, _ = session, params
+        timings = _timings(trace_config_ctx)
+        if timings is not None and (not first or getattr(timings, slot) is None):
+            setattr(timings, slot, perf_counter())
+
+    return record
+
+
+def phase_trace_config() -> TraceConfig:
+    """A TraceConfig that records into the PhaseTimings passed as trace_request_ctx.
+
+    Requests without a PhaseTimings are ignored.
+    """
+    trace_config = TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(_recorder("dns_start"))
+    trace_config.on_dns_resolvehost_end.append(_recorder("dns_end"))
+    trace_config.on_connection_queued_start.append(_recorder("queued_start"))
+    trace_config.on_connection_queued_end.append(_recorder("queued_end"))
+    trace_config.on_connection_create_start.append(_recorder("connect_start"))
+    trace_config.on_connection_create_end.append(_recorder("connect_end"))
+    # Redirects send the headers again, keep the last ones.
+    trace_config.on_request_headers_sent.append(_recorder("headers_sent", False))
+    trace_config.on_request_end.append(_recorder("response_start", False))
+    trace_config.on_response_chunk_received.append(_recorder("body_end", False))
+    return trace_config
+
+
+def with_phase_tracing(session_kwargs: Optional[Dict]) -> Dict:
+    """A copy of session_kwargs, with the phase trace config added."""
+    session_kwargs = dict(session_kwargs) if session_kwargs is not None else {}
+    trace_configs = list(session_kwargs.get("trace_configs") or [])
+    trace_configs.append(phase_trace_config())
+    session_kwargs["trace_configs"] = trace_configs
+    return session_kwargs
@@ -0,0 +1,99 @@
+"""Shrink results to the fields that are needed, as soon as they are decoded.
+
+A :class:`Projection` filters rows, adds computed fields, keeps a subset of
+fields, and renames them. Pass one to ResponseContentToJson or
+StreamJsonArrayToHandlers to apply it while decoding, so the full objects are
+never kept, or use the ProjectResult callback on an existing result.
+
+.. code:: python
+
+    projection = Projection(
+        fields=["type_id", "price"],
+        renames={"type_id": "item"},
+        filters=[lambda row: row["is_buy_order"]],
+        computed={"total": lambda row: row["price"] * row["volume_remain"]},
+    )
+    callbacks = ActionCallbacks(
+        success=[
+            ResponseContentToJson(projection=projection),
+            SaveListOfDictResultToCSVFile(file_path),
+        ]
+    )
+
+Filters and computed fields see the whole original row. Use module level
+functions instead of lambdas if the projection runs in a process pool.
+"""
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from pfmsoft.aiohttp_queue.utilities import optional_object
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class Projection:
+    """Filter, compute, project and rename the fields of dict rows.
+
+    Args:
+        fields: The fields to keep, in order. None keeps all the fields. Missing
+            fields are None.
+        renames: New names for kept fields, {old_name: new_name}.
+        filters: Rows are kept only if every filter returns True.
+        computed: Fields to add, {name: function(row)}, added after the kept
+            fields.
+    """
+
+    def __init__(
+        self,
+        fields: Optional[Sequence[str]] = None,
+        renames: Optional[Dict[str, str]] = None,
+        filters: Optional[Sequence[Callable[[Dict], bool]]] = None,
+        computed: Optional[Dict[str, Callable[[Dict], Any]]] = None,
+    ) -> None:
+        self.fields = list(fields) if fields is not None else None
+        self.renames = optional_object(renames, dict)
+        self.filters = list(optional_object(filters, list))
+        self.computed = optional_object(computed, dict)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"fields={self.fields!r}, renames={self.renames!r}, "
+            f"filters={self.filters!r}, computed={self.computed!r}"
+            ")"
+        )
+
+    def keep(self, row: Dict) -> bool:
+        for row_filter in self.filters:
+            if not row_filter(row):
+                return False
+        return True
+
+    def project(self, row: Dict) -> Dict:
+        """Project a row, without filtering it."""
+        renames = self.renames
+        if self.fields is None:
+            result = {renames.get(key, key): value for key, value in row.items()}
+        else:
+            result = {renames.get(key, key): row.get(key) for key in self.fields}
+        for name, function in self.computed.items():
+            result[name] = function(row)
+        return result
+
+    def apply(self, row: Dict) -> Optional[Dict]:
+        """The projected row, or None if it is filtered out."""
+        if self.filters and not self.keep(row):
+            return None
+        return self.project(row)
+
+    def apply_many(self, rows: Iterable[Dict]) -> List[Dict]:
+        return [self.project(row) for row in rows if self.keep(row)]
+
+    def apply_result(self, data: Any) -> Any:
+        """Apply to a list of rows, or a single row. A filtered row gives None."""
+        if isinstance(data, list):
+            return self.apply_many(data)
+        if isinstance(data, dict):
+            return self.apply(data)
+        return data
@@ -0,0 +1,99 @@
+import json
+from pathlib import Path
+
+import pytest
+import yaml
+from click.testing import CliRunner
+
+from pfmsoft.aiohttp_queue.cli import Job, JobFileError, iter_job_items, main
+
+
+def write_jsonl(path: Path, items):
+    path.write_text("".join(json.dumps(item) + "\n" for item in items))
+    return path
+
+
+def read_jsonl(path: Path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_job_file_formats(test_app_data_dir: Path):
+    items = [{"job": {"workers": 3}}, {"url": "http://a.test/1"}, {"url": "b"}]
+    jsonl = write_jsonl(test_app_data_dir / "formats.jsonl", items)
+    as_json = test_app_data_dir / "formats.json"
+    as_json.write_text(json.dumps(items, indent=2))
+    as_yaml = test_app_data_dir / "formats.yaml"
+    as_yaml.write_text(yaml.safe_dump(items[0]) + "---\n" + yaml.safe_dump(items[1:]))
+    for path in (jsonl, as_json, as_yaml):
+        assert list(iter_job_items(path)) == items
+        job = Job(path, {"workers": None, "max_queued": 5})
+        assert job.settings["workers"] == 3
+        assert job.settings["max_queued"] == 5
+        assert [action.aiohttp_args.url for action in job.actions()] == [
+            "http://a.test/1",
+            "b",
+        ]
+
+
+def test_job_errors(test_app_data_dir: Path):
+    with pytest.raises(JobFileError):
+        Job(test_app_data_dir / "job.txt")
+    bad_line = test_app_data_dir / "bad_line.jsonl"
+    bad_line.write_text('{"url": "a"}\n{"url": \n')
+    with pytest.raises(JobFileError, match="line 2"):
+        list(Job(bad_line).actions())
+    bad_callback = write_jsonl(
+        test_app_data_dir / "bad_callback.jsonl", [{"url": "a", "callbacks": ["nope"]}]
+    )
+    with pytest.raises(JobFileError, match="Unknown callback"):
+        list(Job(bad_callback).actions())
+
+
+def test_run_job(local_server, test_app_data_dir: Path):
+    base_url = local_server.base_url
+    job_file = write_jsonl(
+        test_app_data_dir / "run.jsonl",
+        [
+            {
+                "job": {
+                    "max_queued": 4,
+                    "defaults": {"params": {"source": "job"}},
+                    "callbacks": ["json", {"name": "sink", "explode": False}],
+                }
+            },
+        ]
+        + [{"url": f"{base_url}/get", "params": {"n": str(n)}} for n in range(20)]
+        + [{"url": f"{base_url}/status/404"}],
+    )
+    output = test_app_data_dir / "run_results.jsonl"
+    result = CliRunner().invoke(
+        main,
+        [
+            "run",
+            str(job_file),
+            "--workers",
+            "4",
+            "--limit-per-host",
+            "2",
+            "--output",
+            str(output),
+            "--no-progress",
+            "--json",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    summary = json.loads(result.output)
+    assert summary["actions"] == 21
+    assert summary["workers"] == 4
+    assert summary["succeeded"] == 20
+    assert summary["failed"] == 1
+    records = read_jsonl(output)
+    assert sorted(int(record["args"]["n"]) for record in records) == list(range(20))
+    assert all(record["args"]["source"] == "job" for record in records)
+
+
+def test_run_job_error(test_app_data_dir: Path):
+    job_file = write_jsonl(test_app_data_dir / "no_url.jsonl", [{"method": "get"}])
+    result = CliRunner().invoke(main, ["run", str(job_file), "--no-progress"])
+    assert result.exit_code == 1
+    assert "needs a url" in result.output
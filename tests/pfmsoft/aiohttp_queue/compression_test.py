@@ -0,0 +1,131 @@
+import csv
+import gzip
+import io
+import json
+from pathlib import Path
+
+import pytest
+import yaml
+from tests.pfmsoft.aiohttp_queue.local_server import array_item
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.compression import (
+    accept_encoding,
+    available_content_encodings,
+)
+from pfmsoft.aiohttp_queue.runners import do_single_action_runner
+
+
+def list_action(base_url: str, count: int, *callbacks) -> AiohttpAction:
+    return AiohttpAction(
+        aiohttp_args=AiohttpRequest(
+            method="get", url=f"{base_url}/list-of-dicts/{count}"
+        ),
+        callbacks=ActionCallbacks(success=[AC.ResponseContentToJson(), *callbacks]),
+    )
+
+
+def test_json_gz_from_suffix(local_server, test_app_data_dir):
+    file_path: Path = test_app_data_dir / Path("compressed/auto.json.gz")
+    callback = AC.SaveResultToJsonFile(file_path=file_path)
+    action = list_action(local_server.base_url, 50, callback)
+    do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    assert callback.file_path == file_path
+    with gzip.open(file_path) as file:
+        assert json.load(file) == action.response_data
+
+
+def test_explicit_compression_adds_suffix(local_server, test_app_data_dir):
+    callback = AC.SaveResultToYamlFile(
+        file_path=test_app_data_dir / Path("compressed/explicit"),
+        compression="gzip",
+        compression_level=9,
+    )
+    action = list_action(local_server.base_url, 5, callback)
+    do_single_action_runner(action)
+    assert callback.file_path == test_app_data_dir / Path("compressed/explicit.yaml.gz")
+    with gzip.open(callback.file_path, "rt") as file:
+        assert yaml.safe_load(file) == action.response_data
+
+
+def test_csv_gz(local_server, test_app_data_dir):
+    count = 2500
+    callback = AC.SaveListOfDictResultToCSVFile(
+        file_path_template=str(test_app_data_dir / "compressed" / "${name}.csv.gz"),
+        path_values={"name": "rows"},
+        field_names=["id", "name"],
+        rows_per_write=100,
+    )
+    action = list_action(local_server.base_url, count, callback)
+    # DictWriter raises on fields that are not in field_names.
+    action.callbacks.success.insert(1, DropFields(["id", "name"]))
+    do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    assert callback.file_path.name == "rows.csv.gz"
+    with gzip.open(callback.file_path, "rt", newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert len(rows) == count
+    assert rows[7]["name"] == array_item(7)["name"]
+
+
+def test_uncompressed_by_default(local_server, test_app_data_dir):
+    file_path: Path = test_app_data_dir / Path("compressed/plain.json")
+    callback = AC.SaveResultToJsonFile(file_path=file_path)
+    action = list_action(local_server.base_url, 3, callback)
+    do_single_action_runner(action)
+    assert json.loads(file_path.read_text()) == action.response_data
+
+
+def test_zstd(local_server, test_app_data_dir):
+    zstandard = pytest.importorskip("zstandard")
+    file_path: Path = test_app_data_dir / Path("compressed/data.json.zst")
+    action = list_action(
+        local_server.base_url, 10, AC.SaveResultToJsonFile(file_path=file_path)
+    )
+    do_single_action_runner(action)
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        io.BytesIO(file_path.read_bytes())
+    )
+    assert json.loads(reader.read()) == action.response_data
+
+
+def test_bad_compression():
+    with pytest.raises(ValueError):
+        AC.SaveResultToTxtFile(file_path=Path("x.txt"), compression="lzma")
+
+
+def test_accept_encoding(local_server):
+    header = accept_encoding()
+    assert "gzip" in header
+    assert ("br" in header) == available_content_encodings()["br"]
+    action = AiohttpAction(
+        aiohttp_args=AiohttpRequest(
+            method="get",
+            url=f"{local_server.base_url}/gzip",
+            headers={"Accept-Encoding": header},
+        ),
+        callbacks=ActionCallbacks(success=[AC.ResponseContentToJson()]),
+    )
+    do_single_action_runner(action)
+    assert action.response.headers["Content-Encoding"] == "gzip"
+    assert action.response_data["accept_encoding"] == header
+    assert action.response_data["gzipped"] is True
+
+
+class DropFields(AC.AiohttpActionCallback):
+    def __init__(self, keep):
+        super().__init__()
+        self.keep = keep
+
+    async def do_callback(self, caller):
+        caller.response_data = [
+            {key: item[key] for key in self.keep} for item in caller.response_data
+        ]
+        self.success(caller)
@@ -0,0 +1,81 @@
+import asyncio
+from time import perf_counter
+from typing import List
+
+import pytest
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    AiohttpAction,
+    AiohttpActionCallback,
+    AiohttpRequest,
+)
+
+
+class SleepCallback(AiohttpActionCallback):
+    def __init__(self, name: str, log: List[str], delay: float = 0.1) -> None:
+        super().__init__()
+        self.name = name
+        self.log = log
+        self.delay = delay
+
+    async def do_callback(self, caller: AiohttpAction):
+        self.log.append(f"start {self.name}")
+        await asyncio.sleep(self.delay)
+        self.log.append(f"end {self.name}")
+        self.success(caller)
+
+
+def make_action(callbacks: List[AiohttpActionCallback], concurrent: bool):
+    return AiohttpAction(
+        aiohttp_args=AiohttpRequest(method="get", url="http://localhost"),
+        callbacks=ActionCallbacks(success=callbacks, concurrent=concurrent),
+    )
+
+
+def run_success(action: AiohttpAction) -> float:
+    start = perf_counter()
+    asyncio.run(action.run_callbacks(action.callbacks.success, "success"))
+    return perf_counter() - start
+
+
+def test_sequential_by_default():
+    log: List[str] = []
+    action = make_action(
+        [SleepCallback("a", log, 0.01), SleepCallback("b", log, 0.01)], False
+    )
+    run_success(action)
+    assert log == ["start a", "end a", "start b", "end b"]
+
+
+def test_concurrent_with_dependency():
+    log: List[str] = []
+    parse = SleepCallback("parse", log)
+    saves = [SleepCallback(name, log).after(parse) for name in ("json", "yaml", "csv")]
+    action = make_action([parse, *saves], True)
+    elapsed = run_success(action)
+    assert log[:2] == ["start parse", "end parse"]
+    assert sorted(log[2:5]) == ["start csv", "start json", "start yaml"]
+    assert elapsed < 0.35
+
+
+def test_dependency_must_come_first():
+    log: List[str] = []
+    parse = SleepCallback("parse", log)
+    save = SleepCallback("save", log).after(parse)
+    with pytest.raises(ValueError):
+        run_success(make_action([save, parse], True))
+    assert not log
+
+
+def test_failed_dependency_stops_dependents():
+    class FailCallback(AiohttpActionCallback):
+        async def do_callback(self, caller: AiohttpAction):
+            raise RuntimeError("parse failed")
+
+    log: List[str] = []
+    parse = FailCallback()
+    save = SleepCallback("save", log).after(parse)
+    with pytest.raises(RuntimeError):
+        run_success(make_action([parse, save], True))
+    assert not log
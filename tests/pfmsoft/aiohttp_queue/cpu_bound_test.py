@@ -0,0 +1,95 @@
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import yaml
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.json_codec import available_codecs, get_json_codec
+from pfmsoft.aiohttp_queue.runners import do_single_action_runner
+
+
+def test_codecs_pickle_by_name():
+    for name in available_codecs():
+        codec = get_json_codec(name)
+        assert pickle.loads(pickle.dumps(codec)) is codec
+
+
+def test_process_pool_callbacks(local_server, test_app_data_dir):
+    file_path: Path = test_app_data_dir / Path("cpu_bound/list.yaml")
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        action = AiohttpAction(
+            aiohttp_args=AiohttpRequest(
+                method="get", url=f"{local_server.base_url}/list-of-dicts/50"
+            ),
+            callbacks=ActionCallbacks(
+                success=[
+                    AC.ResponseContentToJson(executor=executor),
+                    AC.SaveResultToYamlFile(file_path=file_path, executor=executor),
+                ]
+            ),
+        )
+        do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    with open(file_path) as file:
+        assert yaml.safe_load(file) == action.response_data
+    assert len(action.response_data) == 50
+
+
+def test_thread_pool_json_file(local_server, test_app_data_dir):
+    file_path: Path = test_app_data_dir / Path("cpu_bound/list.json")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        callback = AC.SaveResultToJsonFile(
+            file_path=file_path, indent=None, executor=executor
+        )
+        action = AiohttpAction(
+            aiohttp_args=AiohttpRequest(
+                method="get", url=f"{local_server.base_url}/list-of-dicts/10"
+            ),
+            callbacks=ActionCallbacks(success=[AC.ResponseContentToJson(), callback]),
+        )
+        do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    assert file_path.read_bytes() == get_json_codec().dumps(action.response_data)
+
+
+class SaveOverriddenJson(AC.SaveResultToJsonFile):
+    def get_data(self, caller: AiohttpAction):
+        return {"overridden": True, "count": len(caller.response_data)}
+
+
+class SaveOverriddenYaml(AC.SaveResultToYamlFile):
+    def get_data(self, caller: AiohttpAction):
+        return {"overridden": True}
+
+
+def test_get_data_override_is_serialized(local_server, test_app_data_dir):
+    output_dir = test_app_data_dir / Path("cpu_bound/overridden")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        callbacks = [
+            SaveOverriddenJson(file_path=output_dir / "inline.json"),
+            SaveOverriddenJson(file_path=output_dir / "pool.json", executor=executor),
+            SaveOverriddenYaml(file_path=output_dir / "inline.yaml"),
+        ]
+        action = AiohttpAction(
+            aiohttp_args=AiohttpRequest(
+                method="get", url=f"{local_server.base_url}/list-of-dicts/3"
+            ),
+            callbacks=ActionCallbacks(success=[AC.ResponseContentToJson(), *callbacks]),
+        )
+        do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    for name in ("inline.json", "pool.json"):
+        assert get_json_codec().loads((output_dir / name).read_bytes()) == {
+            "overridden": True,
+            "count": 3,
+        }
+    assert yaml.safe_load((output_dir / "inline.yaml").read_text()) == {
+        "overridden": True
+    }
@@ -0,0 +1,80 @@
+import asyncio
+import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.aiohttp import CallbackState
+from pfmsoft.aiohttp_queue.profiling import LoopLagMonitor
+from pfmsoft.aiohttp_queue.runners import do_single_action_runner
+
+
+def test_csv_in_executor(local_server, test_app_data_dir):
+    file_path: Path = test_app_data_dir / Path("csv_sink/rows.csv")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        callback = AC.SaveListOfDictResultToCSVFile(
+            file_path=file_path,
+            additional_fields={"source": "local"},
+            rows_per_write=7,
+            executor=executor,
+        )
+        action = AiohttpAction(
+            aiohttp_args=AiohttpRequest(
+                method="get", url=f"{local_server.base_url}/list-of-dicts/100"
+            ),
+            callbacks=ActionCallbacks(success=[AC.ResponseContentToJson(), callback]),
+        )
+        do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    with open(file_path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert len(rows) == 100
+    assert rows[42]["id"] == "42"
+    assert rows[42]["source"] == "local"
+    assert callback.field_names[-1] == "source"
+
+
+def test_csv_does_not_block_loop(tmp_path):
+    rows = [{"a": index, "b": "x" * 20, "c": index * 0.5} for index in range(50000)]
+    action = AiohttpAction(AiohttpRequest(method="get", url="http://localhost"))
+    action.response_data = rows
+    callback = AC.SaveListOfDictResultToCSVFile(file_path=tmp_path / "rows.csv")
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.001)
+            ticks += 1
+
+    async def run():
+        tick_task = asyncio.create_task(ticker())
+        await callback.do_callback(action)
+        tick_task.cancel()
+
+    asyncio.run(run())
+    assert callback.state == CallbackState.SUCCESS
+    # The loop kept running while the rows were written.
+    assert ticks > 1
+
+
+def test_loop_lag_monitor():
+    async def run():
+        async with LoopLagMonitor(interval=0.005) as monitor:
+            await asyncio.sleep(0.02)
+            time.sleep(0.1)
+            await asyncio.sleep(0.02)
+        return monitor
+
+    monitor = asyncio.run(run())
+    summary = monitor.summary()
+    assert summary["samples"] >= 2
+    assert summary["max"] >= 0.09
+    assert summary["p50"] < summary["max"]
@@ -0,0 +1,112 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.durability import (
+    DurabilityPolicy,
+    FsyncDurability,
+    GroupCommitDurability,
+    commit_files,
+)
+from pfmsoft.aiohttp_queue.runners import do_queue_runner, do_single_action_runner
+
+
+def json_action(base_url: str, callback: AC.SaveResultToTxtFile) -> AiohttpAction:
+    return AiohttpAction(
+        aiohttp_args=AiohttpRequest(method="get", url=f"{base_url}/get"),
+        callbacks=ActionCallbacks(success=[AC.ResponseContentToJson(), callback]),
+    )
+
+
+def test_write_path(tmp_path):
+    policy = DurabilityPolicy()
+    file_path = tmp_path / "result.json"
+    write_path = policy.write_path(file_path, "w")
+    assert write_path.parent == tmp_path
+    assert write_path != file_path
+    assert policy.write_path(file_path, "a") == file_path
+    assert policy.write_path(file_path, "x") == file_path
+    assert policy.write_path(file_path, "r+") == file_path
+    assert DurabilityPolicy(atomic=False).write_path(file_path, "w") == file_path
+    write_path.write_text("partial")
+    policy.discard(write_path, file_path)
+    assert not write_path.exists()
+    policy.discard(write_path, file_path)
+
+
+def test_commit_files(tmp_path):
+    paths = []
+    for index in range(3):
+        write_path = tmp_path / f".{index}.tmp"
+        write_path.write_text(str(index))
+        paths.append((write_path, tmp_path / f"{index}.txt"))
+    commit_files(paths)
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "0.txt",
+        "1.txt",
+        "2.txt",
+    ]
+
+
+def test_atomic_write(local_server, test_app_data_dir):
+    output_dir = test_app_data_dir / Path("durability/atomic")
+    callback = AC.SaveResultToJsonFile(
+        file_path=output_dir / "result.json", durability=FsyncDurability()
+    )
+    action = json_action(local_server.base_url, callback)
+    do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    assert [path.name for path in output_dir.iterdir()] == ["result.json"]
+    assert json.loads((output_dir / "result.json").read_text())["args"] == {}
+
+
+def test_group_commit(local_server, test_app_data_dir):
+    output_dir = test_app_data_dir / Path("durability/group")
+    durability = GroupCommitDurability(interval=0.05)
+    actions = [
+        json_action(
+            local_server.base_url,
+            AC.SaveResultToJsonFile(
+                file_path=output_dir / f"{index}.json", durability=durability
+            ),
+        )
+        for index in range(20)
+    ]
+    do_queue_runner(
+        actions, [AiohttpQueueWorker() for _ in range(5)], sinks=[durability]
+    )
+    for action in actions:
+        assert action.state == ActionState.SUCCESS
+    assert durability.closed
+    assert durability.records_written == 20
+    assert durability.batches_written < 20
+    assert len(list(output_dir.glob("*.json"))) == 20
+    assert not list(output_dir.glob(".*"))
+
+
+def test_exclusive_create_keeps_existing_file(local_server, test_app_data_dir):
+    file_path = test_app_data_dir / Path("durability/exclusive/result.txt")
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_text("original")
+    action = AiohttpAction(
+        aiohttp_args=AiohttpRequest(method="get", url=f"{local_server.base_url}/get"),
+        callbacks=ActionCallbacks(
+            success=[
+                AC.ResponseContentToText(),
+                AC.SaveResultToTxtFile(file_path=file_path, mode="x"),
+            ]
+        ),
+    )
+    with pytest.raises(FileExistsError):
+        do_single_action_runner(action)
+    assert file_path.read_text() == "original"
+    assert [path.name for path in file_path.parent.iterdir()] == ["result.txt"]
@@ -0,0 +1,87 @@
+import json
+from pathlib import Path
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    AiohttpAction,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue.callbacks import ResponseContentToJson
+from pfmsoft.aiohttp_queue.events import (
+    ActionEvent,
+    EventBus,
+    EventKind,
+    EventRingBuffer,
+    SinkSubscriber,
+)
+from pfmsoft.aiohttp_queue.runners import do_queue_runner
+from pfmsoft.aiohttp_queue.sinks import JsonLinesSink
+
+
+def make_event(number: int) -> ActionEvent:
+    action = AiohttpAction(AiohttpRequest(method="get", url="http://example.com"))
+    return ActionEvent(EventKind.START, 0.0, action.uid, "", str(number), 1)
+
+
+def test_ring_buffer():
+    ring = EventRingBuffer(capacity=3)
+    for number in range(2):
+        ring.handle(make_event(number))
+    assert [event.id_ for event in ring.drain()] == ["0", "1"]
+    for number in range(2, 7):
+        ring.handle(make_event(number))
+    assert len(ring) == 3
+    assert [event.id_ for event in ring.events()] == ["4", "5", "6"]
+    assert [event.id_ for event in ring.drain()] == ["4", "5", "6"]
+    assert ring.dropped == 2
+    assert ring.drain() == []
+
+
+def test_no_subscribers():
+    events = EventBus()
+    action = AiohttpAction(
+        AiohttpRequest(method="get", url="http://example.com"), events=events
+    )
+    action.emit(EventKind.START)
+    assert events.events_emitted == 0
+
+
+def test_queue_runner_events(local_server, test_app_data_dir: Path):
+    events = EventBus()
+    ring = events.subscribe(EventRingBuffer())
+    file_path = test_app_data_dir / "events" / "events.jsonl"
+    sink = JsonLinesSink(file_path)
+    events.subscribe(SinkSubscriber(sink, to_dict=True, kinds=[EventKind.RETRY]))
+    ok_action = AiohttpAction(
+        AiohttpRequest(method="get", url=f"{local_server.base_url}/get"),
+        callbacks=ActionCallbacks(success=[ResponseContentToJson()]),
+        events=events,
+    )
+    retry_action = AiohttpAction(
+        AiohttpRequest(method="get", url=f"{local_server.base_url}/status/503"),
+        max_attempts=2,
+        events=events,
+    )
+    do_queue_runner([ok_action, retry_action], [AiohttpQueueWorker()], sinks=[sink])
+    ok_kinds = [event.kind for event in ring.events() if event.uid == ok_action.uid]
+    assert ok_kinds == [
+        EventKind.ENQUEUE,
+        EventKind.START,
+        EventKind.RESPONSE,
+        EventKind.SUCCESS,
+        EventKind.CALLBACK_START,
+        EventKind.CALLBACK_END,
+        EventKind.FINISH,
+    ]
+    callback_end = ring.events()[5]
+    assert callback_end.source == "ResponseContentToJson"
+    assert callback_end.detail == "success"
+    retry_kinds = [
+        event.kind for event in ring.events() if event.uid == retry_action.uid
+    ]
+    assert retry_kinds.count(EventKind.RETRY) == 2
+    assert retry_kinds[-2:] == [EventKind.FAIL, EventKind.FINISH]
+    lines = file_path.read_text().splitlines()
+    assert [json.loads(line)["kind"] for line in lines] == ["retry", "retry"]
+    assert json.loads(lines[0])["status"] == 503
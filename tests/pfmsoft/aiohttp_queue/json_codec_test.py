@@ -0,0 +1,79 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.json_codec import (
+    JsonCodec,
+    available_codecs,
+    get_json_codec,
+)
+from pfmsoft.aiohttp_queue.runners import do_single_action_runner
+
+SAMPLE = {
+    "args": {"type_id": "34", "name": "Tritanium é"},
+    "items": [{"id": i, "price": i * 1.5, "ok": i % 2 == 0} for i in range(5)],
+    "empty": None,
+}
+
+
+@pytest.mark.parametrize("codec_name", available_codecs())
+def test_codec_round_trip(codec_name):
+    codec = get_json_codec(codec_name)
+    for indent in (None, 2, 4):
+        encoded = codec.dumps(SAMPLE, indent=indent)
+        assert isinstance(encoded, bytes)
+        assert codec.loads(encoded) == SAMPLE
+        assert codec.loads(encoded.decode("utf-8")) == SAMPLE
+    assert b"\n" not in codec.dumps(SAMPLE)
+    assert b"\n" in codec.dumps(SAMPLE, indent=2)
+
+
+def test_get_json_codec():
+    assert get_json_codec().name == available_codecs()[0]
+    assert isinstance(get_json_codec("json"), JsonCodec)
+    assert get_json_codec("json") is get_json_codec("json")
+    with pytest.raises(ValueError):
+        get_json_codec("not_a_codec")
+
+
+def test_orjson_falls_back_to_json():
+    pytest.importorskip("orjson")
+    codec = get_json_codec("orjson")
+    big = {"id": 2**70, "items": [-(2**65)]}
+    for indent in (None, 2):
+        assert codec.dumps(big, indent=indent) == get_json_codec("json").dumps(
+            big, indent=indent
+        )
+    assert json.loads(codec.dumps(big)) == big
+
+
+@pytest.mark.parametrize("codec_name", available_codecs())
+def test_json_callbacks_with_codec(codec_name, local_server, test_app_data_dir):
+    codec = get_json_codec(codec_name)
+    file_path: Path = test_app_data_dir / Path(f"codec_{codec_name}.json")
+    params = {"arg1": "argument 1"}
+    action = AiohttpAction(
+        aiohttp_args=AiohttpRequest(
+            method="get", url=f"{local_server.base_url}/get", params=params
+        ),
+        callbacks=ActionCallbacks(
+            success=[
+                AC.ResponseContentToJson(codec=codec),
+                AC.SaveResultToJsonFile(file_path=file_path, codec=codec, indent=None),
+            ]
+        ),
+    )
+    do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    assert action.response_data["args"] == params
+    text = file_path.read_text()
+    assert "\n" not in text
+    assert json.loads(text) == action.response_data
@@ -0,0 +1,99 @@
+import json
+from typing import Any, List
+
+import pytest
+from tests.pfmsoft.aiohttp_queue.local_server import array_item
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.json_stream import (
+    CollectJsonArrayItems,
+    JsonArrayItemHandler,
+    JsonArrayScanner,
+)
+from pfmsoft.aiohttp_queue.runners import do_single_action_runner
+
+ARRAY = [
+    {"a": "x]}", "b": [1, 2, {"c": "\\"}]},
+    'string with " quote, and comma',
+    12.5e3,
+    -1,
+    True,
+    None,
+    [],
+    {},
+    [[["deep"]]],
+]
+
+
+def scan(chunks: List[bytes]) -> List[Any]:
+    scanner = JsonArrayScanner()
+    items = []
+    for chunk in chunks:
+        items.extend(json.loads(raw) for raw in scanner.feed(chunk))
+    scanner.close()
+    return items
+
+
+def test_scanner_every_split():
+    body = json.dumps(ARRAY, indent=1).encode()
+    assert scan([body]) == ARRAY
+    for split in range(len(body)):
+        assert scan([body[:split], body[split:]]) == ARRAY
+
+
+def test_scanner_single_bytes():
+    body = b'  \n[1, "\\\\", {"x": [2]}]  \n'
+    chunks = [body[idx : idx + 1] for idx in range(len(body))]
+    assert scan(chunks) == [1, "\\", {"x": [2]}]
+
+
+def test_scanner_empty_array():
+    assert scan([b"[", b" ", b"]"]) == []
+
+
+@pytest.mark.parametrize(
+    "body", [b'{"a": 1}', b"[1, 2", b"[1,,2]", b"[1,]", b"[1] 2", b"[1}]"]
+)
+def test_scanner_bad_arrays(body):
+    with pytest.raises(ValueError):
+        scan([body])
+
+
+class CountingHandler(JsonArrayItemHandler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.count = 0
+        self.finished = False
+
+    async def handle_item(self, caller, item):
+        assert item == array_item(self.count)
+        self.count += 1
+
+    async def finish(self, caller):
+        self.finished = True
+
+
+def test_stream_json_array_callback(local_server, logger):
+    count = 2000
+    counter = CountingHandler()
+    collector = CollectJsonArrayItems()
+    action = AiohttpAction(
+        aiohttp_args=AiohttpRequest(
+            method="get", url=f"{local_server.base_url}/json-array/{count}"
+        ),
+        callbacks=ActionCallbacks(
+            success=[AC.StreamJsonArrayToHandlers(handlers=[counter, collector])]
+        ),
+    )
+    do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    assert counter.count == count
+    assert counter.finished
+    assert action.context["pfmsoft_item_count"] == count
+    assert action.response_data == [array_item(index) for index in range(count)]
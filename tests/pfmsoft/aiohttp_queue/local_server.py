@@ -0,0 +1,172 @@
+"""A small in-process aiohttp server, so tests can run without network access."""
+import asyncio
+import json
+import logging
+import threading
+from typing import Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+def payload_bytes(size: int) -> bytes:
+    """Deterministic payload, so tests can check what was written."""
+    pattern = b"0123456789abcdef"
+    repeats, remainder = divmod(size, len(pattern))
+    return pattern * repeats + pattern[:remainder]
+
+
+async def get_handler(request: web.Request) -> web.Response:
+    return web.json_response({"args": dict(request.query), "url": str(request.url)})
+
+
+async def status_handler(request: web.Request) -> web.Response:
+    return web.Response(status=int(request.match_info["code"]))
+
+
+async def stream_bytes_handler(request: web.Request) -> web.StreamResponse:
+    size = int(request.match_info["size"])
+    response = web.StreamResponse()
+    response.content_type = "application/octet-stream"
+    await response.prepare(request)
+    data = payload_bytes(size)
+    for start in range(0, size, 65536):
+        await response.write(data[start : start + 65536])
+    await response.write_eof()
+    return response
+
+
+def array_item(index: int) -> dict:
+    """Items with strings that look like json structure, to trip up a naive parser."""
+    return {
+        "id": index,
+        "name": f'item "{index}" [{{,}}] \\',
+        "tags": ["a", "b"],
+        "nested": {"values": [index, index * 0.5, None, True]},
+    }
+
+
+async def json_array_handler(request: web.Request) -> web.StreamResponse:
+    count = int(request.match_info["count"])
+    response = web.StreamResponse()
+    response.content_type = "application/json"
+    await response.prepare(request)
+    body = json.dumps([array_item(index) for index in range(count)]).encode()
+    # Small, odd sized writes so items are split across chunks.
+    for start in range(0, len(body), 1000):
+        await response.write(body[start : start + 1000])
+    await response.write_eof()
+    return response
+
+
+async def list_of_dicts_handler(request: web.Request) -> web.Response:
+    count = int(request.match_info["count"])
+    return web.json_response([array_item(index) for index in range(count)])
+
+
+async def gzip_handler(request: web.Request) -> web.Response:
+    response = web.json_response(
+        {"accept_encoding": request.headers.get("Accept-Encoding"), "gzipped": True}
+    )
+    response.enable_compression(web.ContentCoding.gzip)
+    return response
+
+
+def page_slice(request: web.Request, start: int, size: int) -> list:
+    count = int(request.match_info["count"])
+    return [array_item(index) for index in range(start, min(start + size, count))]
+
+
+async def pages_handler(request: web.Request) -> web.Response:
+    """Numbered pages, with x-pages and Link headers.
+
+    The body of page `bad_page`, if it is given, is not valid json.
+    """
+    count = int(request.match_info["count"])
+    per_page = int(request.query.get("per_page", "10"))
+    page = int(request.query.get("page", "1"))
+    last_page = max(1, -(-count // per_page))
+    url = request.url.with_query({**request.query, "per_page": str(per_page)})
+    links = [f'<{url.update_query(page=last_page)}>; rel="last"']
+    if page < last_page:
+        links.append(f'<{url.update_query(page=page + 1)}>; rel="next"')
+    headers = {"x-pages": str(last_page), "Link": ", ".join(links)}
+    if str(page) == request.query.get("bad_page"):
+        return web.Response(
+            text='[{"id": ', content_type="application/json", headers=headers
+        )
+    return web.json_response(
+        page_slice(request, (page - 1) * per_page, per_page), headers=headers
+    )
+
+
+async def cursor_handler(request: web.Request) -> web.Response:
+    """Opaque cursors, in the body and in a header."""
+    count = int(request.match_info["count"])
+    per_page = int(request.query.get("per_page", "10"))
+    start = int(request.query.get("cursor", "c0")[1:])
+    next_start = start + per_page
+    next_cursor = f"c{next_start}" if next_start < count else None
+    headers = {"x-next-cursor": next_cursor} if next_cursor else {}
+    return web.json_response(
+        {"items": page_slice(request, start, per_page), "next_cursor": next_cursor},
+        headers=headers,
+    )
+
+
+async def offset_handler(request: web.Request) -> web.Response:
+    """Offset and limit, with an X-Total-Count header."""
+    count = int(request.match_info["count"])
+    offset = int(request.query.get("offset", "0"))
+    limit = int(request.query.get("limit", "10"))
+    return web.json_response(
+        page_slice(request, offset, limit), headers={"X-Total-Count": str(count)}
+    )
+
+
+def make_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/get", get_handler)
+    app.router.add_get("/status/{code}", status_handler)
+    app.router.add_get("/stream-bytes/{size}", stream_bytes_handler)
+    app.router.add_get("/json-array/{count}", json_array_handler)
+    app.router.add_get("/list-of-dicts/{count}", list_of_dicts_handler)
+    app.router.add_get("/gzip", gzip_handler)
+    app.router.add_get("/pages/{count}", pages_handler)
+    app.router.add_get("/cursor/{count}", cursor_handler)
+    app.router.add_get("/offset/{count}", offset_handler)
+    return app
+
+
+class LocalServer:
+    """Run the test app on its own event loop in a background thread."""
+
+    def __init__(self, app: Optional[web.Application] = None) -> None:
+        self.app = app if app is not None else make_app()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.runner: Optional[web.AppRunner] = None
+        self.port: int = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def _start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # type: ignore
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        logger.info("Local test server running at %s", self.base_url)
+
+    def stop(self):
+        if self.runner is not None:
+            asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
@@ -0,0 +1,82 @@
+import asyncio
+from pathlib import Path
+
+from aiohttp import ClientSession
+
+from pfmsoft.aiohttp_queue import AiohttpAction, AiohttpQueueWorker, AiohttpRequest
+from pfmsoft.aiohttp_queue.metrics import (
+    MetricsFileExporter,
+    MetricsRegistry,
+    MetricsServer,
+    RunnerMetrics,
+)
+from pfmsoft.aiohttp_queue.runners import do_queue_runner, queue_runner
+
+
+def test_render():
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs", "Jobs done.", ("state",))
+    counter.inc(2, ("ok",))
+    counter.inc(1, ('say "hi"',))
+    assert registry.counter("jobs", "Jobs done.", ("state",)) is counter
+    histogram = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+    registry.gauge("depth", "Depth.").set(3)
+    text = registry.render()
+    assert 'jobs_total{state="ok"} 2' in text
+    assert r'jobs_total{state="say \"hi\""} 1' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 3' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+    assert "latency_seconds_count 4" in text
+    assert "latency_seconds_sum 6.05" in text
+    assert "depth 3" in text
+    assert text.endswith("# EOF\n")
+
+
+def test_queue_runner_metrics(local_server):
+    metrics = RunnerMetrics()
+    actions = [
+        AiohttpAction(AiohttpRequest(method="get", url=f"{local_server.base_url}/get"))
+        for _ in range(10)
+    ]
+    actions.append(
+        AiohttpAction(
+            AiohttpRequest(method="get", url=f"{local_server.base_url}/status/503"),
+            max_attempts=2,
+        )
+    )
+    workers = [AiohttpQueueWorker() for _ in range(3)]
+    do_queue_runner(actions, workers, metrics=metrics)
+    assert metrics.attempts.value(("success",)) == 10
+    assert metrics.attempts.value(("retry",)) == 2
+    # The third attempt is over max_attempts, and fails without a request.
+    assert metrics.attempts.value(("fail",)) == 1
+    assert metrics.request_seconds.count(("127.0.0.1", "200")) == 10
+    assert metrics.request_seconds.count(("127.0.0.1", "503")) == 2
+    assert metrics.in_flight.value() == 0
+    assert metrics.queue_depth.value() == 0
+    assert 0 < metrics.utilization() <= 1
+
+
+def test_metrics_endpoint_and_file(local_server, test_app_data_dir):
+    file_path: Path = test_app_data_dir / Path("metrics/metrics.txt")
+    metrics = RunnerMetrics()
+
+    async def run():
+        async with MetricsServer(metrics.registry, port=0) as server:
+            async with MetricsFileExporter(metrics.registry, file_path, 0.01):
+                action = AiohttpAction(
+                    AiohttpRequest(method="get", url=f"{local_server.base_url}/get")
+                )
+                await queue_runner([action], [AiohttpQueueWorker()], metrics=metrics)
+            async with ClientSession() as session:
+                url = f"http://127.0.0.1:{server.port}/metrics"
+                async with session.get(url) as response:
+                    assert response.content_type == "application/openmetrics-text"
+                    return await response.text()
+
+    text = asyncio.run(run())
+    assert 'aiohttp_queue_attempts_total{state="success"} 1' in text
+    assert file_path.read_text() == text
@@ -0,0 +1,247 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional
+
+import pytest
+from aiohttp import ClientSession
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.pagination import (
+    CursorStrategy,
+    LinkHeaderStrategy,
+    OffsetLimitStrategy,
+    PageReorderBuffer,
+    PaginationStrategy,
+    XPagesStrategy,
+    lookup,
+)
+from pfmsoft.aiohttp_queue.runners import do_single_action_runner
+from pfmsoft.aiohttp_queue.sinks import JsonLinesSink
+
+
+def paginated_action(
+    url: str, paginate: AC.Paginate, params: Optional[Dict] = None
+) -> AiohttpAction:
+    return AiohttpAction(
+        aiohttp_args=AiohttpRequest(method="get", url=url, params=params),
+        callbacks=ActionCallbacks(success=[AC.ResponseContentToJson(), paginate]),
+    )
+
+
+def run_pages(url: str, strategy: PaginationStrategy, params=None, max_pages=1000):
+    action = paginated_action(url, AC.Paginate(strategy, max_pages=max_pages), params)
+    do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    return action
+
+
+def item_ids(action: AiohttpAction):
+    return [item["id"] for item in action.response_data]
+
+
+def test_lookup():
+    assert lookup({"meta": {"next": "a"}}, "meta.next") == "a"
+    assert lookup({"meta": None}, "meta.next") is None
+    assert lookup([1], None) == [1]
+
+
+def test_x_pages(local_server):
+    action = run_pages(
+        f"{local_server.base_url}/pages/95", XPagesStrategy(), {"page": 1}
+    )
+    assert item_ids(action) == list(range(95))
+    assert action.context["pfmsoft_page_count"] == 10
+
+
+def test_link_header_follow(local_server):
+    action = run_pages(
+        f"{local_server.base_url}/pages/45", LinkHeaderStrategy(), {"page": 1}
+    )
+    assert item_ids(action) == list(range(45))
+    assert action.context["pfmsoft_page_count"] == 5
+
+
+def test_link_header_concurrent(local_server):
+    strategy = LinkHeaderStrategy(page_param="page")
+    first = paginated_action(
+        f"{local_server.base_url}/pages/45",
+        AC.Paginate(strategy),
+        {"page": 1},
+    )
+    do_single_action_runner(first)
+    assert item_ids(first) == list(range(45))
+
+
+def test_body_cursor(local_server):
+    action = run_pages(
+        f"{local_server.base_url}/cursor/33",
+        CursorStrategy(body_field="next_cursor", items_field="items"),
+    )
+    assert item_ids(action) == list(range(33))
+    assert action.context["pfmsoft_page_count"] == 4
+
+
+def test_header_cursor(local_server):
+    action = run_pages(
+        f"{local_server.base_url}/cursor/33",
+        CursorStrategy(header="x-next-cursor", items_field="items"),
+    )
+    assert item_ids(action) == list(range(33))
+
+
+def test_offset_with_total(local_server):
+    strategy = OffsetLimitStrategy(limit=10, total_header="X-Total-Count")
+    action = run_pages(
+        f"{local_server.base_url}/offset/57", strategy, {"offset": 0, "limit": 10}
+    )
+    assert item_ids(action) == list(range(57))
+    assert action.context["pfmsoft_page_count"] == 6
+
+
+def test_offset_speculative(local_server):
+    strategy = OffsetLimitStrategy(limit=10)
+    action = run_pages(
+        f"{local_server.base_url}/offset/50", strategy, {"offset": 0, "limit": 10}
+    )
+    # The last page is empty, the page after it is prefetched and dropped.
+    assert item_ids(action) == list(range(50))
+    assert action.context["pfmsoft_page_count"] == 6
+
+
+def test_max_pages(local_server):
+    action = run_pages(
+        f"{local_server.base_url}/cursor/100",
+        CursorStrategy(items_field="items"),
+        max_pages=3,
+    )
+    assert item_ids(action) == list(range(30))
+
+
+def test_max_pages_concurrent_log(local_server, caplog):
+    caplog.set_level(logging.INFO, logger="pfmsoft.aiohttp_queue.callbacks")
+    action = run_pages(
+        f"{local_server.base_url}/pages/95", XPagesStrategy(), {"page": 1}, max_pages=4
+    )
+    assert item_ids(action) == list(range(40))
+    messages = [record.getMessage() for record in caplog.records]
+    assert any("dropping the last 6" in message for message in messages)
+    assert any(message.startswith("Fetching 3 more pages") for message in messages)
+
+
+def test_check_for_pages_keeps_all_pages(local_server):
+    action = AiohttpAction(
+        aiohttp_args=AiohttpRequest(
+            method="get", url=f"{local_server.base_url}/pages/45", params={"page": 1}
+        ),
+        callbacks=ActionCallbacks(
+            success=[AC.ResponseContentToJson(), AC.CheckForPages()]
+        ),
+    )
+    do_single_action_runner(action)
+    assert item_ids(action) == list(range(45))
+
+
+def test_report(local_server):
+    action = run_pages(
+        f"{local_server.base_url}/cursor/100",
+        CursorStrategy(items_field="items"),
+        max_pages=3,
+    )
+    report = action.context["pfmsoft_page_report"]
+    assert not report["complete"]
+    assert report["truncated"]
+    assert [page["count"] for page in report["pages"]] == [10, 10, 10]
+    action = run_pages(
+        f"{local_server.base_url}/pages/25", XPagesStrategy(), {"page": 1}
+    )
+    report = action.context["pfmsoft_page_report"]
+    assert report["complete"]
+    assert report["item_count"] == 25
+
+
+def test_undecodable_page_fails(local_server):
+    for strategy in (XPagesStrategy(), LinkHeaderStrategy()):
+        action = run_pages(
+            f"{local_server.base_url}/pages/95",
+            strategy,
+            {"page": 1, "bad_page": 3},
+        )
+        report = action.context["pfmsoft_page_report"]
+        assert not report["complete"]
+        assert report["failed_pages"] == [3]
+        assert item_ids(action)[:20] == list(range(20))
+        assert 20 not in item_ids(action)
+
+
+def test_max_pages_must_be_positive():
+    with pytest.raises(ValueError):
+        AC.Paginate(XPagesStrategy(), max_pages=0)
+
+
+class FailingItemsStrategy(XPagesStrategy):
+    def page_items(self, action: AiohttpAction) -> List:
+        if action.id_ == "3":
+            raise RuntimeError("No items for page 3.")
+        return super().page_items(action)
+
+
+def test_concurrent_workers_stopped_on_error(local_server):
+    async def paginate():
+        action = paginated_action(
+            f"{local_server.base_url}/pages/300",
+            AC.Paginate(FailingItemsStrategy(), workers=4, window=2),
+            {"page": 1},
+        )
+        async with ClientSession() as session:
+            with pytest.raises(RuntimeError):
+                await action.do_action(session)
+        # Only this task is left, no worker is waiting on the reorder buffer.
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+
+    asyncio.run(paginate())
+
+
+def test_stream_pages_to_sink(local_server, test_app_data_dir):
+    file_path = test_app_data_dir / "pagination/pages.jsonl"
+    sink = JsonLinesSink(file_path)
+    paginate = AC.Paginate(XPagesStrategy(), sink=sink, workers=8, window=3)
+    action = paginated_action(
+        f"{local_server.base_url}/pages/300", paginate, {"page": 1, "per_page": 7}
+    )
+    do_single_action_runner(action, sinks=[sink])
+    assert action.state == ActionState.SUCCESS
+    assert action.response_data is None
+    assert action.context["pfmsoft_page_report"]["complete"]
+    with open(file_path, "rb") as file:
+        ids = [json.loads(line)["id"] for line in file]
+    assert ids == list(range(300))
+
+
+def test_reorder_buffer():
+    emitted: List[int] = []
+
+    async def emit(action, page_number):
+        _ = action
+        emitted.append(page_number)
+
+    async def run():
+        buffer = PageReorderBuffer(emit, window=3, next_page=1)
+        await buffer.add(2, None)
+        await buffer.add(3, None)
+        assert emitted == []
+        reserve = asyncio.create_task(buffer.reserve(4))
+        await asyncio.sleep(0)
+        assert not reserve.done()
+        await buffer.add(1, None)
+        await asyncio.wait_for(reserve, 1)
+        assert emitted == [1, 2, 3]
+        assert buffer.max_held == 3
+
+    asyncio.run(run())
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.runners import do_queue_runner
+from pfmsoft.aiohttp_queue.sinks import ParquetSink
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def test_list_of_dicts_to_parquet(local_server, test_app_data_dir):
+    file_path = test_app_data_dir / "parquet/list_of_dicts.parquet"
+    sink = ParquetSink(file_path, row_group_size=120)
+    actions = [
+        AiohttpAction(
+            aiohttp_args=AiohttpRequest(
+                method="get", url=f"{local_server.base_url}/list-of-dicts/50"
+            ),
+            callbacks=ActionCallbacks(
+                success=[AC.ResponseContentToJson(), AC.SaveResultToSink(sink)]
+            ),
+        )
+        for _ in range(10)
+    ]
+    do_queue_runner(actions, [AiohttpQueueWorker() for _ in range(3)], sinks=[sink])
+    assert all(action.state == ActionState.SUCCESS for action in actions)
+    assert sink.rows_written == 500
+    parquet_file = pq.ParquetFile(str(file_path))
+    assert parquet_file.metadata.num_rows == 500
+    assert parquet_file.metadata.num_row_groups == 5
+    table = parquet_file.read()
+    assert table.schema.field("id").type == pa.int64()
+    assert sorted(table.column("id").to_pylist()) == sorted(list(range(50)) * 10)
+
+
+def test_declared_schema(tmp_path):
+    schema = pa.schema([("id", pa.int32()), ("price", pa.float64())])
+    sink = ParquetSink(tmp_path / "declared.parquet", schema=schema)
+
+    async def run():
+        await sink.put({"id": 1, "price": 2.5, "ignored": "x"})
+        await sink.put([{"id": 2}, {"id": 3, "price": 1}])
+        await sink.close()
+
+    asyncio.run(run())
+    table = pq.read_table(str(tmp_path / "declared.parquet"))
+    assert table.schema == schema
+    assert table.to_pylist() == [
+        {"id": 1, "price": 2.5},
+        {"id": 2, "price": None},
+        {"id": 3, "price": 1.0},
+    ]
@@ -0,0 +1,129 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.paths import PathResolver
+from pfmsoft.aiohttp_queue.runners import do_queue_runner
+
+
+def test_template_cache():
+    resolver = PathResolver()
+    assert resolver.template("${a}/x") is resolver.template("${a}/x")
+    assert resolver.substitute("${a}/${b}.json", {"a": "one"}) == Path("one/${b}.json")
+
+
+def test_ensure_parent_once(tmp_path):
+    resolver = PathResolver()
+    for index in range(10):
+        resolver.ensure_parent(tmp_path / "a" / "b" / f"{index}.json")
+    assert (tmp_path / "a" / "b").is_dir()
+    assert resolver.mkdir_count == 1
+    resolver.forget_directories()
+    resolver.ensure_parent(tmp_path / "a" / "b" / "x.json")
+    assert resolver.mkdir_count == 2
+
+
+def test_shard_layout():
+    resolver = PathResolver(shard_depth=2, shard_width=2)
+    sharded = resolver.shard(Path("out/result.json"))
+    assert sharded.name == "result.json"
+    assert sharded.parts[0] == "out"
+    assert len(sharded.parts) == 4
+    assert all(len(part) == 2 for part in sharded.parts[1:3])
+    assert resolver.shard(Path("other/result.json")).parts[1:] == sharded.parts[1:]
+    assert PathResolver().shard(Path("out/result.json")) == Path("out/result.json")
+    with pytest.raises(ValueError):
+        PathResolver(shard_depth=-1)
+
+
+def test_sharded_callbacks(local_server, test_app_data_dir):
+    resolver = PathResolver(shard_depth=1)
+    output_dir = test_app_data_dir / Path("paths")
+    actions = []
+    for index in range(20):
+        callback = AC.SaveResultToJsonFile(
+            file_path_template=str(output_dir / "${index}.json"),
+            path_values={"index": str(index)},
+            path_resolver=resolver,
+        )
+        actions.append(
+            AiohttpAction(
+                aiohttp_args=AiohttpRequest(
+                    method="get",
+                    url=f"{local_server.base_url}/get",
+                    params={"index": index},
+                ),
+                callbacks=ActionCallbacks(
+                    success=[AC.ResponseContentToJson(), callback]
+                ),
+            )
+        )
+    do_queue_runner(actions, [AiohttpQueueWorker() for _ in range(4)])
+    for action in actions:
+        assert action.state == ActionState.SUCCESS
+    written = sorted(output_dir.glob("*/*.json"))
+    assert len(written) == 20
+    assert resolver.mkdir_count == len({path.parent for path in written})
+
+
+def test_removed_directory_is_made_again(local_server, test_app_data_dir):
+    output_dir = test_app_data_dir / Path("paths_removed")
+
+    def run_callbacks():
+        action = AiohttpAction(
+            aiohttp_args=AiohttpRequest(
+                method="get", url=f"{local_server.base_url}/list-of-dicts/3"
+            ),
+            callbacks=ActionCallbacks(
+                success=[
+                    AC.ResponseContentToJson(),
+                    AC.SaveResultToJsonFile(file_path=output_dir / "sub" / "a.json"),
+                    AC.SaveListOfDictResultToCSVFile(
+                        file_path=output_dir / "csv" / "a.csv"
+                    ),
+                ]
+            ),
+        )
+        stream_action = AiohttpAction(
+            aiohttp_args=AiohttpRequest(
+                method="get", url=f"{local_server.base_url}/stream-bytes/100"
+            ),
+            callbacks=ActionCallbacks(
+                success=[
+                    AC.SaveResponseStreamToFile(
+                        file_path=output_dir / "stream" / "a.bin"
+                    )
+                ]
+            ),
+        )
+        do_queue_runner([action, stream_action], [AiohttpQueueWorker()])
+        assert action.state == ActionState.SUCCESS
+        assert stream_action.state == ActionState.SUCCESS
+
+    # Both runs use the shared default resolver, which remembers the directories.
+    run_callbacks()
+    shutil.rmtree(output_dir)
+    run_callbacks()
+    assert (output_dir / "sub" / "a.json").is_file()
+    assert (output_dir / "csv" / "a.csv").is_file()
+    assert (output_dir / "stream" / "a.bin").stat().st_size == 100
+
+
+def test_remake_parent(tmp_path):
+    resolver = PathResolver()
+    file_path = tmp_path / "a" / "b" / "x.json"
+    assert not resolver.remake_parent(file_path)
+    resolver.ensure_parent(file_path)
+    shutil.rmtree(tmp_path / "a")
+    assert resolver.remake_parent(file_path)
+    assert file_path.parent.is_dir()
+    assert resolver.mkdir_count == 2
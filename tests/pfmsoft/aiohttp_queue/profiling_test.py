@@ -0,0 +1,66 @@
+import pstats
+import time
+from pathlib import Path
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    AiohttpAction,
+    AiohttpActionCallback,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue.callbacks import ResponseContentToJson
+from pfmsoft.aiohttp_queue.events import EventBus, EventRingBuffer
+from pfmsoft.aiohttp_queue.profiling import RunProfiler
+from pfmsoft.aiohttp_queue.runners import do_queue_runner
+
+
+class BlockingCallback(AiohttpActionCallback):
+    async def do_callback(self, caller: AiohttpAction):
+        time.sleep(0.05)
+        self.success(caller)
+
+
+def test_queue_runner_profiler(local_server, test_app_data_dir: Path):
+    profile_path = test_app_data_dir / "profiling" / "run.prof"
+    profiler = RunProfiler(
+        interval=0.005, slow_callback_seconds=0.04, profile_path=profile_path
+    )
+    events = EventBus()
+    ring = events.subscribe(EventRingBuffer())
+    actions = [
+        AiohttpAction(
+            AiohttpRequest(method="get", url=f"{local_server.base_url}/get"),
+            name="get",
+            callbacks=ActionCallbacks(success=[ResponseContentToJson()]),
+        )
+        for _ in range(5)
+    ]
+    actions.append(
+        AiohttpAction(
+            AiohttpRequest(method="get", url=f"{local_server.base_url}/get"),
+            name="blocking",
+            callbacks=ActionCallbacks(success=[BlockingCallback()]),
+            events=events,
+        )
+    )
+    do_queue_runner(actions, [AiohttpQueueWorker()], profiler=profiler)
+    summary = profiler.profile_summary()
+    assert summary["callbacks"]["ResponseContentToJson"]["count"] == 5
+    assert summary["callbacks"]["BlockingCallback"]["count"] == 1
+    assert summary["actions"]["get"]["count"] == 5
+    assert summary["actions"]["blocking"]["count"] == 1
+    assert summary["slow_callback_count"] == 1
+    assert summary["slow_callbacks"][0]["callback"] == "BlockingCallback"
+    # The blocking sleep shows up as lag, blamed on the callback that ran.
+    assert summary["loop_lag"]["max"] >= 0.03
+    assert summary["callbacks"]["BlockingCallback"]["lag"] >= 0.03
+    # An action with its own bus keeps it, and the profiler subscribes to it.
+    assert actions[-1].events is events
+    assert len(ring) > 0
+    # Stopping the profiler detaches it again.
+    assert events.subscribers == [ring]
+    assert all(action.events is None for action in actions[:-1])
+    assert profiler.summary() == summary["loop_lag"]
+    assert "BlockingCallback" in profiler.report()
+    assert pstats.Stats(str(profile_path)).total_calls > 0
@@ -0,0 +1,59 @@
+import logging
+from io import StringIO
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    AiohttpAction,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue.callbacks import ResponseContentToJson
+from pfmsoft.aiohttp_queue.progress import ProgressReporter, format_duration
+from pfmsoft.aiohttp_queue.runners import do_queue_runner, do_sequential_action_runner
+
+
+def test_format_duration():
+    assert format_duration(3725.5) == "01:02:05"
+    assert format_duration(None) == "--:--:--"
+
+
+def test_queue_runner_progress(local_server):
+    stream = StringIO()
+    progress = ProgressReporter(interval=0.01, stream=stream)
+    actions = [
+        AiohttpAction(
+            AiohttpRequest(method="get", url=f"{local_server.base_url}/get"),
+            callbacks=ActionCallbacks(success=[ResponseContentToJson()]),
+        )
+        for _ in range(10)
+    ]
+    actions.append(
+        AiohttpAction(
+            AiohttpRequest(method="get", url=f"{local_server.base_url}/status/503"),
+            max_attempts=2,
+        )
+    )
+    do_queue_runner(actions, [AiohttpQueueWorker()], progress=progress)
+    assert progress.total == 11
+    assert progress.succeeded == 10
+    assert progress.failed == 1
+    assert progress.retries == 2
+    assert progress.bytes_received > 0
+    output = stream.getvalue()
+    assert output.startswith("\r")
+    assert output.endswith("\n")
+    assert "11/11 (100.0%) ok=10 failed=1 retries=2" in output
+    assert "eta 00:00:00" in output
+
+
+def test_sequential_runner_progress_logs(local_server, caplog):
+    caplog.set_level(logging.INFO, logger="pfmsoft.aiohttp_queue.progress")
+    progress = ProgressReporter(interval=60)
+    actions = [
+        AiohttpAction(AiohttpRequest(method="get", url=f"{local_server.base_url}/get"))
+        for _ in range(3)
+    ]
+    do_sequential_action_runner(actions, progress=progress)
+    # Only the final report, the timer never fired.
+    assert progress.reports == 1
+    assert "Progress: 3/3 (100.0%) ok=3 failed=0" in caplog.text
@@ -0,0 +1,156 @@
+import json
+from pathlib import Path
+from typing import List
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.pagination import LinkHeaderStrategy, XPagesStrategy
+from pfmsoft.aiohttp_queue.replay import (
+    ArchiveRecorder,
+    ReplayArchive,
+    request_fingerprint,
+)
+from pfmsoft.aiohttp_queue.runners import do_queue_runner, do_single_action_runner
+
+
+def json_actions(base_url: str) -> List[AiohttpAction]:
+    return [
+        AiohttpAction(
+            AiohttpRequest(method="get", url=f"{base_url}/get", params={"n": index}),
+            callbacks=ActionCallbacks(success=[AC.ResponseContentToJson()]),
+        )
+        for index in range(5)
+    ] + [
+        AiohttpAction(
+            AiohttpRequest(method="get", url=f"{base_url}/list-of-dicts/20"),
+            callbacks=ActionCallbacks(success=[AC.ResponseContentToJson()]),
+        ),
+        AiohttpAction(
+            AiohttpRequest(method="get", url=f"{base_url}/gzip"),
+            callbacks=ActionCallbacks(success=[AC.ResponseContentToText()]),
+        ),
+    ]
+
+
+def run_queue(actions, session_factory, sinks=None):
+    do_queue_runner(
+        actions,
+        [AiohttpQueueWorker() for _ in range(3)],
+        sinks=sinks,
+        session_factory=session_factory,
+    )
+
+
+def test_request_fingerprint():
+    first = request_fingerprint("get", "http://a.test/x?b=2&a=1")
+    assert first == request_fingerprint("GET", "http://a.test/x", {"a": 1, "b": 2})
+    assert first != request_fingerprint("GET", "http://a.test/x", {"a": 2, "b": 2})
+    assert request_fingerprint(
+        "post", "http://a.test/x", json_data={"a": 1, "b": 2}
+    ) == request_fingerprint("post", "http://a.test/x", json_data={"b": 2, "a": 1})
+    assert request_fingerprint(
+        "post", "http://a.test/x", data=b"1"
+    ) != request_fingerprint("post", "http://a.test/x", data=b"2")
+
+
+def test_record_and_replay(local_server, test_app_data_dir: Path):
+    archive_dir = test_app_data_dir / "archive"
+    recorder = ArchiveRecorder(archive_dir, flush_size=2)
+    recorded = json_actions(local_server.base_url)
+    run_queue(recorded, recorder.session, sinks=[recorder])
+    assert all(action.state == ActionState.SUCCESS for action in recorded)
+    assert recorder.records_written == len(recorded)
+    lines = (archive_dir / "index.jsonl").read_text().splitlines()
+    assert len(lines) == len(recorded)
+    gzip_entry = [json.loads(line) for line in lines if "/gzip" in line][0]
+    # Bodies are stored decoded.
+    assert "Content-Encoding" not in dict(gzip_entry["headers"])
+
+    replayed = json_actions(local_server.base_url)
+    with ReplayArchive(archive_dir) as archive:
+        run_queue(replayed, archive.session)
+        assert archive.hits == len(replayed)
+        assert archive.misses == 0
+    for original, replay in zip(recorded, replayed):
+        assert replay.state == ActionState.SUCCESS
+        assert replay.response_data == original.response_data
+
+
+def test_replay_retries_in_order(local_server, test_app_data_dir: Path):
+    archive_dir = test_app_data_dir / "retry_archive"
+    recorder = ArchiveRecorder(archive_dir)
+    action = AiohttpAction(
+        AiohttpRequest(method="get", url=f"{local_server.base_url}/status/503"),
+        max_attempts=3,
+    )
+    run_queue([action], recorder.session, sinks=[recorder])
+    assert action.state == ActionState.FAIL
+    assert recorder.records_written == 3
+
+    replay = AiohttpAction(
+        AiohttpRequest(method="get", url=f"{local_server.base_url}/status/503"),
+        max_attempts=3,
+    )
+    with ReplayArchive(archive_dir) as archive:
+        run_queue([replay], archive.session)
+        assert archive.hits == 3
+    assert replay.state == ActionState.FAIL
+    assert replay.attempts == action.attempts
+
+
+def test_replay_miss(local_server, test_app_data_dir: Path):
+    archive_dir = test_app_data_dir / "empty_archive"
+    recorder = ArchiveRecorder(archive_dir)
+    do_single_action_runner(
+        AiohttpAction(AiohttpRequest(method="get", url=f"{local_server.base_url}/get")),
+        sinks=[recorder],
+        session_factory=recorder.session,
+    )
+    action = AiohttpAction(
+        AiohttpRequest(method="get", url=f"{local_server.base_url}/not-recorded")
+    )
+    with ReplayArchive(archive_dir) as archive:
+        run_queue([action], archive.session)
+        assert archive.misses == 1
+    assert action.state != ActionState.SUCCESS
+
+
+def test_replay_pagination(local_server, test_app_data_dir: Path):
+    def paginated(strategy, session_factory):
+        return AiohttpAction(
+            AiohttpRequest(
+                method="get",
+                url=f"{local_server.base_url}/pages/35",
+                params={"page": 1},
+            ),
+            callbacks=ActionCallbacks(
+                success=[
+                    AC.ResponseContentToJson(),
+                    AC.Paginate(strategy, session_factory=session_factory),
+                ]
+            ),
+        )
+
+    for name, strategy in (
+        ("x_pages", XPagesStrategy()),
+        ("links", LinkHeaderStrategy()),
+    ):
+        archive_dir = test_app_data_dir / f"pages_{name}"
+        recorder = ArchiveRecorder(archive_dir)
+        recorded = paginated(strategy, recorder.session)
+        do_single_action_runner(
+            recorded, sinks=[recorder], session_factory=recorder.session
+        )
+        assert [item["id"] for item in recorded.response_data] == list(range(35))
+        with ReplayArchive(archive_dir) as archive:
+            replayed = paginated(strategy, archive.session)
+            do_single_action_runner(replayed, session_factory=archive.session)
+            assert archive.misses == 0
+        assert replayed.response_data == recorded.response_data
+        assert replayed.context["pfmsoft_page_count"] == 4
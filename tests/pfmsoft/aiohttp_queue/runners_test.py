@@ -0,0 +1,89 @@
+from time import perf_counter
+
+import pytest
+from aiohttp import ClientConnectorError
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.progress import ProgressReporter
+from pfmsoft.aiohttp_queue.runners import (
+    do_sequential_action_runner,
+    do_streaming_queue_runner,
+)
+from pfmsoft.aiohttp_queue.sinks import JsonLinesSink
+
+
+def test_streaming_queue_runner_reads_ahead_boundedly(local_server):
+    made = []
+    progress = ProgressReporter(interval=60)
+
+    def actions():
+        for index in range(50):
+            # The actions made but not finished are queued, or being done.
+            assert index - progress.finished <= 5 + 2
+            action = AiohttpAction(
+                AiohttpRequest(
+                    method="get",
+                    url=f"{local_server.base_url}/get",
+                    params={"n": index},
+                ),
+                callbacks=ActionCallbacks(success=[AC.ResponseContentToJson()]),
+            )
+            made.append(action)
+            yield action
+
+    summary = do_streaming_queue_runner(
+        actions(),
+        [AiohttpQueueWorker() for _ in range(2)],
+        progress=progress,
+        max_queued=5,
+    )
+    assert summary["actions"] == 50
+    assert summary["workers"] == 2
+    assert progress.total == 50
+    assert all(action.state == ActionState.SUCCESS for action in made)
+
+
+def test_streaming_queue_runner_retries_and_rate(local_server):
+    actions = [
+        AiohttpAction(
+            AiohttpRequest(method="get", url=f"{local_server.base_url}/status/503"),
+            max_attempts=3,
+        )
+        for _ in range(6)
+    ]
+    start = perf_counter()
+    summary = do_streaming_queue_runner(
+        iter(actions), [AiohttpQueueWorker()], max_queued=1, rate=50
+    )
+    # Five intervals between six new actions.
+    assert perf_counter() - start >= 0.1
+    assert summary["actions"] == 6
+    assert all(action.state == ActionState.FAIL for action in actions)
+
+
+def test_sinks_closed_when_an_action_raises(local_server, test_app_data_dir):
+    file_path = test_app_data_dir / "runner_raises.jsonl"
+    sink = JsonLinesSink(file_path)
+    saved = AiohttpAction(
+        AiohttpRequest(method="get", url=f"{local_server.base_url}/get"),
+        callbacks=ActionCallbacks(
+            success=[AC.ResponseContentToJson(), AC.SaveResultToSink(sink)]
+        ),
+    )
+    # Nothing listens on port 1, the request raises.
+    unreachable = AiohttpAction(AiohttpRequest(method="get", url="http://127.0.0.1:1"))
+    progress = ProgressReporter(interval=60)
+    with pytest.raises(ClientConnectorError):
+        do_sequential_action_runner(
+            [saved, unreachable], sinks=[sink], progress=progress
+        )
+    assert sink.closed
+    assert len(file_path.read_text().splitlines()) == 1
+    assert progress.finished == 2
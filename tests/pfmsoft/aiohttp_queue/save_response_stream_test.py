@@ -0,0 +1,57 @@
+import hashlib
+from pathlib import Path
+
+import pytest
+from tests.pfmsoft.aiohttp_queue.local_server import payload_bytes
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.runners import do_single_action_runner
+
+
+def stream_action(url: str, callback: AC.SaveResponseStreamToFile) -> AiohttpAction:
+    return AiohttpAction(
+        aiohttp_args=AiohttpRequest(method="get", url=url),
+        callbacks=ActionCallbacks(success=[callback]),
+    )
+
+
+def test_stream_to_file(local_server, test_app_data_dir, logger):
+    size = 1024 * 1024 + 7
+    file_path: Path = test_app_data_dir / Path("stream_to_file.bin")
+    callback = AC.SaveResponseStreamToFile(
+        file_path=file_path, chunk_size=4096, hash_name="sha256"
+    )
+    action = stream_action(f"{local_server.base_url}/stream-bytes/{size}", callback)
+    do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    assert action.response_data is None
+    expected = payload_bytes(size)
+    assert file_path.read_bytes() == expected
+    assert callback.bytes_written == size
+    assert callback.hexdigest == hashlib.sha256(expected).hexdigest()
+    assert action.context["pfmsoft_stream_hash"]["hexdigest"] == callback.hexdigest
+
+
+def test_stream_to_file_template(local_server, test_app_data_dir, logger):
+    callback = AC.SaveResponseStreamToFile(
+        file_path_template=str(test_app_data_dir / "${sub_dir}" / "stream.bin"),
+        path_values={"sub_dir": "stream_template"},
+    )
+    action = stream_action(f"{local_server.base_url}/stream-bytes/100", callback)
+    do_single_action_runner(action)
+    file_path = test_app_data_dir / "stream_template" / "stream.bin"
+    assert file_path.read_bytes() == payload_bytes(100)
+    assert callback.hexdigest is None
+
+
+def test_stream_to_file_bad_args(tmp_path):
+    with pytest.raises(ValueError):
+        AC.SaveResponseStreamToFile(file_path=tmp_path / "x.bin", mode="w")
+    with pytest.raises(ValueError):
+        AC.SaveResponseStreamToFile(file_path=tmp_path / "x.bin", hash_name="nope")
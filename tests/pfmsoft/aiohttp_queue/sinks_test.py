@@ -0,0 +1,128 @@
+import asyncio
+import gzip
+import json
+from pathlib import Path
+from typing import List
+
+import pytest
+from tests.pfmsoft.aiohttp_queue.local_server import array_item
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.runners import do_queue_runner, do_single_action_runner
+from pfmsoft.aiohttp_queue.sinks import AsyncSink, JsonLinesSink, SinkItemHandler
+
+
+def read_lines(file_path: Path) -> List:
+    opener = gzip.open if file_path.suffix == ".gz" else open
+    with opener(file_path, "rt") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_many_actions_one_file(local_server, test_app_data_dir):
+    sink = JsonLinesSink(test_app_data_dir / "sinks/many.jsonl", flush_size=16)
+    actions = []
+    for index in range(100):
+        actions.append(
+            AiohttpAction(
+                aiohttp_args=AiohttpRequest(
+                    method="get",
+                    url=f"{local_server.base_url}/get",
+                    params={"index": str(index)},
+                ),
+                callbacks=ActionCallbacks(
+                    success=[AC.ResponseContentToJson(), AC.SaveResultToSink(sink)]
+                ),
+            )
+        )
+    workers = [AiohttpQueueWorker() for _ in range(10)]
+    do_queue_runner(actions, workers, sinks=[sink])
+    assert all(action.state == ActionState.SUCCESS for action in actions)
+    assert sink.closed
+    assert sink.records_written == 100
+    assert sink.batches_written < 100
+    records = read_lines(sink.file_path)
+    assert sorted(int(record["args"]["index"]) for record in records) == list(
+        range(100)
+    )
+
+
+def test_explode_rotate_compress(local_server, test_app_data_dir):
+    sink = JsonLinesSink(
+        test_app_data_dir / "sinks/rotated.jsonl.gz", rotate_records=30
+    )
+    action = AiohttpAction(
+        aiohttp_args=AiohttpRequest(
+            method="get", url=f"{local_server.base_url}/list-of-dicts/100"
+        ),
+        callbacks=ActionCallbacks(
+            success=[
+                AC.ResponseContentToJson(),
+                AC.SaveResultToSink(sink, explode=True),
+            ]
+        ),
+    )
+    do_single_action_runner(action, sinks=[sink])
+    assert [path.name for path in sink.file_paths] == [
+        f"rotated-0000{index}.jsonl.gz" for index in range(1, 5)
+    ]
+    records = []
+    for file_path in sink.file_paths:
+        lines = read_lines(file_path)
+        assert len(lines) <= 30
+        records.extend(lines)
+    assert records == [array_item(index) for index in range(100)]
+
+
+def test_stream_items_to_sink(local_server, test_app_data_dir):
+    sink = JsonLinesSink(test_app_data_dir / "sinks/streamed.jsonl")
+    action = AiohttpAction(
+        aiohttp_args=AiohttpRequest(
+            method="get", url=f"{local_server.base_url}/json-array/500"
+        ),
+        callbacks=ActionCallbacks(
+            success=[AC.StreamJsonArrayToHandlers(handlers=[SinkItemHandler(sink)])]
+        ),
+    )
+    do_single_action_runner(action, sinks=[sink])
+    assert read_lines(sink.file_path) == [array_item(index) for index in range(500)]
+
+
+def test_flush_interval(tmp_path):
+    sink = JsonLinesSink(tmp_path / "interval.jsonl", flush_interval=0.01)
+
+    async def run():
+        await sink.put({"a": 1})
+        await asyncio.sleep(0.1)
+        written = sink.records_written
+        await sink.close()
+        return written
+
+    assert asyncio.run(run()) == 1
+    assert read_lines(tmp_path / "interval.jsonl") == [{"a": 1}]
+
+
+class FailingSink(AsyncSink):
+    async def write_batch(self, batch):
+        raise OSError("disk full")
+
+
+def test_failed_writer():
+    sink = FailingSink(flush_interval=0.0, max_queue_size=2)
+
+    async def run():
+        await sink.put(1)
+        await asyncio.sleep(0.01)
+        with pytest.raises(RuntimeError):
+            await sink.put(2)
+        with pytest.raises(RuntimeError):
+            await sink.close()
+
+    asyncio.run(run())
+    assert sink.closed
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import sqlite3
+
+from tests.pfmsoft.aiohttp_queue.local_server import array_item
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpQueueWorker,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.runners import do_queue_runner
+from pfmsoft.aiohttp_queue.sinks import SqliteSink
+
+
+def test_upsert_from_many_actions(local_server, test_app_data_dir):
+    db_path = test_app_data_dir / "sqlite/items.db"
+    sink = SqliteSink(
+        db_path,
+        table="items",
+        key_columns=["id"],
+        column_types={"id": "INTEGER"},
+        flush_size=4,
+    )
+    actions = [
+        AiohttpAction(
+            aiohttp_args=AiohttpRequest(
+                method="get", url=f"{local_server.base_url}/list-of-dicts/50"
+            ),
+            callbacks=ActionCallbacks(
+                success=[AC.ResponseContentToJson(), AC.SaveResultToSink(sink)]
+            ),
+        )
+        for _ in range(8)
+    ]
+    do_queue_runner(actions, [AiohttpQueueWorker() for _ in range(4)], sinks=[sink])
+    assert all(action.state == ActionState.SUCCESS for action in actions)
+    assert sink.rows_written == 400
+    with sqlite3.connect(str(db_path)) as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert connection.execute("SELECT count(*) FROM items").fetchone()[0] == 50
+        name, tags, nested = connection.execute(
+            "SELECT name, tags, nested FROM items WHERE id = 7"
+        ).fetchone()
+    expected = array_item(7)
+    assert name == expected["name"]
+    assert json.loads(tags) == expected["tags"]
+    assert json.loads(nested) == expected["nested"]
+
+
+def test_declared_columns_insert(tmp_path):
+    sink = SqliteSink(tmp_path / "declared.db", table='odd "name"', columns=["a", "b"])
+
+    async def run():
+        await sink.put({"a": 1, "b": "x", "c": "dropped"})
+        await sink.put([{"a": 1}, {"b": "y"}])
+        await sink.close()
+
+    asyncio.run(run())
+    with sqlite3.connect(str(tmp_path / "declared.db")) as connection:
+        rows = connection.execute('SELECT a, b FROM "odd ""name"""').fetchall()
+    assert rows == [(1, "x"), (1, None), (None, "y")]
@@ -0,0 +1,57 @@
+from pfmsoft.aiohttp_queue import AiohttpAction, AiohttpQueueWorker, AiohttpRequest
+from pfmsoft.aiohttp_queue.metrics import RunnerMetrics
+from pfmsoft.aiohttp_queue.runners import do_queue_runner
+from pfmsoft.aiohttp_queue.tracing import PhaseTimings, with_phase_tracing
+
+
+def test_phases():
+    timings = PhaseTimings(enqueued=1.0)
+    timings.started = 2.0
+    timings.connect_start = 2.0
+    timings.connect_end = 2.5
+    timings.headers_sent = 2.5
+    timings.response_start = 3.0
+    timings.callbacks_start = 3.0
+    timings.body_end = 3.5
+    timings.callbacks_end = 4.0
+    assert timings.phases() == {
+        "queue_wait": 1.0,
+        "connect": 0.5,
+        "ttfb": 0.5,
+        "body": 0.5,
+        "callbacks": 0.5,
+        "total": 2.0,
+    }
+
+
+def test_with_phase_tracing_copies():
+    session_kwargs = {"trace_configs": []}
+    traced = with_phase_tracing(session_kwargs)
+    assert session_kwargs == {"trace_configs": []}
+    assert len(traced["trace_configs"]) == 1
+
+
+def test_queue_runner_trace(local_server):
+    metrics = RunnerMetrics()
+    actions = [
+        AiohttpAction(AiohttpRequest(method="get", url=f"{local_server.base_url}/get"))
+        for _ in range(5)
+    ]
+    do_queue_runner(actions, [AiohttpQueueWorker()], metrics=metrics, trace=True)
+    phases = [action.timings.phases() for action in actions]
+    for action_phases in phases:
+        # No callback reads the body.
+        assert {"queue_wait", "ttfb", "callbacks", "total"} <= set(action_phases)
+    # One worker, so the connection is made once and reused.
+    assert "connect" in phases[0]
+    assert not any("connect" in action_phases for action_phases in phases[1:])
+    assert metrics.phase_seconds.count(("ttfb",)) == 5
+    assert metrics.phase_seconds.count(("connect",)) == 1
+
+
+def test_queue_runner_no_trace(local_server):
+    action = AiohttpAction(
+        AiohttpRequest(method="get", url=f"{local_server.base_url}/get")
+    )
+    do_queue_runner([action], [AiohttpQueueWorker()])
+    assert set(action.timings.phases()) == {"queue_wait", "callbacks", "total"}
@@ -0,0 +1,102 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from pfmsoft.aiohttp_queue import (
+    ActionCallbacks,
+    ActionState,
+    AiohttpAction,
+    AiohttpRequest,
+)
+from pfmsoft.aiohttp_queue import callbacks as AC
+from pfmsoft.aiohttp_queue.json_stream import CollectJsonArrayItems
+from pfmsoft.aiohttp_queue.runners import do_single_action_runner
+from pfmsoft.aiohttp_queue.transforms import Projection
+
+
+def is_even(row):
+    return row["id"] % 2 == 0
+
+
+def first_value(row):
+    return row["nested"]["values"][0]
+
+
+def even_projection() -> Projection:
+    return Projection(
+        fields=["id", "missing"],
+        renames={"id": "item_id"},
+        filters=[is_even],
+        computed={"first": first_value},
+    )
+
+
+def test_projection():
+    projection = even_projection()
+    row = {"id": 2, "name": "two", "nested": {"values": [7]}}
+    assert projection.apply(row) == {"item_id": 2, "missing": None, "first": 7}
+    assert projection.apply({"id": 3, "nested": {"values": [7]}}) is None
+    assert Projection(renames={"id": "key"}).apply(row) == {
+        "key": 2,
+        "name": "two",
+        "nested": {"values": [7]},
+    }
+    assert projection.apply_result("text") == "text"
+
+
+def test_decode_with_projection(local_server):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        action = AiohttpAction(
+            aiohttp_args=AiohttpRequest(
+                method="get", url=f"{local_server.base_url}/list-of-dicts/10"
+            ),
+            callbacks=ActionCallbacks(
+                success=[
+                    AC.ResponseContentToJson(
+                        executor=executor, projection=even_projection()
+                    )
+                ]
+            ),
+        )
+        do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    assert [row["item_id"] for row in action.response_data] == [0, 2, 4, 6, 8]
+    assert action.response_data[1] == {"item_id": 2, "missing": None, "first": 2}
+
+
+def test_stream_with_projection(local_server):
+    action = AiohttpAction(
+        aiohttp_args=AiohttpRequest(
+            method="get", url=f"{local_server.base_url}/json-array/100"
+        ),
+        callbacks=ActionCallbacks(
+            success=[
+                AC.StreamJsonArrayToHandlers(
+                    [CollectJsonArrayItems()], projection=even_projection()
+                )
+            ]
+        ),
+    )
+    do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    assert action.context["pfmsoft_item_count"] == 100
+    assert len(action.response_data) == 50
+    assert set(action.response_data[0]) == {"item_id", "missing", "first"}
+
+
+def test_project_result_then_csv(local_server, test_app_data_dir):
+    file_path: Path = test_app_data_dir / Path("transforms/projected.csv")
+    action = AiohttpAction(
+        aiohttp_args=AiohttpRequest(
+            method="get", url=f"{local_server.base_url}/list-of-dicts/4"
+        ),
+        callbacks=ActionCallbacks(
+            success=[
+                AC.ResponseContentToJson(),
+                AC.ProjectResult(Projection(fields=["id", "name"])),
+                AC.SaveListOfDictResultToCSVFile(file_path=file_path),
+            ]
+        ),
+    )
+    do_single_action_runner(action)
+    assert action.state == ActionState.SUCCESS
+    assert file_path.read_text().splitlines()[0] == "id,name"
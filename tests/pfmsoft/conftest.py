@@ -7,6 +7,7 @@ from pathlib import Path
 
 import pytest
 from rich import inspect
+from tests.pfmsoft.aiohttp_queue.local_server import LocalServer
 
 APP_LOG_LEVEL = logging.INFO
 
@@ -58,6 +59,15 @@ def test_app_data_dir_(tmp_path_factory):
     return test_app_data_dir
 
 
+@pytest.fixture(scope="session", name="local_server")
+def local_server_():
+    """An in-process aiohttp server, for tests that should not need the network."""
+    server = LocalServer()
+    server.start()
+    yield server
+    server.stop()
+
+
 @pytest.fixture(scope="session")
 def example_resource(logger: logging.Logger) -> dict:
     """Load a resource file from a package directory."""